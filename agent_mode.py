@@ -1,15 +1,27 @@
 """Agent mode for autonomous multi-step research"""
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
 import re
+import time
+import threading
+from tracing import span, traced
 
 class ResearchAgent:
-    def __init__(self, search_engine, ai_processor):
+    def __init__(self, search_engine, ai_processor, max_depth: int = 3, max_concurrency: int = 4,
+                 time_budget: Optional[float] = None, token_budget: Optional[int] = None, model: str = "gpt-4o-mini"):
         self.search_engine = search_engine
         self.ai_processor = ai_processor
         self.research_depth = 0
-        self.max_depth = 3
+        self.max_depth = max_depth
+        self.max_concurrency = max_concurrency
+        self.time_budget = time_budget  # seconds
+        self.token_budget = token_budget  # estimated prompt + completion tokens
+        self.model = model
         self.context_history = []
+        self.tokens_used = 0
+        self._deadline = None
+        self._tokens_lock = threading.Lock()
     
     def should_deep_research(self, query: str, initial_results: List[Dict]) -> bool:
         """Decide if we need to do deeper research"""
@@ -51,49 +63,131 @@ class ResearchAgent:
         
         return followups[:3]  # Return top 3 follow-ups
     
-    def autonomous_research(self, initial_query: str, depth: int = 0) -> Dict[str, Any]:
-        """Perform autonomous multi-step research"""
+    def _budget_exhausted(self) -> Optional[str]:
+        """Return the reason research must stop, if any budget is spent"""
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            return "Time budget exhausted"
+        if self.token_budget is not None and self.tokens_used >= self.token_budget:
+            return "Token budget exhausted"
+        return None
+    
+    @traced("agent_node")
+    def _research_node(self, query: str, depth: int, results: Optional[List[Dict]] = None, response: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Search one query and, if it is not a leaf, synthesize an answer and its
+        follow-ups; a response already generated for these results is reused
+        """
+        if results is None:
+            results = self.search_engine.search(query, num_results=5 if depth == 0 else 3)
+        
+        node = {"query": query, "depth": depth, "results": results, "response": "", "followups": []}
+        
+        # Leaves are only searched; synthesis is what drives the next level
+        if depth >= self.max_depth - 1 or self._budget_exhausted():
+            return node
+        if not self.should_deep_research(query, results):
+            return node
+        
+        ai_response = response or ""
+        if not ai_response:
+            for chunk in self.ai_processor.generate_response_with_citations_stream(query, results, self.model):
+                ai_response += chunk
+        
+        # Rough local estimate (~4 characters per token) of the prompt and completion
+        prompt_chars = sum(len(r.get('title', '')) + len(r.get('snippet', '')) for r in results)
+        with self._tokens_lock:
+            self.tokens_used += (prompt_chars + len(ai_response)) // 4
+        
+        node["response"] = ai_response
+        node["followups"] = self.generate_followup_queries(query, results, ai_response)
+        return node
+    
+    @traced("agent_research")
+    def autonomous_research(self, initial_query: str, depth: int = 0, initial_results: Optional[List[Dict]] = None,
+                            initial_response: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Perform autonomous multi-step research breadth-first: every query of a
+        depth level is researched concurrently before the next level is expanded.
+        Pass the answer already shown for initial_results as initial_response so
+        the root is not synthesized a second time.
+        """
         if depth >= self.max_depth:
             return {"complete": True, "reason": "Max research depth reached"}
         
-        # Initial search
-        results = self.search_engine.search(initial_query, num_results=5)
+        started = time.monotonic()
+        self._deadline = started + self.time_budget if self.time_budget is not None else None
+        # Budgets and history are per query; one agent serves a whole interactive session
+        with self._tokens_lock:
+            self.tokens_used = 0
+        self.context_history = []
+        
+        # The root is researched on its own so its search errors reach the caller
+        root = self._research_node(initial_query, depth, initial_results, initial_response)
+        if root["response"]:
+            self.context_history.append({"query": initial_query, "response": root["response"], "depth": depth})
         
-        # Check if we need deeper research
-        if not self.should_deep_research(initial_query, results):
+        if not root["followups"]:
             return {
-                "complete": True, 
-                "reason": "Sufficient information found",
-                "results": results
+                "complete": True,
+                "reason": self._budget_exhausted() or "Sufficient information found",
+                "results": root["results"],
+                "depth": depth,
+                "tokens_used": self.tokens_used,
+                "elapsed": time.monotonic() - started
             }
         
-        # Generate AI response
-        ai_response = ""
-        for chunk in self.ai_processor.generate_response_with_citations_stream(
-            initial_query, results
-        ):
-            ai_response += chunk
+        seen = {initial_query.lower()}
+        frontier = []
+        for followup in root["followups"]:
+            if followup.lower() not in seen:
+                seen.add(followup.lower())
+                frontier.append(followup)
         
-        # Store context
-        self.context_history.append({
-            "query": initial_query,
-            "response": ai_response,
-            "depth": depth
-        })
-        
-        # Generate follow-up queries
-        followups = self.generate_followup_queries(initial_query, results, ai_response)
-        
-        # Research follow-ups
+        followup_queries = []
         additional_context = []
-        for followup in followups:
-            sub_results = self.search_engine.search(followup, num_results=3)
-            additional_context.extend(sub_results)
+        reason = "Max research depth reached"
+        level = depth
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while frontier:
+                exhausted = self._budget_exhausted()
+                if exhausted:
+                    reason = exhausted
+                    break
+                
+                level += 1
+                self.research_depth = level
+                next_frontier = []
+                with span("agent_level", depth=level, queries=len(frontier)):
+                    futures = [executor.submit(self._research_node, query, level) for query in frontier]
+                    for query, future in zip(frontier, futures):
+                        try:
+                            node = future.result()
+                        except Exception:
+                            # A failed follow-up search only loses that branch
+                            continue
+                        
+                        followup_queries.append(query)
+                        additional_context.extend(node["results"])
+                        if node["response"]:
+                            self.context_history.append({"query": query, "response": node["response"], "depth": level})
+                        
+                        for followup in node["followups"]:
+                            if followup.lower() not in seen:
+                                seen.add(followup.lower())
+                                next_frontier.append(followup)
+                
+                frontier = next_frontier
+            else:
+                reason = "Max research depth reached" if level >= self.max_depth - 1 else "Sufficient information found"
         
         return {
-            "complete": False,
-            "followup_queries": followups,
+            "complete": True,
+            "reason": reason,
+            "results": root["results"],
+            "followup_queries": followup_queries,
             "additional_context": additional_context,
-            "depth": depth,
-            "should_continue": depth < self.max_depth - 1
-        }
\ No newline at end of file
+            "depth": level,
+            "tokens_used": self.tokens_used,
+            "elapsed": time.monotonic() - started
+        }
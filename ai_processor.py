@@ -1,62 +1,114 @@
 import os
-from typing import List, Dict, Any, Tuple
-from openai import OpenAI
+import threading
+import time
+from typing import List, Dict, Any, Tuple, Optional
 import re
+from context_packer import ContextPacker, estimate_tokens
+from domain_reputation import DomainReputation
+from resilience import Resilience, RetryPolicy, CircuitBreaker, is_retryable
+from rate_limiter import TokenBucket
+from tracing import span
+
+# Prefix of the placeholder returned when follow-up generation fails
+FOLLOW_UP_ERROR_PREFIX = "Error generating follow-up questions"
+
+# (connect, read) timeouts in seconds for OpenAI requests; the read timeout also bounds gaps in a stream
+DEFAULT_TIMEOUT = (5.0, 60.0)
 
 class AIProcessor:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key: str, context_budget: int = 1500, max_answer_tokens: int = 1000,
+                 domain_reputation: Optional[DomainReputation] = None, base_url: Optional[str] = None,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT, retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None, rate_limiter: Optional[TokenBucket] = None,
+                 token_limiter: Optional[TokenBucket] = None):
+        self.api_key = api_key
+        # None uses the openai default (or OPENAI_BASE_URL); set to target any compatible server
+        self.base_url = base_url
+        self.domain_reputation = domain_reputation if domain_reputation is not None else DomainReputation()
+        # Search results are packed into at most context_budget estimated prompt tokens
+        self.context_packer = ContextPacker(max_tokens=context_budget)
+        self.max_answer_tokens = max_answer_tokens
+        self.timeout = timeout
+        # Retries happen here rather than inside the openai client, so they count toward the circuit breaker
+        self.resilience = Resilience("OpenAI", retry_policy, circuit_breaker)
+        # Client-side quota: requests, and prompt plus max_tokens per request, as OpenAI counts them
+        self.rate_limiter = rate_limiter
+        self.token_limiter = token_limiter
+        self._client = None
+        self._client_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        """The OpenAI client, created on first use so that fully cached queries never import openai"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._create_client()
+        return self._client
+    
+    def _create_client(self):
+        from openai import OpenAI
+        return OpenAI(**self._client_options())
+    
+    def _client_options(self) -> Dict[str, Any]:
+        import httpx
+        connect_timeout, read_timeout = self.timeout
+        return {
+            'api_key': self.api_key,
+            'base_url': self.base_url,
+            'timeout': httpx.Timeout(read_timeout, connect=connect_timeout),
+            'max_retries': 0
+        }
+    
+    def _throttle(self, messages: List[Dict[str, str]], max_tokens: int) -> float:
+        """Reserve request and token quota for one completion; returns the seconds to wait before sending it"""
+        wait = 0.0
+        if self.rate_limiter:
+            wait = self.rate_limiter.reserve()
+        if self.token_limiter:
+            tokens = sum(estimate_tokens(message['content']) for message in messages) + max_tokens
+            wait = max(wait, self.token_limiter.reserve(tokens))
+        return wait
+    
+    def _create_completion(self, **kwargs):
+        """One chat completion request, once the rate limits allow it"""
+        wait = self._throttle(kwargs['messages'], kwargs['max_tokens'])
+        if wait > 0:
+            with span("rate_limit_wait", backend="openai"):
+                time.sleep(wait)
+        # For a stream this ends when the response headers arrive, before the first token
+        with span("openai_request", model=kwargs['model'], stream=bool(kwargs.get('stream'))):
+            return self.client.chat.completions.create(**kwargs)
     
     def score_source_quality(self, source: Dict[str, Any]) -> float:
         """Score source quality based on various factors"""
-        score = 0.5  # Base score
-        
+        return self.score_sources([source])[0]
+    
+    def score_sources(self, sources: List[Dict[str, Any]]) -> List[float]:
+        """Score a whole result list, looking each distinct URL's domain up once"""
         # Domain authority scoring
-        trusted_domains = ['.gov', '.edu', '.org', 'wikipedia.org', 'reuters.com', 
-                          'apnews.com', 'bbc.com', 'nytimes.com', 'nature.com']
-        domain = source.get('link', '').lower()
-        for trusted in trusted_domains:
-            if trusted in domain:
-                score += 0.3
-                break
-        
-        # Recency scoring
-        if source.get('date'):
-            score += 0.1
+        domain_scores = self.domain_reputation.score_urls(source.get('link', '') for source in sources)
         
-        # Content relevance (longer snippets usually more informative)
-        snippet_length = len(source.get('snippet', ''))
-        if snippet_length > 150:
-            score += 0.1
-        
-        return min(score, 1.0)
+        scores = []
+        for source, domain_score in zip(sources, domain_scores):
+            score = 0.5 + domain_score  # Base score
+            
+            # Recency scoring
+            if source.get('date'):
+                score += 0.1
+            
+            # Content relevance (longer snippets usually more informative)
+            if len(source.get('snippet', '')) > 150:
+                score += 0.1
+            
+            scores.append(min(max(score, 0.0), 1.0))
+        return scores
     
-    def generate_response_with_citations_stream(self, query: str, search_results: List[Dict[str, Any]], model: str = "gpt-4o-mini"):
-        """
-        Generate an AI response based on search results with citations, streaming the output.
-        """
-        # Score and sort search results by quality
-        scored_results = []
-        for result in search_results:
-            score = self.score_source_quality(result)
-            scored_results.append({**result, 'quality_score': score})
-        
-        # Sort by quality score descending
-        scored_results.sort(key=lambda x: x['quality_score'], reverse=True)
-        
-        # Create context from search results with quality indicators
-        context_parts = []
-        for result in scored_results:
-            quality_indicator = "⭐" if result['quality_score'] > 0.7 else ""
-            context_parts.append(
-                f"[{result['index']}] {result['title']} {quality_indicator}\n"
-                f"Source: {result['source']}\n"
-                f"Content: {result['snippet']}\n"
-                f"URL: {result['link']}\n"
-                f"Quality Score: {result['quality_score']:.2f}\n"
-            )
-        
-        context = "\n".join(context_parts)
+    def _build_citation_messages(self, query: str, search_results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Build the chat messages asking for a cited answer from the search results"""
+        # Score results; the packer keeps the best ones that fit the context budget
+        scores = self.score_sources(search_results)
+        scored_results = [{**result, 'quality_score': score} for result, score in zip(search_results, scores)]
+        context = self.context_packer.pack(scored_results)['context']
         
         system_prompt = """You are a helpful AI assistant that provides comprehensive answers based on search results. 
         You must cite your sources using [number] format inline with your response.
@@ -73,29 +125,41 @@ Search Results:
 Please provide a comprehensive answer to the query based on these search results. 
 Include inline citations [1], [2], etc. when referencing specific information from the search results.
 Make sure to synthesize information from multiple sources when relevant."""
-
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def generate_response_with_citations_stream(self, query: str, search_results: List[Dict[str, Any]], model: str = "gpt-4o-mini"):
+        """
+        Generate an AI response based on search results with citations, streaming the output.
+        Failures raise rather than being mixed into the answer text.
+        """
+        with span("prompt_build"):
+            messages = self._build_citation_messages(query, search_results)
+        
+        response_stream = self.resilience.call(
+            self._create_completion,
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=self.max_answer_tokens,
+            stream=True
+        )
+        
         try:
-            response_stream = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000,
-                stream=True
-            )
-            
             for chunk in response_stream:
                 if chunk.choices[0].delta.content is not None:
                     yield chunk.choices[0].delta.content
         except Exception as e:
-            yield f"\n[bold red]Error calling OpenAI API: {e}[/bold red]"
+            # Chunks may already be shown, so a broken stream is not retried, only counted
+            if is_retryable(e):
+                self.resilience.circuit_breaker.record_failure(e)
+            raise
 
-    def generate_follow_up_questions(self, query: str, search_results: List[Dict[str, Any]], model: str = "gpt-4o-mini") -> List[str]:
-        """
-        Generate a list of relevant follow-up questions.
-        """
+    def _build_follow_up_messages(self, query: str, search_results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Build the chat messages asking for follow-up questions"""
         context = "\n".join([f"[{res['index']}] {res['snippet']}" for res in search_results])
         
         system_prompt = """You are an AI assistant that generates relevant follow-up questions based on a user's query and the search results. 
@@ -108,21 +172,96 @@ Search Results:
 {context}
 
 Based on the above, what are some relevant follow-up questions?"""
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    def _parse_follow_up_questions(self, content: str) -> List[str]:
+        """Extract the questions from a numbered list"""
+        # Use regex to find numbered list items
+        questions = re.findall(r'\d+\.\s*(.*?)(?=\n\d+\.|$)', content, re.DOTALL)
+        return [q.strip() for q in questions]
+    
+    def generate_follow_up_questions(self, query: str, search_results: List[Dict[str, Any]], model: str = "gpt-4o-mini") -> List[str]:
+        """
+        Generate a list of relevant follow-up questions.
+        """
+        messages = self._build_follow_up_messages(query, search_results)
+        
+        with span("follow_up_questions"):
+            try:
+                response = self.resilience.call(
+                    self._create_completion,
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=200
+                )
+                
+                return self._parse_follow_up_questions(response.choices[0].message.content)
+            except Exception as e:
+                return [f"{FOLLOW_UP_ERROR_PREFIX}: {e}"]
 
+class AsyncAIProcessor(AIProcessor):
+    """AIProcessor variant built on AsyncOpenAI for use inside an event loop"""
+    
+    def _create_client(self):
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(**self._client_options())
+    
+    async def _create_completion(self, **kwargs):
+        import asyncio
+        
+        # Reserving quota may wait on a shared SQLite bucket, so it runs off the event loop
+        wait = await asyncio.to_thread(self._throttle, kwargs['messages'], kwargs['max_tokens'])
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return await self.client.chat.completions.create(**kwargs)
+    
+    async def generate_response_with_citations_stream(self, query: str, search_results: List[Dict[str, Any]], model: str = "gpt-4o-mini"):
+        """
+        Generate an AI response based on search results with citations, streaming the output.
+        Failures raise rather than being mixed into the answer text.
+        """
+        with span("prompt_build"):
+            messages = self._build_citation_messages(query, search_results)
+        
+        response_stream = await self.resilience.acall(
+            self._create_completion,
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=self.max_answer_tokens,
+            stream=True
+        )
+        
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=200
-            )
-            
-            content = response.choices[0].message.content
-            # Use regex to find numbered list items
-            questions = re.findall(r'\d+\.\s*(.*?)(?=\n\d+\.|$)', content, re.DOTALL)
-            return [q.strip() for q in questions]
+            async for chunk in response_stream:
+                if chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            return [f"Error generating follow-up questions: {e}"]
+            if is_retryable(e):
+                self.resilience.circuit_breaker.record_failure(e)
+            raise
+    
+    async def generate_follow_up_questions(self, query: str, search_results: List[Dict[str, Any]], model: str = "gpt-4o-mini") -> List[str]:
+        """
+        Generate a list of relevant follow-up questions.
+        """
+        messages = self._build_follow_up_messages(query, search_results)
+        
+        with span("follow_up_questions"):
+            try:
+                response = await self.resilience.acall(
+                    self._create_completion,
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=200
+                )
+                
+                return self._parse_follow_up_questions(response.choices[0].message.content)
+            except Exception as e:
+                return [f"{FOLLOW_UP_ERROR_PREFIX}: {e}"]
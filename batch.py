@@ -0,0 +1,60 @@
+"""Batch mode: answer a stream of queries with a worker pool, emitting JSON Lines"""
+
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, Tuple, Dict, Any, Optional, TextIO
+
+from pipeline import answer_query
+from rate_limiter import TokenBucket
+
+def read_queries(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Yield (line_number, query) for each non-empty line"""
+    for line_number, line in enumerate(lines, 1):
+        query = line.strip()
+        if query:
+            yield line_number, query
+
+def run_batch(lines: Iterable[str], num_results: int, model: str, search_engine, ai_processor, cache_manager=None,
+              workers: int = 4, rate: Optional[float] = None, out: TextIO = sys.stdout) -> Dict[str, int]:
+    """
+    Answer every query in lines and write one JSON object per query to out, in
+    completion order, as soon as each finishes. Input is read lazily so stdin
+    can be streamed.
+    """
+    # No burst: queries start evenly spaced, at most rate per second
+    limiter = TokenBucket("batch", rate, capacity=1.0) if rate else None
+    stats = {'succeeded': 0, 'failed': 0}
+    out_lock = threading.Lock()
+    
+    def process(line_number: int, query: str) -> Dict[str, Any]:
+        if limiter:
+            limiter.acquire()
+        try:
+            result = answer_query(query, num_results, model, search_engine, ai_processor, cache_manager)
+            del result['search_results']
+            return {'line': line_number, **result}
+        except Exception as e:
+            return {'line': line_number, 'query': query, 'error': str(e)}
+    
+    def emit(future) -> None:
+        # Runs on the worker that finished, so output does not wait for the next input line
+        record = future.result()
+        with out_lock:
+            stats['failed' if 'error' in record else 'succeeded'] += 1
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    
+    # Leaving the block waits for every query, and with it every emit
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for line_number, query in read_queries(lines):
+            # Keep a bounded number of queries in flight so huge inputs are not read up front
+            if len(pending) >= workers * 2:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            future = executor.submit(process, line_number, query)
+            future.add_done_callback(emit)
+            pending.add(future)
+    
+    return stats
@@ -0,0 +1,204 @@
+"""Local stand-ins for SerpAPI and the OpenAI chat completions API"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+from urllib.parse import urlsplit, parse_qs
+
+class FakeBackend:
+    """
+    One HTTP server on localhost answering both SerpAPI searches
+    (GET /search.json) and OpenAI chat completions, streamed or not
+    (POST /v1/chat/completions). Every response waits latency ± jitter seconds
+    and fails with probability error_rate; streamed answers then emit
+    answer_tokens chunks token_delay seconds apart.
+    """
+    
+    def __init__(self, latency: float = 0.05, jitter: float = 0.01, error_rate: float = 0.0,
+                 token_delay: float = 0.005, answer_tokens: int = 60, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_delay = token_delay
+        self.answer_tokens = answer_tokens
+        self.requests = {'search': 0, 'completion': 0, 'stream': 0, 'error': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+    
+    def __enter__(self) -> "FakeBackend":
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+    
+    def start(self) -> None:
+        backend = self
+        
+        class Handler(_FakeHandler):
+            pass
+        Handler.backend = backend
+        
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    @property
+    def serpapi_url(self) -> str:
+        """Pass as SearchEngine(base_url=...)"""
+        return f"{self.url}/search.json"
+    
+    @property
+    def openai_url(self) -> str:
+        """Pass as AIProcessor(base_url=...)"""
+        return f"{self.url}/v1"
+    
+    def count(self, kind: str) -> None:
+        with self._lock:
+            self.requests[kind] += 1
+    
+    def delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+    
+    def should_fail(self) -> bool:
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            self.count('error')
+        return failed
+    
+    def reset_counts(self) -> None:
+        with self._lock:
+            for kind in self.requests:
+                self.requests[kind] = 0
+
+def fake_search_results(query: str, num: int) -> Dict[str, Any]:
+    """A SerpAPI-shaped response whose links and snippets depend on the query"""
+    slug = re.sub(r'\W+', '-', query.lower()).strip('-') or 'query'
+    return {
+        'search_metadata': {'status': 'Success'},
+        'organic_results': [
+            {
+                'position': rank,
+                'title': f"{query} - result {rank}",
+                'link': f"https://site{rank}.example.com/{slug}",
+                'source': f"site{rank}.example.com",
+                'snippet': f"Result {rank} explains {query} in detail, covering the background, how it works "
+                           f"and the trade-offs practitioners run into. " * 2,
+                'date': '2024-01-01' if rank % 2 else ''
+            }
+            for rank in range(1, num + 1)
+        ]
+    }
+
+def fake_answer_tokens(count: int) -> List[str]:
+    """Tokens of a cited answer, roughly the size of a real one"""
+    words = ["The", " sources", " agree", " on", " the", " main", " points", " [1].", " Further",
+             " detail", " is", " given", " by", " another", " source", " [2].", "\n"]
+    return [words[i % len(words)] for i in range(count)]
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    backend = None
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args) -> None:
+        pass
+    
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path != '/search.json':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        
+        self.backend.count('search')
+        params = parse_qs(parts.query)
+        time.sleep(self.backend.delay())
+        if self.backend.should_fail():
+            self._send_json(500, {'error': 'Injected search failure'})
+            return
+        self._send_json(200, fake_search_results(params.get('q', [''])[0], int(params.get('num', ['10'])[0])))
+    
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if urlsplit(self.path).path != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+            return
+        
+        model = body.get('model', 'gpt-4o-mini')
+        self.backend.count('stream' if body.get('stream') else 'completion')
+        # Latency before the first token, as with a real completion
+        time.sleep(self.backend.delay())
+        if self.backend.should_fail():
+            self._send_json(500, {'error': {'message': 'Injected completion failure', 'type': 'server_error'}})
+            return
+        
+        if body.get('stream'):
+            self._stream_completion(model)
+        else:
+            content = "1. What are the alternatives?\n2. How has this changed recently?\n3. Where is it used in practice?"
+            self._send_json(200, {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+            })
+    
+    def _stream_completion(self, model: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # The stream is delimited by closing the connection
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        
+        def chunk(delta: Dict[str, Any], finish_reason=None) -> bytes:
+            payload = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            return f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+        
+        try:
+            self.wfile.write(chunk({'role': 'assistant', 'content': ''}))
+            for token in fake_answer_tokens(self.backend.answer_tokens):
+                self.wfile.write(chunk({'content': token}))
+                self.wfile.flush()
+                time.sleep(self.backend.token_delay)
+            self.wfile.write(chunk({}, finish_reason='stop'))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for Perplexity CLI against local fake SerpAPI/OpenAI servers.
+
+    python benchmarks/run_benchmarks.py                      # run and save JSON results
+    python benchmarks/run_benchmarks.py --compare old.json   # also report regressions
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List
+
+# Run from anywhere: the modules under test live in the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.fake_servers import FakeBackend
+from search_engine import SearchEngine
+from ai_processor import AIProcessor
+from cache_manager import CacheManager
+from agent_mode import ResearchAgent
+from pipeline import query_events
+from batch import run_batch
+
+MODEL = "gpt-4o-mini"
+QUERIES = [
+    "how does tcp congestion control work",
+    "python asyncio event loop internals",
+    "compare postgres and mysql replication",
+    "what is a bloom filter",
+    "rust ownership model explained",
+    "how do vaccines train the immune system",
+]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summary statistics of a list of measurements"""
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'min': ordered[0],
+        'max': ordered[-1]
+    }
+
+def make_clients(backend: FakeBackend):
+    search_engine = SearchEngine("fake-serpapi-key", base_url=backend.serpapi_url)
+    ai_processor = AIProcessor("fake-openai-key", base_url=backend.openai_url)
+    return search_engine, ai_processor
+
+def fresh_cache() -> CacheManager:
+    return CacheManager(cache_dir=tempfile.mkdtemp(prefix="perplexity-bench-"))
+
+def run_process_query(query: str, search_engine, ai_processor, cache_manager) -> None:
+    """End-to-end interactive path with the terminal output discarded"""
+    import cli
+    from rich.console import Console
+    cli._console = Console(file=io.StringIO(), width=120)
+    cli.process_query(query, 5, MODEL, search_engine, ai_processor, cache_manager)
+
+def timed(fn: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+def bench_end_to_end(backend: FakeBackend, repeat: int) -> Dict[str, Any]:
+    """process_query latency on a cache miss and on a full cache hit"""
+    search_engine, ai_processor = make_clients(backend)
+    misses, hits = [], []
+    for i in range(repeat):
+        cache = fresh_cache()
+        query = QUERIES[i % len(QUERIES)]
+        misses.append(timed(lambda: run_process_query(query, search_engine, ai_processor, cache)))
+        hits.append(timed(lambda: run_process_query(query, search_engine, ai_processor, cache)))
+    return {'cache_miss': summarize(misses), 'cache_hit': summarize(hits)}
+
+def bench_first_token(backend: FakeBackend, repeat: int) -> Dict[str, Any]:
+    """Time to first answer token when generating, and when replaying from the cache"""
+    search_engine, ai_processor = make_clients(backend)
+    metrics = {'fresh_ttft': [], 'fresh_total': [], 'replay_ttft': [], 'replay_total': []}
+    for i in range(repeat):
+        cache = fresh_cache()
+        query = QUERIES[i % len(QUERIES)]
+        for prefix in ('fresh', 'replay'):
+            timing = {}
+            for event in query_events(query, 5, MODEL, search_engine, ai_processor, cache):
+                if event['event'] == 'timing':
+                    timing = event
+            if 'time_to_first_token' in timing:
+                metrics[f'{prefix}_ttft'].append(timing['time_to_first_token'])
+            metrics[f'{prefix}_total'].append(timing.get('total', 0.0))
+    return {name: summarize(samples) for name, samples in metrics.items() if samples}
+
+def bench_agent(backend: FakeBackend, repeat: int, concurrency: int) -> Dict[str, Any]:
+    """Breadth-first agent research: wall time and how many requests it fans out to"""
+    search_engine, ai_processor = make_clients(backend)
+    elapsed, searches = [], []
+    for i in range(repeat):
+        backend.reset_counts()
+        agent = ResearchAgent(search_engine, ai_processor, max_depth=3, max_concurrency=concurrency, model=MODEL)
+        elapsed.append(timed(lambda: agent.autonomous_research(f"how does {QUERIES[i % len(QUERIES)]} compare")))
+        searches.append(float(backend.requests['search']))
+    return {'elapsed': summarize(elapsed), 'searches': summarize(searches), 'concurrency': concurrency}
+
+def bench_batch(backend: FakeBackend, queries: int, workers: int) -> Dict[str, Any]:
+    """Batch mode throughput on distinct, uncached queries"""
+    search_engine, ai_processor = make_clients(backend)
+    lines = [f"{QUERIES[i % len(QUERIES)]} variant {i}" for i in range(queries)]
+    out = io.StringIO()
+    started = time.perf_counter()
+    stats = run_batch(lines, 5, MODEL, search_engine, ai_processor, fresh_cache(), workers=workers, out=out)
+    elapsed = time.perf_counter() - started
+    return {
+        'elapsed': elapsed,
+        'queries_per_second': queries / elapsed,
+        'succeeded': stats['succeeded'],
+        'failed': stats['failed'],
+        'workers': workers
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every latency p50 that got slower, or throughput that dropped, by more than tolerance"""
+    regressions = []
+    for scenario, metrics in results['scenarios'].items():
+        for metric, value in metrics.items():
+            old = baseline.get('scenarios', {}).get(scenario, {}).get(metric)
+            if metric == 'searches' and isinstance(old, dict):
+                # A count, not a latency: report changes in fan-out without judging them
+                print(f"{scenario}.{metric} p50: {old['p50']:.0f} -> {value['p50']:.0f}")
+            elif isinstance(value, dict) and isinstance(old, dict) and old.get('p50'):
+                change = value['p50'] / old['p50'] - 1
+                line = f"{scenario}.{metric} p50: {old['p50'] * 1000:.1f}ms -> {value['p50'] * 1000:.1f}ms ({change:+.0%})"
+                if change > tolerance:
+                    regressions.append(line)
+                print(line)
+            elif metric == 'queries_per_second' and old:
+                change = value / old - 1
+                line = f"{scenario}.{metric}: {old:.2f} -> {value:.2f} ({change:+.0%})"
+                if change < -tolerance:
+                    regressions.append(line)
+                print(line)
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Perplexity CLI against local fake SerpAPI/OpenAI servers")
+    parser.add_argument('--repeat', type=int, default=5, help='Samples per latency scenario')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Uniform jitter added to the latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability that a fake request fails')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='Seconds between streamed answer tokens')
+    parser.add_argument('--batch-queries', type=int, default=24, help='Queries in the batch throughput scenario')
+    parser.add_argument('--workers', type=int, default=4, help='Batch workers and agent concurrency')
+    parser.add_argument('--scenarios', default='end_to_end,first_token,agent,batch', help='Comma-separated scenarios to run')
+    parser.add_argument('--output', default=None, help='Results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', default=None, help='Baseline results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Slowdown fraction reported as a regression')
+    args = parser.parse_args()
+    
+    selected = set(args.scenarios.split(','))
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+        },
+        'scenarios': {}
+    }
+    
+    with FakeBackend(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, token_delay=args.token_delay) as backend:
+        runners = {
+            'end_to_end': lambda: bench_end_to_end(backend, args.repeat),
+            'first_token': lambda: bench_first_token(backend, args.repeat),
+            'agent': lambda: bench_agent(backend, args.repeat, args.workers),
+            'batch': lambda: bench_batch(backend, args.batch_queries, args.workers),
+        }
+        for name, runner in runners.items():
+            if name in selected:
+                print(f"Running {name}...", file=sys.stderr)
+                results['scenarios'][name] = runner()
+    
+    output = args.output or os.path.join(REPO_DIR, 'benchmarks', 'results', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results['scenarios'], indent=2))
+    print(f"Results saved to {output}", file=sys.stderr)
+    
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
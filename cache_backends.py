@@ -0,0 +1,199 @@
+"""Storage backends for CacheManager"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+class CacheBackend(ABC):
+    """Interface for cache storage; timestamps are Unix epoch seconds"""
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        """Return (timestamp, data) for a key, or None if missing or unreadable"""
+    
+    @abstractmethod
+    def set(self, key: str, cache_type: str, timestamp: float, data: Any) -> None:
+        """Store data under a key, replacing any previous entry"""
+    
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a single entry"""
+    
+    @abstractmethod
+    def purge_expired(self, cutoff: float) -> int:
+        """Remove entries written before cutoff and return how many were removed"""
+    
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove all entries"""
+    
+    def acquire_lock(self, key: str, owner: str, expires: float) -> bool:
+        """
+        Claim a key until expires unless another owner holds an unexpired claim.
+        Backends that cannot share locks between processes always grant it.
+        """
+        return True
+    
+    def release_lock(self, key: str, owner: str) -> None:
+        """Drop a claim made by owner"""
+        pass
+    
+    def lock_held(self, key: str) -> bool:
+        """Whether any owner holds an unexpired claim on a key"""
+        return False
+    
+    def close(self) -> None:
+        """Release any resources held by the backend"""
+        pass
+
+class JSONFileBackend(CacheBackend):
+    """Legacy backend storing one JSON file per entry"""
+    
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def _get_cache_path(self, key: str) -> str:
+        """Get the file path for a cache key"""
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        cache_path = self._get_cache_path(key)
+        if not os.path.exists(cache_path):
+            return None
+        
+        try:
+            with open(cache_path, 'r') as f:
+                cached_data = json.load(f)
+            return datetime.fromisoformat(cached_data['timestamp']).timestamp(), cached_data['data']
+        except (json.JSONDecodeError, KeyError, ValueError):
+            # Invalid cache file, remove it
+            self.delete(key)
+            return None
+    
+    def set(self, key: str, cache_type: str, timestamp: float, data: Any) -> None:
+        cache_data = {
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'type': cache_type,
+            'data': data
+        }
+        
+        with open(self._get_cache_path(key), 'w') as f:
+            json.dump(cache_data, f, indent=2)
+    
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._get_cache_path(key))
+        except FileNotFoundError:
+            pass
+    
+    def purge_expired(self, cutoff: float) -> int:
+        removed = 0
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.json'):
+                key = filename[:-len('.json')]
+                entry = self.get(key)
+                if entry is None or entry[0] < cutoff:
+                    self.delete(key)
+                    removed += 1
+        return removed
+    
+    def clear(self) -> None:
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+class SQLiteBackend(CacheBackend):
+    """
+    Single-file SQLite backend in WAL mode. Readers never block the writer, so
+    several CLI processes can share one cache directory safely.
+    """
+    
+    def __init__(self, db_path: str, busy_timeout: float = 30.0):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        
+        # Autocommit mode; the lock serializes threads sharing this connection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    payload BLOB NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_timestamp ON cache (timestamp)")
+            # Claims on entries being computed, so processes sharing the file compute each entry once
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS locks (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+    
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT timestamp, payload FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        
+        try:
+            return row[0], json.loads(row[1])
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.delete(key)
+            return None
+    
+    def set(self, key: str, cache_type: str, timestamp: float, data: Any) -> None:
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, type, timestamp, payload) VALUES (?, ?, ?, ?)",
+                (key, cache_type, timestamp, payload)
+            )
+    
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+    
+    def purge_expired(self, cutoff: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM cache WHERE timestamp < ?", (cutoff,)).rowcount
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            # Give the freed pages back to the filesystem
+            self._conn.execute("VACUUM")
+    
+    def acquire_lock(self, key: str, owner: str, expires: float) -> bool:
+        with self._lock:
+            # A claim left behind by a crashed process is taken over once it expires
+            self._conn.execute("DELETE FROM locks WHERE key = ? AND expires < ?", (key, time.time()))
+            return self._conn.execute(
+                "INSERT OR IGNORE INTO locks (key, owner, expires) VALUES (?, ?, ?)",
+                (key, owner, expires)
+            ).rowcount == 1
+    
+    def release_lock(self, key: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+    
+    def lock_held(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM locks WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+        return row is not None
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,65 +1,295 @@
-import json
 import hashlib
+import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable
+from cache_backends import CacheBackend, SQLiteBackend
+from page_cache import PageCache
+from query_optimizer import normalize_query
+from semantic_cache import SemanticCache
+
+class LRUCache:
+    """
+    Bounded in-process cache that evicts the least recently used entries once
+    either the entry count or the approximate payload size budget is exceeded
+    """
+    
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (timestamp, data, size)
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        """Return (timestamp, data) and mark the entry as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+    
+    def set(self, key: str, timestamp: float, data: Any, size: int) -> None:
+        """Insert or replace an entry, evicting old entries to stay within budget"""
+        with self._lock:
+            self._remove(key)
+            # An entry larger than the whole budget would only evict everything else
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            
+            self._entries[key] = (timestamp, data, size)
+            self.current_bytes += size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+    
+    def delete(self, key: str) -> None:
+        """Remove a single entry"""
+        with self._lock:
+            self._remove(key)
+    
+    def clear(self) -> None:
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+    
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring the memory tier"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes
+            }
 
 class CacheManager:
-    def __init__(self, cache_dir: str = ".cache", ttl_hours: int = 24):
+    def __init__(self, cache_dir: str = ".cache", ttl_hours: int = 24, backend: Optional[CacheBackend] = None,
+                 memory_entries: int = 256, memory_bytes: int = 32 * 1024 * 1024, stale_ttl_hours: Optional[int] = None,
+                 lock_ttl: float = 120.0, semantic_threshold: Optional[float] = None,
+                 page_cache_bytes: int = 256 * 1024 * 1024):
         self.cache_dir = cache_dir
+        # Entries are fresh for ttl_hours, then stale (still servable) until stale_ttl_hours
         self.ttl_hours = ttl_hours
-        os.makedirs(cache_dir, exist_ok=True)
+        self.stale_ttl_hours = stale_ttl_hours if stale_ttl_hours is not None else max(ttl_hours, 7 * 24)
+        self.backend = backend or SQLiteBackend(os.path.join(cache_dir, "cache.db"))
+        # Repeated lookups within a session are served from memory; writes go through to the backend
+        self.memory = LRUCache(max_entries=memory_entries, max_bytes=memory_bytes)
+        
+        # Single-flight state: entries this instance is computing, and the claim
+        # owner id other processes see in the backend (expires after lock_ttl seconds)
+        self.lock_ttl = lock_ttl
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self._leases = {}  # cache key -> Event set when the computation ends
+        self._leases_lock = threading.Lock()
+        
+        # Optional index matching near-duplicate queries to answers cached for an earlier phrasing
+        self.semantic = SemanticCache(os.path.join(cache_dir, "semantic_index.jsonl"), threshold=semantic_threshold) if semantic_threshold else None
+        
+        # Fetched result pages, opened on first use since only --fetch-pages needs them
+        self.page_cache_bytes = page_cache_bytes
+        self._pages = None
+        self._pages_lock = threading.Lock()
+        
+        # Reclaim entries that expired without ever being read again
+        self.purge_expired()
     
-    def _get_cache_key(self, query: str, cache_type: str) -> str:
-        """Generate a cache key from query and type"""
-        hash_input = f"{query}:{cache_type}"
+    def _get_cache_key(self, query: str, cache_type: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Generate a cache key from the normalized query, type and result-affecting parameters"""
+        hash_input = json.dumps({
+            'query': normalize_query(query),
+            'type': cache_type,
+            'params': params or {}
+        }, sort_keys=True)
         return hashlib.md5(hash_input.encode()).hexdigest()
     
-    def _get_cache_path(self, cache_key: str) -> str:
-        """Get the file path for a cache key"""
-        return os.path.join(self.cache_dir, f"{cache_key}.json")
+    def _stale_cutoff(self) -> float:
+        """Entries written before this time are stale"""
+        return time.time() - self.ttl_hours * 3600
+    
+    def _expiry_cutoff(self) -> float:
+        """Entries written before this time are expired and never served"""
+        return time.time() - self.stale_ttl_hours * 3600
     
-    def get(self, query: str, cache_type: str) -> Optional[Dict[str, Any]]:
-        """Retrieve cached data if it exists and is not expired"""
-        cache_key = self._get_cache_key(query, cache_type)
-        cache_path = self._get_cache_path(cache_key)
+    def get(self, query: str, cache_type: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Retrieve cached data if it exists and is still fresh"""
+        data, is_stale = self.get_with_staleness(query, cache_type, params)
+        return None if is_stale else data
+    
+    def get_with_staleness(self, query: str, cache_type: str, params: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Retrieve cached data that has not expired, along with whether it is stale
+        (past ttl_hours) and should be refreshed
+        """
+        cache_key = self._get_cache_key(query, cache_type, params)
+        entry = self.memory.get(cache_key)
+        if entry is None:
+            entry = self.backend.get(cache_key)
+            if entry is None:
+                return None, False
+            self.memory.set(cache_key, entry[0], entry[1], self._payload_size(entry[1]))
+        
+        # Check if cache is expired
+        timestamp, data = entry
+        if timestamp <= self._expiry_cutoff():
+            self.memory.delete(cache_key)
+            self.backend.delete(cache_key)
+            return None, False
         
-        if not os.path.exists(cache_path):
-            return None
+        return data, timestamp <= self._stale_cutoff()
+    
+    def set(self, query: str, cache_type: str, data: Dict[str, Any], params: Optional[Dict[str, Any]] = None) -> None:
+        """Store data in cache"""
+        cache_key = self._get_cache_key(query, cache_type, params)
+        timestamp = time.time()
+        self.backend.set(cache_key, cache_type, timestamp, data)
+        self.memory.set(cache_key, timestamp, data, self._payload_size(data))
+    
+    def lease(self, query: str, cache_type: str, params: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Try to become the only caller computing an entry, in this process and in any
+        other process sharing the cache. Callers that get True must call release().
+        """
+        cache_key = self._get_cache_key(query, cache_type, params)
+        with self._leases_lock:
+            if cache_key in self._leases:
+                return False
+            if not self.backend.acquire_lock(cache_key, self._owner, time.time() + self.lock_ttl):
+                return False
+            self._leases[cache_key] = threading.Event()
+        return True
+    
+    def release(self, query: str, cache_type: str, params: Optional[Dict[str, Any]] = None) -> None:
+        """End a lease, whether or not the entry was stored, and wake its waiters"""
+        cache_key = self._get_cache_key(query, cache_type, params)
+        self.backend.release_lock(cache_key, self._owner)
+        with self._leases_lock:
+            event = self._leases.pop(cache_key, None)
+        if event is not None:
+            event.set()
+    
+    def wait_for(self, query: str, cache_type: str, params: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None, poll_interval: float = 0.05) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the current lease holder to store an entry and return it. Returns
+        None if the holder finished without storing it or timeout (lock_ttl by default) passed.
+        """
+        cache_key = self._get_cache_key(query, cache_type, params)
+        deadline = time.monotonic() + (timeout if timeout is not None else self.lock_ttl)
         
-        try:
-            with open(cache_path, 'r') as f:
-                cached_data = json.load(f)
+        while True:
+            with self._leases_lock:
+                event = self._leases.get(cache_key)
+            if event is not None:
+                # Same process: woken as soon as the holder releases
+                event.wait(max(0.0, deadline - time.monotonic()))
+            elif self.backend.lock_held(cache_key):
+                # Another process: poll the shared claim
+                time.sleep(poll_interval)
             
-            # Check if cache is expired
-            cached_time = datetime.fromisoformat(cached_data['timestamp'])
-            if datetime.now() - cached_time > timedelta(hours=self.ttl_hours):
-                os.remove(cache_path)
+            data = self.get(query, cache_type, params)
+            if data is not None:
+                return data
+            if event is None and not self.backend.lock_held(cache_key):
+                return None
+            if time.monotonic() >= deadline:
                 return None
-            
-            return cached_data['data']
-        except (json.JSONDecodeError, KeyError, ValueError):
-            # Invalid cache file, remove it
-            os.remove(cache_path)
-            return None
     
-    def set(self, query: str, cache_type: str, data: Dict[str, Any]) -> None:
-        """Store data in cache"""
-        cache_key = self._get_cache_key(query, cache_type)
-        cache_path = self._get_cache_path(cache_key)
+    def get_or_compute(self, query: str, cache_type: str, compute: Callable[[], Any],
+                       params: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Return a fresh cached entry, or compute and store it. Concurrent callers asking
+        for the same entry wait for the one computation in flight instead of repeating it.
+        """
+        data = self.get(query, cache_type, params)
+        if data is not None:
+            return data
         
-        cache_data = {
-            'timestamp': datetime.now().isoformat(),
-            'query': query,
-            'type': cache_type,
-            'data': data
-        }
+        if self.lease(query, cache_type, params):
+            try:
+                # The previous holder may have stored it between our lookup and the lease
+                data = self.get(query, cache_type, params)
+                if data is None:
+                    data = compute()
+                    self.set(query, cache_type, data, params)
+                return data
+            finally:
+                self.release(query, cache_type, params)
+        
+        data = self.wait_for(query, cache_type, params)
+        # The holder failed or is taking too long; its error is not shared, so try ourselves
+        return data if data is not None else compute()
+    
+    async def get_or_compute_async(self, query: str, cache_type: str, compute: Callable[[], Any],
+                                   params: Optional[Dict[str, Any]] = None) -> Any:
+        """get_or_compute() for a coroutine function; cache reads, writes and lease waits run off the event loop"""
+        import asyncio
+        
+        data = await asyncio.to_thread(self.get, query, cache_type, params)
+        if data is not None:
+            return data
+        
+        if await asyncio.to_thread(self.lease, query, cache_type, params):
+            try:
+                data = await asyncio.to_thread(self.get, query, cache_type, params)
+                if data is None:
+                    data = await compute()
+                    await asyncio.to_thread(self.set, query, cache_type, data, params)
+                return data
+            finally:
+                await asyncio.to_thread(self.release, query, cache_type, params)
         
-        with open(cache_path, 'w') as f:
-            json.dump(cache_data, f, indent=2)
+        data = await asyncio.to_thread(self.wait_for, query, cache_type, params)
+        return data if data is not None else await compute()
+    
+    def _payload_size(self, data: Any) -> int:
+        """Approximate in-memory footprint of a cached payload"""
+        return len(json.dumps(data, separators=(',', ':')))
+    
+    @property
+    def pages(self) -> PageCache:
+        """Content-addressed store of fetched result pages"""
+        with self._pages_lock:
+            if self._pages is None:
+                self._pages = PageCache(os.path.join(self.cache_dir, "pages"), max_bytes=self.page_cache_bytes)
+        return self._pages
+    
+    def purge_expired(self) -> int:
+        """Remove all expired entries and return how many were removed"""
+        removed = self.backend.purge_expired(self._expiry_cutoff())
+        if self.semantic is not None:
+            # Index entries outlive their answers unless dropped with them
+            self.semantic.compact(
+                lambda data: self.backend.get(self._get_cache_key(data['query'], 'ai_response', data['ai_params'])) is not None
+            )
+        return removed
     
     def clear(self) -> None:
         """Clear all cached data"""
-        for filename in os.listdir(self.cache_dir):
-            if filename.endswith('.json'):
-                os.remove(os.path.join(self.cache_dir, filename))
\ No newline at end of file
+        self.memory.clear()
+        self.backend.clear()
+        if self.semantic is not None:
+            self.semantic.clear()
+        if self._pages is not None or os.path.isdir(os.path.join(self.cache_dir, "pages")):
+            self.pages.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters of the in-memory tier"""
+        return {'memory': self.memory.stats()}
@@ -1,68 +1,183 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import click
 import os
 from dotenv import load_dotenv
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
-from rich.markdown import Markdown
-from rich.prompt import Prompt
-from rich.progress import Progress, SpinnerColumn, TextColumn
-from rich.live import Live
 import sys
-import re
+import json
+import time
+from typing import Dict, Any, Optional, Tuple
 
-from search_engine import SearchEngine
-from ai_processor import AIProcessor
+# Only lightweight modules are imported up front; rich, openai and requests load on
+# first use so --help, --clear-cache and fully cached queries start quickly
+from search_engine import SearchEngine, SERPAPI_URL, DEFAULT_TIMEOUT as SEARCH_TIMEOUT
+from ai_processor import AIProcessor, DEFAULT_TIMEOUT as AI_TIMEOUT
+from resilience import RetryPolicy
+from rate_limiter import TokenBucket, MemoryBucketStore, SQLiteBucketStore, key_id
+from tracing import span, record, traced, start_tracing, Tracer
+from page_fetcher import PageFetcher
 from cache_manager import CacheManager
+from agent_mode import ResearchAgent
+from pipeline import extract_citations, lookup_cached_search, run_in_background, query_events, answer_query, ChunkLog, replay_answer, find_similar_answer, stale_fallback, stale_answer, store_answer, claim_answer
 
 # Load environment variables
 load_dotenv()
 
-console = Console()
-
-def extract_citations(text: str) -> list[int]:
-    """Extract citation numbers from the AI response."""
-    citations = list(set(int(match) for match in re.findall(r'\[(\d+)\]', text)))
-    citations.sort()
-    return citations
+_console = None
 
+def get_console():
+    """Return the shared rich Console, creating it on first use"""
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
 
 @click.command()
 @click.option('--query', '-q', help='Search query (if not provided, interactive mode is used)')
 @click.option('--results', '-r', default=5, help='Number of search results to fetch')
 @click.option('--model', '-m', default='gpt-4o-mini', help='OpenAI model to use')
+@click.option('--context-budget', default=1500, help='Maximum estimated tokens of search results packed into the answer prompt')
+@click.option('--domain-list', 'domain_lists', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help="File of 'domain [adjustment]' lines added to the source-quality table (repeatable)")
 @click.option('--no-cache', is_flag=True, help='Disable caching')
 @click.option('--clear-cache', is_flag=True, help='Clear all cached data')
+@click.option('--semantic-cache', is_flag=True, help='Reuse cached answers for near-duplicate queries (requires numpy)')
+@click.option('--similarity', default=0.85, help='Minimum query similarity for --semantic-cache matches (0-1)')
 @click.option('--agent', is_flag=True, help='Enable autonomous agent mode for deep research')
-def main(query, results, model, no_cache, clear_cache, agent):
+@click.option('--agent-concurrency', default=4, help='Maximum concurrent searches per research level in agent mode')
+@click.option('--agent-time-budget', type=float, default=None, help='Stop agent research after this many seconds')
+@click.option('--agent-token-budget', type=int, default=None, help='Stop agent research after this many estimated tokens')
+@click.option('--multi-query', is_flag=True, help='Also search optimized alternative queries in parallel for vague queries')
+@click.option('--batch', type=click.File('r'), default=None, help="Answer one query per line from FILE ('-' for stdin), writing JSON Lines to stdout")
+@click.option('--workers', default=4, help='Number of queries processed concurrently in batch mode')
+@click.option('--rate', type=float, default=None, help='Maximum queries started per second in batch mode')
+@click.option('--output', '-o', 'output_format', type=click.Choice(['rich', 'json', 'ndjson']), default='rich',
+              help='Output format: rich terminal UI, one JSON document, or a stream of NDJSON events')
+@click.option('--serve', is_flag=True, help='Run as a daemon answering client.py queries over a Unix socket')
+@click.option('--socket', 'socket_path', default=None, help='Unix socket path for --serve')
+@click.option('--replay', type=click.Choice(['instant', 'timed']), default='instant',
+              help='Replay cached answers instantly or with their original streaming timing')
+@click.option('--timeout', type=float, default=None, help='Read timeout in seconds for SerpAPI and OpenAI requests (default: 30 and 60)')
+@click.option('--search-timeout', type=(float, float), default=None, metavar='CONNECT READ',
+              help='Connect and read timeouts in seconds for SerpAPI, overriding --timeout (default: 5 30)')
+@click.option('--openai-timeout', type=(float, float), default=None, metavar='CONNECT READ',
+              help='Connect and read timeouts in seconds for OpenAI, overriding --timeout (default: 5 60)')
+@click.option('--retries', default=2, help='Retries with jittered backoff for timeouts, 429s and 5xx responses')
+@click.option('--search-rate', type=float, default=None, help='Maximum SerpAPI requests per second, shared by all local processes')
+@click.option('--openai-rate', type=float, default=None, help='Maximum OpenAI requests per second, shared by all local processes')
+@click.option('--openai-tpm', type=float, default=None, help='Maximum OpenAI tokens per minute (prompt + max answer), shared by all local processes')
+@click.option('--fetch-pages', default=0, help='Fetch the top N result pages and add their most relevant passages to the prompt')
+@click.option('--page-cache-mb', default=256, help='Disk space for fetched pages kept for revalidation (compressed, in MB)')
+@click.option('--profile', is_flag=True, help='Print a per-stage timing breakdown to stderr when done')
+@click.option('--trace', 'trace_file', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Write timing spans to FILE in Chrome trace format (chrome://tracing, Perfetto)')
+def main(query, results, model, context_budget, domain_lists, no_cache, clear_cache, semantic_cache, similarity, agent, agent_concurrency, agent_time_budget, agent_token_budget, multi_query, batch, workers, rate, output_format, serve, socket_path, replay, timeout, search_timeout, openai_timeout, retries, search_rate, openai_rate, openai_tpm, fetch_pages, page_cache_mb, profile, trace_file):
     """Perplexity CLI - AI-powered search with citations"""
     
+    if agent and output_format != 'rich':
+        raise click.UsageError("--agent research is only shown with --output rich")
+    
+    if profile or trace_file:
+        # Reported when the command finishes, however it exits
+        tracer = start_tracing()
+        click.get_current_context().call_on_close(lambda: report_trace(tracer, profile, trace_file))
+    
+    timed_replay = replay == 'timed'
+    try:
+        cache_manager = CacheManager(
+            semantic_threshold=similarity if semantic_cache else None,
+            page_cache_bytes=page_cache_mb * 1024 * 1024
+        ) if not no_cache else None
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+    
+    # Handle cache clearing (needs no API keys or network clients)
+    if clear_cache:
+        if cache_manager:
+            cache_manager.clear()
+            click.echo("Cache cleared successfully!")
+        if not query and not batch:
+            sys.exit(0)
+    
     # Check for API keys
     serpapi_key = os.getenv('SERPAPI_KEY')
     openai_key = os.getenv('OPENAI_API_KEY')
     
     if not serpapi_key or not openai_key:
+        console = get_console()
         console.print("[bold red]Error:[/bold red] Missing API keys!")
         console.print("Please set SERPAPI_KEY and OPENAI_API_KEY in your .env file")
         console.print("Copy .env.example to .env and add your keys")
         sys.exit(1)
     
-    # Initialize components
-    search_engine = SearchEngine(serpapi_key)
-    ai_processor = AIProcessor(openai_key)
-    cache_manager = CacheManager() if not no_cache else None
+    # Initialize components; the API clients themselves are created on first request
+    retry_policy = RetryPolicy(retries=retries)
+    limiters = create_rate_limiters(
+        serpapi_key, openai_key, search_rate, openai_rate, openai_tpm,
+        cache_dir=cache_manager.cache_dir if cache_manager else None
+    )
+    search_engine = SearchEngine(
+        serpapi_key,
+        multi_query=multi_query,
+        base_url=os.getenv('SERPAPI_BASE_URL', SERPAPI_URL),
+        timeout=backend_timeout(SEARCH_TIMEOUT, timeout, search_timeout),
+        retry_policy=retry_policy,
+        rate_limiter=limiters['search'],
+        page_fetcher=PageFetcher(
+            top_n=fetch_pages,
+            page_cache=cache_manager.pages if cache_manager and page_cache_mb > 0 else None
+        ) if fetch_pages > 0 else None
+    )
+    ai_processor = AIProcessor(
+        openai_key,
+        context_budget=context_budget,
+        timeout=backend_timeout(AI_TIMEOUT, timeout, openai_timeout),
+        retry_policy=retry_policy,
+        rate_limiter=limiters['openai_requests'],
+        token_limiter=limiters['openai_tokens']
+    )
+    for path in domain_lists:
+        ai_processor.domain_reputation.load(path)
+    research_agent = ResearchAgent(
+        search_engine, ai_processor,
+        max_concurrency=agent_concurrency,
+        time_budget=agent_time_budget,
+        token_budget=agent_token_budget,
+        model=model
+    ) if agent else None
+    
+    # Daemon mode
+    if serve:
+        run_server(socket_path, results, model, search_engine, ai_processor, cache_manager)
+        return
     
-    # Handle cache clearing
-    if clear_cache and cache_manager:
-        cache_manager.clear()
-        console.print("[green]Cache cleared successfully![/green]")
+    # Batch mode
+    if batch:
+        from batch import run_batch
+        stats = run_batch(batch, results, model, search_engine, ai_processor, cache_manager, workers=workers, rate=rate)
+        click.echo(f"Processed {stats['succeeded'] + stats['failed']} queries ({stats['failed']} failed)", err=True)
+        packing = ai_processor.context_packer.stats()
+        if packing['prompts']:
+            click.echo(f"Context packing saved ~{packing['tokens_saved']} prompt tokens over {packing['prompts']} answers", err=True)
+        return
+    
+    # Machine-readable output bypasses rich entirely
+    if output_format != 'rich':
         if not query:
-            sys.exit(0)
+            click.echo("Error: --output json/ndjson requires --query (use --batch for many queries)", err=True)
+            sys.exit(1)
+        if not print_structured(query, results, model, search_engine, ai_processor, cache_manager, output_format, timed_replay):
+            sys.exit(1)
+        return
     
     # Interactive mode
+    console = get_console()
     if not query:
+        from rich.prompt import Prompt
         console.print("[bold]Welcome to Perplexity CLI![/bold]")
         console.print("Type 'exit' or 'quit' to leave\n")
         
@@ -73,14 +188,92 @@ def main(query, results, model, no_cache, clear_cache, agent):
                 console.print("[yellow]Goodbye![/yellow]")
                 break
             
-            process_query(query, results, model, search_engine, ai_processor, cache_manager)
+            process_query(query, results, model, search_engine, ai_processor, cache_manager, research_agent, timed_replay)
             console.print("\n" + "="*80 + "\n")
     else:
         # Single query mode
-        process_query(query, results, model, search_engine, ai_processor, cache_manager)
+        process_query(query, results, model, search_engine, ai_processor, cache_manager, research_agent, timed_replay)
+
+def report_trace(tracer: Tracer, profile: bool, trace_file: str = None) -> None:
+    """Print the --profile breakdown and write the --trace file"""
+    if profile:
+        click.echo("\n" + tracer.format_breakdown(), err=True)
+    if trace_file:
+        tracer.export(trace_file)
+        click.echo(f"Trace written to {trace_file}", err=True)
 
-def process_query(query: str, num_results: int, model: str, search_engine: SearchEngine, ai_processor: AIProcessor, cache_manager: CacheManager = None):
+def backend_timeout(default: Tuple[float, float], read: Optional[float] = None,
+                    override: Optional[Tuple[float, float]] = None) -> Tuple[float, float]:
+    """(connect, read) timeouts of one backend: its own option, else --timeout as the read timeout, else its defaults"""
+    if override:
+        return tuple(override)
+    return (default[0], read) if read else default
+
+def create_rate_limiters(serpapi_key: str, openai_key: str, search_rate: float = None, openai_rate: float = None,
+                         openai_tpm: float = None, cache_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Token buckets for the configured limits, kept in a SQLite file in cache_dir so
+    that every local process using the same API key draws from the same quota.
+    Without a cache directory the buckets are only shared within this process.
+    """
+    limiters = {'search': None, 'openai_requests': None, 'openai_tokens': None}
+    if not (search_rate or openai_rate or openai_tpm):
+        return limiters
+    
+    store = SQLiteBucketStore(os.path.join(cache_dir, "rate_limits.db")) if cache_dir else MemoryBucketStore()
+    if search_rate:
+        limiters['search'] = TokenBucket(f"serpapi:{key_id(serpapi_key)}:requests", search_rate, store=store)
+    if openai_rate:
+        limiters['openai_requests'] = TokenBucket(f"openai:{key_id(openai_key)}:requests", openai_rate, store=store)
+    if openai_tpm:
+        limiters['openai_tokens'] = TokenBucket.per_minute(f"openai:{key_id(openai_key)}:tokens", openai_tpm, store=store)
+    return limiters
+
+def run_server(socket_path: str, num_results: int, model: str, search_engine: SearchEngine, ai_processor: AIProcessor, cache_manager: CacheManager):
+    """Serve queries over a Unix socket until interrupted"""
+    from daemon import QueryServer, DEFAULT_SOCKET_PATH, warm_up
+    
+    socket_path = socket_path or DEFAULT_SOCKET_PATH
+    try:
+        server = QueryServer(socket_path, search_engine, ai_processor, cache_manager, default_results=num_results, default_model=model)
+    except Exception as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+    
+    warm_up(ai_processor)
+    click.echo(f"Listening on {socket_path} (Ctrl+C to stop)", err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def print_structured(query: str, num_results: int, model: str, search_engine: SearchEngine, ai_processor: AIProcessor, cache_manager: CacheManager, output_format: str, timed_replay: bool = False) -> bool:
+    """Write a query's events as NDJSON, or its aggregated result as one JSON document; returns False on error"""
+    if output_format == 'ndjson':
+        succeeded = True
+        for event in query_events(query, num_results, model, search_engine, ai_processor, cache_manager, timed_replay):
+            sys.stdout.write(json.dumps(event) + "\n")
+            sys.stdout.flush()
+            succeeded = succeeded and event['event'] != 'error'
+        return succeeded
+    
+    try:
+        result = answer_query(query, num_results, model, search_engine, ai_processor, cache_manager)
+    except Exception as e:
+        result = {'query': query, 'error': str(e)}
+    sys.stdout.write(json.dumps(result) + "\n")
+    return 'error' not in result
+
+@traced("process_query")
+def process_query(query: str, num_results: int, model: str, search_engine: SearchEngine, ai_processor: AIProcessor, cache_manager: CacheManager = None, research_agent: ResearchAgent = None, timed_replay: bool = False):
     """Process a single query"""
+    from rich.table import Table
+    from rich.progress import Progress, SpinnerColumn, TextColumn
+    from streaming_renderer import StreamingRenderer
+    
+    console = get_console()
     
     # Display query
     console.print(f"\n[bold cyan]Query:[/bold cyan] {query}")
@@ -88,19 +281,37 @@ def process_query(query: str, num_results: int, model: str, search_engine: Searc
     # Check cache first
     search_results = None
     ai_response_content = None
+    cached_ai = None
+    cached_follow_ups = None
     use_cached_ai = False
     
     if cache_manager:
-        cached_search = cache_manager.get(query, 'search')
-        if cached_search:
-            search_results = cached_search
+        # Results depend on more than the query text, so those parameters are part of the key
+        cached_search = lookup_cached_search(query, num_results, search_engine, cache_manager)
+        search_params = cached_search['params']
+        ai_params = {**search_params, 'model': model}
+        
+        search_results = cached_search['results']
+        if cached_search['stale']:
+            console.print("[dim]Using cached search results (refreshing in background)[/dim]")
+        elif cached_search['cached']:
             console.print("[dim]Using cached search results[/dim]")
         
-        cached_ai = cache_manager.get(query, 'ai_response')
+        with span("cache_lookup", type='ai_response'):
+            cached_ai = cache_manager.get(query, 'ai_response', ai_params)
         if cached_ai and cached_ai.get('model') == model:
-            ai_response_content = cached_ai.get('response')
+            cached_follow_ups = cached_ai.get('follow_up_questions')
             use_cached_ai = True
             console.print("[dim]Using cached AI response[/dim]")
+        
+        # A near-duplicate of an earlier query can reuse its results and answer
+        similar = None if use_cached_ai else find_similar_answer(query, num_results, model, search_engine, cache_manager)
+        if similar:
+            search_results = similar['results']
+            cached_ai = similar['answer']
+            cached_follow_ups = cached_ai.get('follow_up_questions')
+            use_cached_ai = True
+            console.print(f"[dim]Using cached answer for a similar query: \"{similar['query']}\" (similarity {similar['similarity']:.2f})[/dim]")
     
     with Progress(
         SpinnerColumn(),
@@ -111,74 +322,117 @@ def process_query(query: str, num_results: int, model: str, search_engine: Searc
         if search_results is None:
             search_task = progress.add_task("[cyan]Searching the web...", total=None)
             try:
-                search_results = search_engine.search(query, num_results)
                 if cache_manager:
-                    cache_manager.set(query, 'search', search_results)
+                    search_results = cache_manager.get_or_compute(
+                        query, 'search', lambda: search_engine.search(query, num_results), search_params
+                    )
+                else:
+                    search_results = search_engine.search(query, num_results)
                 progress.update(search_task, completed=True)
             except Exception as e:
-                progress.stop()
-                console.print(f"[bold red]Search Error:[/bold red] {str(e)}")
-                return
+                search_results = stale_fallback(query, 'search', search_params, cache_manager) if cache_manager else None
+                if search_results is None:
+                    progress.stop()
+                    console.print(f"[bold red]Search Error:[/bold red] {str(e)}")
+                    return
+                console.print(f"[dim]Search failed ({e}); using stale cached results[/dim]")
         
-    # Generate AI response with streaming (if not cached)
-    if not use_cached_ai:
-        ai_response_content = ""
-        console.print("\n[bold green]AI Response:[/bold green]")
+    # Only one caller generates a given answer; identical queries in flight,
+    # here or in other processes sharing the cache, wait for it
+    leased = False
+    if cache_manager and search_results and not use_cached_ai:
+        cached_ai, leased = claim_answer(query, model, ai_params, cache_manager)
+        if cached_ai:
+            cached_follow_ups = cached_ai.get('follow_up_questions')
+            use_cached_ai = True
+            console.print("[dim]Using the AI response of an identical query answered meanwhile[/dim]")
+    
+    try:
+        # Follow-up questions only depend on the query and search results, so start
+        # generating them now and join the result once the answer is displayed
+        follow_up_future = None
+        if search_results and cached_follow_ups is None:
+            follow_up_future = run_in_background(ai_processor.generate_follow_up_questions, query, search_results, model)
         
         # Check if search results are empty
-        if not search_results:
+        if not use_cached_ai and not search_results:
             console.print("[yellow]No search results found. Unable to generate response.[/yellow]")
             return
         
-        panel = Panel("Generating response...", title="[bold green]AI Response[/bold green]", border_style="green")
-        with Live(panel, console=console, refresh_per_second=4, vertical_overflow="visible") as live:
+        # Cached answers are replayed from their chunk log through the same renderer as fresh ones
+        chunk_log = None
+        if use_cached_ai:
+            stream = replay_answer(cached_ai, timed=timed_replay)
+            title = "[bold green]AI Response (Cached)[/bold green]"
+        else:
+            chunk_log = ChunkLog()
+            stream = ai_processor.generate_response_with_citations_stream(query, search_results, model)
+            title = "[bold green]AI Response[/bold green]"
+        
+        # Only the unfinished last line is re-laid out as chunks arrive
+        fell_back = False
+        stream_started = time.perf_counter()
+        first_chunk = True
+        with StreamingRenderer(console, title=title) as renderer:
             try:
-                chunk_count = 0
-                for chunk in ai_processor.generate_response_with_citations_stream(query, search_results, model):
+                for chunk in stream:
                     if chunk:  # Only process non-empty chunks
-                        ai_response_content += chunk
-                        chunk_count += 1
-                        # Update the panel with the accumulated content
-                        live.update(Panel(ai_response_content, title="[bold green]AI Response[/bold green]", border_style="green"))
+                        if first_chunk:
+                            first_chunk = False
+                            record("time_to_first_token", stream_started, time.perf_counter(), cached=chunk_log is None)
+                        with span("render"):
+                            renderer.feed(chunk)
+                        if chunk_log is not None:
+                            chunk_log.append(chunk)
+                record("answer_stream", stream_started, time.perf_counter(), cached=chunk_log is None)
                 
-                if chunk_count == 0:
+                ai_response_content = renderer.text
+                if not ai_response_content:
                     console.print("[yellow]No response generated from AI.[/yellow]")
                     return
-                    
+            
             except Exception as e:
-                console.print(f"[bold red]AI Error:[/bold red] {str(e)}")
-                import traceback
-                console.print(f"[dim]{traceback.format_exc()}[/dim]")
-                return
-
-        # Cache the AI response if caching is enabled
-        if cache_manager and ai_response_content:
-            cache_manager.set(query, 'ai_response', {
-                'response': ai_response_content,
-                'model': model
-            })
-    else:
-        # Display cached response
-        console.print("\n[bold green]AI Response:[/bold green]")
-        console.print(Panel(ai_response_content, title="[bold green]AI Response (Cached)[/bold green]", border_style="green"))
-    
-    # Extract citations and display sources
-    citations = extract_citations(ai_response_content)
-    
-    # Display sources cited
-    if citations:
-        console.print("\n[bold yellow]Sources Used:[/bold yellow]")
-        for citation in citations:
-            for result in search_results:
-                if result['index'] == citation:
-                    console.print(f"[{citation}] [link={result['link']}]{result['title']}[/link] - {result['source']}")
-    
-    # Generate and display follow-up questions
-    follow_up_questions = ai_processor.generate_follow_up_questions(query, search_results, model)
-    if follow_up_questions:
-        console.print("\n[bold yellow]Follow-up Questions:[/bold yellow]")
-        for question in follow_up_questions:
-            console.print(f"- {question}")
+                # Nothing shown yet: an answer past its freshness TTL is better than none
+                stale_ai = stale_answer(query, model, ai_params, cache_manager) if cache_manager and chunk_log is not None and not renderer.text else None
+                if not stale_ai:
+                    console.print(f"[bold red]AI Error:[/bold red] {str(e)}")
+                    import traceback
+                    console.print(f"[dim]{traceback.format_exc()}[/dim]")
+                    return
+                console.print(f"[dim]AI request failed ({e}); using stale cached answer[/dim]")
+                for chunk in replay_answer(stale_ai):
+                    renderer.feed(chunk)
+                ai_response_content = renderer.text
+                cached_ai, chunk_log, fell_back = stale_ai, None, True
+                if stale_ai.get('follow_up_questions'):
+                    cached_follow_ups, follow_up_future = stale_ai['follow_up_questions'], None
+        
+        # Extract citations and display sources
+        citations = extract_citations(ai_response_content)
+        
+        # Display sources cited
+        if citations:
+            console.print("\n[bold yellow]Sources Used:[/bold yellow]")
+            for citation in citations:
+                for result in search_results:
+                    if result['index'] == citation:
+                        console.print(f"[{citation}] [link={result['link']}]{result['title']}[/link] - {result['source']}")
+        
+        # Generate and display follow-up questions
+        with span("follow_up_wait"):
+            follow_up_questions = follow_up_future.result() if follow_up_future else (cached_follow_ups or [])
+        if follow_up_questions:
+            console.print("\n[bold yellow]Follow-up Questions:[/bold yellow]")
+            for question in follow_up_questions:
+                console.print(f"- {question}")
+        
+        # Cache the AI response and its follow-ups if caching is enabled
+        if cache_manager and follow_up_future and not fell_back:
+            chunks = chunk_log.chunks if chunk_log is not None else cached_ai.get('chunks')
+            store_answer(query, num_results, model, ai_response_content, follow_up_questions, chunks, search_params, ai_params, cache_manager)
+    finally:
+        if leased:
+            cache_manager.release(query, 'ai_response', ai_params)
 
     # Display all search results
     console.print("\n[bold blue]All Search Results:[/bold blue]")
@@ -196,7 +450,39 @@ def process_query(query: str, num_results: int, model: str, search_engine: Searc
             result['snippet'][:80] + "..." if len(result['snippet']) > 80 else result['snippet']
         )
     
-    console.print(table)
+    with span("render"):
+        console.print(table)
+    
+    if research_agent:
+        display_research(query, search_results, research_agent, ai_response_content)
+
+def display_research(query: str, search_results: list, research_agent: ResearchAgent, response: Optional[str] = None):
+    """Run agent research on top of the initial results and display what it found"""
+    from rich.progress import Progress, SpinnerColumn, TextColumn
+    
+    console = get_console()
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        console=console,
+    ) as progress:
+        progress.add_task("[cyan]Researching follow-up queries...", total=None)
+        try:
+            research = research_agent.autonomous_research(query, initial_results=search_results, initial_response=response)
+        except Exception as e:
+            progress.stop()
+            console.print(f"[bold red]Research Error:[/bold red] {str(e)}")
+            return
+    
+    console.print(f"\n[bold blue]Deep Research:[/bold blue] [dim]{research['reason']} (depth {research.get('depth', 0)}, {research.get('elapsed', 0):.1f}s)[/dim]")
+    for followup in research.get('followup_queries', []):
+        console.print(f"- {followup}")
+    
+    seen_links = {result['link'] for result in search_results}
+    for result in research.get('additional_context', []):
+        if result['link'] and result['link'] not in seen_links:
+            seen_links.add(result['link'])
+            console.print(f"  [link={result['link']}]{result['title']}[/link] - {result['source']}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Thin client for a running `cli.py --serve` daemon; imports only the standard library"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+from typing import Iterator, Dict, Any, Optional
+
+# Must match daemon.DEFAULT_SOCKET_PATH (not imported to keep start-up minimal)
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"perplexity-cli-{os.getuid()}.sock")
+
+def stream_query(query: str, socket_path: str = DEFAULT_SOCKET_PATH, results: Optional[int] = None,
+                 model: Optional[str] = None, replay: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Send a query to the daemon and yield its events as they arrive"""
+    request = {'query': query}
+    if results is not None:
+        request['results'] = results
+    if model is not None:
+        request['model'] = model
+    if replay is not None:
+        request['replay'] = replay
+    
+    yield from _send_request(request, socket_path)
+
+def health(socket_path: str = DEFAULT_SOCKET_PATH) -> Dict[str, Any]:
+    """The daemon's backend circuit breaker states and cache counters"""
+    events = _send_request({'health': True}, socket_path)
+    try:
+        return next(events)
+    finally:
+        events.close()
+
+def _send_request(request: Dict[str, Any], socket_path: str) -> Iterator[Dict[str, Any]]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b"\n")
+        with sock.makefile('r', encoding='utf-8') as stream:
+            for line in stream:
+                yield json.loads(line)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Query a running Perplexity CLI daemon (start it with: python cli.py --serve)")
+    parser.add_argument('query', nargs='?', help='Search query')
+    parser.add_argument('-r', '--results', type=int, default=None, help='Number of search results to fetch')
+    parser.add_argument('-m', '--model', default=None, help='OpenAI model to use')
+    parser.add_argument('--replay', choices=['instant', 'timed'], default=None, help='Replay cached answers instantly or with their original timing')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Daemon socket path')
+    parser.add_argument('--output', choices=['text', 'ndjson'], default='text', help='Plain text or the raw NDJSON events')
+    parser.add_argument('--health', action='store_true', help="Print the daemon's backend and cache health as JSON and exit")
+    args = parser.parse_args()
+    if not args.query and not args.health:
+        parser.error('a query is required unless --health is given')
+    
+    try:
+        if args.health:
+            sys.stdout.write(json.dumps(health(args.socket), indent=2) + "\n")
+            return 0
+        events = stream_query(args.query, args.socket, args.results, args.model, args.replay)
+        succeeded = True
+        for event in events:
+            if args.output == 'ndjson':
+                sys.stdout.write(json.dumps(event) + "\n")
+            elif event['event'] == 'answer_delta':
+                sys.stdout.write(event['text'])
+            elif event['event'] == 'citations':
+                sys.stdout.write("\n")
+                if event['sources']:
+                    sys.stdout.write("\nSources Used:\n")
+                for source in event['sources']:
+                    sys.stdout.write(f"[{source['index']}] {source['title']} - {source['link']}\n")
+            elif event['event'] == 'follow_ups' and event['questions']:
+                sys.stdout.write("\nFollow-up Questions:\n")
+                for question in event['questions']:
+                    sys.stdout.write(f"- {question}\n")
+            elif event['event'] == 'error':
+                sys.stderr.write(f"Error: {event['message']}\n")
+            succeeded = succeeded and event['event'] != 'error'
+            sys.stdout.flush()
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.stderr.write(f"No daemon listening on {args.socket}; start one with: python cli.py --serve\n")
+        return 2
+    
+    return 0 if succeeded else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
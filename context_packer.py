@@ -0,0 +1,143 @@
+"""Token-aware packing of search results into the answer prompt"""
+
+import contextvars
+import re
+import threading
+from typing import List, Dict, Any, Optional, Set
+from tracing import count
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Token counts of the latest pack() in the current thread or asyncio task, so the
+# query that built a prompt can report them although the packer is shared
+_last_pack = contextvars.ContextVar('last_pack', default=None)
+
+def last_pack() -> Optional[Dict[str, int]]:
+    """tokens and tokens_saved of the latest prompt packed in this thread or task, or None"""
+    return _last_pack.get()
+
+def reset_last_pack() -> None:
+    """Forget the latest pack(), before building a prompt whose counts will be read"""
+    _last_pack.set(None)
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of text locally: about one token per punctuation
+    mark and per four characters of each word, which tracks BPE tokenizers for English
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+
+def _shingles(text: str) -> Set[str]:
+    """Word bigrams used to detect near-duplicate snippets"""
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(pair) for pair in zip(words, words[1:])} or set(words)
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def trim_text(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, preferring to end on a sentence boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    
+    tokens = 0
+    end = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        tokens += (len(match.group()) + 3) // 4
+        if tokens > max_tokens:
+            break
+        end = match.end()
+    
+    trimmed = text[:end]
+    sentence_end = max(trimmed.rfind(". "), trimmed.rfind("! "), trimmed.rfind("? "))
+    if sentence_end > len(trimmed) // 2:
+        return trimmed[:sentence_end + 1]
+    return trimmed.rstrip() + "..."
+
+class ContextPacker:
+    """
+    Packs scored search results into a prompt context within a token budget:
+    highest quality_score first, snippets trimmed to max_snippet_tokens and
+    near-duplicate snippets (word bigram Jaccard >= similarity_threshold) dropped
+    """
+    
+    def __init__(self, max_tokens: int = 1500, max_snippet_tokens: int = 120, similarity_threshold: float = 0.8):
+        self.max_tokens = max_tokens
+        self.max_snippet_tokens = max_snippet_tokens
+        self.similarity_threshold = similarity_threshold
+        self.packed_prompts = 0
+        self.tokens_packed = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+    
+    def format_result(self, result: Dict[str, Any], snippet: str) -> str:
+        """Render one result as it appears in the prompt, with any passages fetched from its page"""
+        quality_indicator = "⭐" if result['quality_score'] > 0.7 else ""
+        excerpts = "".join(f"Excerpt: {passage}\n" for passage in result.get('passages', []))
+        return (
+            f"[{result['index']}] {result['title']} {quality_indicator}\n"
+            f"Source: {result['source']}\n"
+            f"Content: {snippet}\n"
+            f"{excerpts}"
+            f"URL: {result['link']}\n"
+            f"Quality Score: {result['quality_score']:.2f}\n"
+        )
+    
+    def pack(self, scored_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Return the packed context along with the indexes included and dropped,
+        its estimated tokens and the tokens saved against packing every result in full
+        """
+        ordered = sorted(scored_results, key=lambda x: x['quality_score'], reverse=True)
+        full_tokens = sum(estimate_tokens(self.format_result(result, result['snippet'])) for result in ordered)
+        
+        blocks = []
+        included = []
+        dropped = []
+        seen_snippets = []
+        tokens = 0
+        
+        for result in ordered:
+            shingles = _shingles(result['snippet'])
+            if any(_similarity(shingles, seen) >= self.similarity_threshold for seen in seen_snippets):
+                dropped.append(result['index'])
+                continue
+            
+            block = self.format_result(result, trim_text(result['snippet'], self.max_snippet_tokens))
+            block_tokens = estimate_tokens(block)
+            # The best result is always kept; lower ranked ones may still fit after a large one is skipped
+            if blocks and tokens + block_tokens > self.max_tokens:
+                dropped.append(result['index'])
+                continue
+            
+            blocks.append(block)
+            included.append(result['index'])
+            seen_snippets.append(shingles)
+            tokens += block_tokens
+        
+        with self._lock:
+            self.packed_prompts += 1
+            self.tokens_packed += tokens
+            self.tokens_saved += full_tokens - tokens
+        _last_pack.set({'tokens': tokens, 'tokens_saved': full_tokens - tokens})
+        count("context_tokens", tokens)
+        count("context_tokens_saved", full_tokens - tokens)
+        
+        return {
+            'context': "\n".join(blocks),
+            'included': included,
+            'dropped': dropped,
+            'tokens': tokens,
+            'tokens_saved': full_tokens - tokens
+        }
+    
+    def stats(self) -> Dict[str, int]:
+        """Running totals over every prompt packed so far"""
+        with self._lock:
+            return {
+                'prompts': self.packed_prompts,
+                'tokens_packed': self.tokens_packed,
+                'tokens_saved': self.tokens_saved
+            }
@@ -0,0 +1,111 @@
+"""Long-lived query server that keeps the search, AI and cache clients warm behind a Unix socket"""
+
+import json
+import os
+import socket
+import socketserver
+import tempfile
+from typing import Dict, Any
+
+from pipeline import query_events
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"perplexity-cli-{os.getuid()}.sock")
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Each connection sends one JSON line {"query": ..., "results": ..., "model": ..., "replay": ...}
+    and receives the query's pipeline events back as NDJSON until the stream ends.
+    A {"health": true} request is answered with a single health event instead.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, socket_path: str, search_engine, ai_processor, cache_manager=None,
+                 default_results: int = 5, default_model: str = "gpt-4o-mini"):
+        self.search_engine = search_engine
+        self.ai_processor = ai_processor
+        self.cache_manager = cache_manager
+        self.default_results = default_results
+        self.default_model = default_model
+        
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, QueryHandler)
+        # Only the owner may submit queries billed to their API keys
+        os.chmod(socket_path, 0o600)
+    
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline())
+            if not isinstance(request, dict):
+                raise TypeError("request is not a JSON object")
+            if request.get('health'):
+                self._send(health_event(server))
+                return
+            query = str(request['query'])
+            num_results = int(request.get('results', server.default_results))
+            model = str(request.get('model', server.default_model))
+            timed_replay = request.get('replay') == 'timed'
+        except (ValueError, KeyError, TypeError):
+            self._send({'event': 'error', 'stage': 'request', 'message': 'Expected a JSON line with a "query" field'})
+            return
+        
+        events = query_events(
+            query,
+            num_results,
+            model,
+            server.search_engine,
+            server.ai_processor,
+            server.cache_manager,
+            timed_replay
+        )
+        try:
+            for event in events:
+                self._send(event)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; stop generating for it
+            events.close()
+    
+    def _send(self, event: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(event).encode('utf-8') + b"\n")
+        self.wfile.flush()
+
+def health_event(server: QueryServer) -> Dict[str, Any]:
+    """Circuit breaker state of each backend and the cache counters, for monitoring"""
+    event = {
+        'event': 'health',
+        'backends': {
+            'serpapi': server.search_engine.resilience.stats(),
+            'openai': server.ai_processor.resilience.stats()
+        }
+    }
+    if server.cache_manager:
+        event['cache'] = server.cache_manager.stats()
+    return event
+
+def _remove_stale_socket(socket_path: str) -> None:
+    """Remove a socket file left behind by a server that is no longer running"""
+    if not os.path.exists(socket_path):
+        return
+    
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise Exception(f"A server is already listening on {socket_path}")
+
+def warm_up(ai_processor) -> None:
+    """Create the API clients up front so the first query does not pay for it"""
+    ai_processor.client
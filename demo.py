@@ -7,7 +7,7 @@ import subprocess
 import time
 import os
 import sys
-import re
+import json
 from rich.console import Console
 from rich.panel import Panel
 from rich.markdown import Markdown
@@ -19,63 +19,16 @@ from rich.live import Live
 
 console = Console()
 
-def clean_ansi_codes(text):
-    """Remove ANSI escape codes from text"""
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
-
 def extract_sections(output):
-    """Extract different sections from the CLI output"""
-    sections = {
-        'query': '',
-        'ai_response': '',
-        'sources': [],
-        'followups': [],
-        'search_results': []
+    """Extract the sections to display from the CLI's JSON output"""
+    result = json.loads(output)
+    return {
+        'query': result['query'],
+        'ai_response': result['answer'],
+        'sources': [f"[{source['index']}] {source['title']} - {source['source']}" for source in result['sources']],
+        'followups': result['follow_up_questions'],
+        'search_results': result['search_results']
     }
-    
-    lines = output.split('\n')
-    current_section = None
-    ai_response_lines = []
-    
-    for i, line in enumerate(lines):
-        # Extract query
-        if line.strip().startswith('Query:'):
-            sections['query'] = line.replace('Query:', '').strip()
-        
-        # Extract AI response
-        elif 'AI Response:' in line:
-            current_section = 'ai_response'
-            # Look for the panel content
-            j = i + 1
-            while j < len(lines) and 'Sources Used:' not in lines[j]:
-                if lines[j].strip() and not lines[j].startswith('⠋'):
-                    ai_response_lines.append(lines[j])
-                j += 1
-        
-        # Extract sources
-        elif 'Sources Used:' in line:
-            current_section = 'sources'
-        elif current_section == 'sources' and line.strip().startswith('['):
-            sections['sources'].append(line.strip())
-        
-        # Extract follow-up questions
-        elif 'Follow-up Questions:' in line:
-            current_section = 'followups'
-        elif current_section == 'followups' and line.strip().startswith('-'):
-            sections['followups'].append(line.strip()[2:])  # Remove '- '
-        
-        # Stop at search results table
-        elif 'All Search Results:' in line:
-            break
-    
-    # Clean up AI response
-    ai_text = '\n'.join(ai_response_lines)
-    # Remove box drawing characters
-    ai_text = re.sub(r'[╭╮╰╯│─]', '', ai_text)
-    sections['ai_response'] = ai_text.strip()
-    
-    return sections
 
 def run_demo():
     # Clear screen for better presentation
@@ -152,7 +105,7 @@ def run_demo():
             task = progress.add_task("[cyan]Running query...", total=None)
             
             # Add agent flag if specified
-            cmd = ["python", "cli.py", "-q", query_info['query'], "-r", "5"]
+            cmd = ["python", "cli.py", "-q", query_info['query'], "-r", "5", "--output", "json"]
             if query_info.get('use_agent'):
                 cmd.append('--agent')
             
@@ -0,0 +1,244 @@
+"""Content-addressed, compressed store of fetched pages with HTTP revalidation metadata"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, Any, Optional
+
+def _zstd():
+    """The zstandard module if it is installed (it is optional), else None"""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+class PageCache:
+    """
+    Stores page bodies under the SHA-256 of their content, compressed with zstd
+    when the zstandard package is installed and zlib otherwise, so identical
+    bodies served from several URLs are stored once. Each URL keeps its ETag and
+    Last-Modified validators for conditional re-fetches. When the compressed
+    total exceeds max_bytes, the least recently used URLs are dropped along with
+    any bodies no other URL refers to.
+    
+    The index is a SQLite file in WAL mode, so processes sharing the directory
+    share the cache.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, max_age: float = 3600.0,
+                 compression: Optional[str] = None, level: int = 6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Pages fetched within max_age seconds are used without revalidating
+        self.max_age = max_age
+        if compression is None:
+            compression = 'zstd' if _zstd() else 'zlib'
+        if compression == 'zstd' and not _zstd():
+            raise Exception("zstd compression requires the zstandard package (pip install zstandard)")
+        if compression not in ('zstd', 'zlib'):
+            raise Exception(f"Unknown page cache compression: {compression}")
+        self.compression = compression
+        self.level = level
+        self._open()
+    
+    def _open(self) -> None:
+        os.makedirs(os.path.join(self.directory, 'blobs'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, 'index.db'), timeout=30.0, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    codec TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    raw_size INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_accessed ON urls (accessed)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_digest ON urls (digest)")
+    
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'blobs', digest[:2], digest)
+    
+    def _compress(self, body: bytes) -> bytes:
+        if self.compression == 'zstd':
+            return _zstd().ZstdCompressor(level=self.level).compress(body)
+        return zlib.compress(body, self.level)
+    
+    def _decompress(self, codec: str, data: bytes) -> Optional[bytes]:
+        if codec == 'zlib':
+            return zlib.decompress(data)
+        zstandard = _zstd()
+        # A blob written by a process that had zstandard cannot be read without it
+        return zstandard.ZstdDecompressor().decompress(data) if zstandard else None
+    
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """The cached page for a URL: body, content_type, etag, last_modified and fetched time, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT u.digest, u.content_type, u.etag, u.last_modified, u.fetched, b.codec "
+                "FROM urls u JOIN blobs b ON b.digest = u.digest WHERE u.url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE urls SET accessed = ? WHERE url = ?", (time.time(), url))
+        
+        digest, content_type, etag, last_modified, fetched, codec = row
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                body = self._decompress(codec, f.read())
+        except (OSError, zlib.error, ValueError):
+            body = None
+        if body is None or hashlib.sha256(body).hexdigest() != digest:
+            self.delete(url)
+            return None
+        
+        return {
+            'body': body,
+            'content_type': content_type,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched': fetched
+        }
+    
+    def is_fresh(self, page: Dict[str, Any]) -> bool:
+        """Whether a cached page may be used without asking the server"""
+        return time.time() - page['fetched'] < self.max_age
+    
+    def validators(self, page: Dict[str, Any]) -> Dict[str, str]:
+        """Request headers that make the server answer 304 Not Modified if the page has not changed"""
+        headers = {}
+        if page.get('etag'):
+            headers['If-None-Match'] = page['etag']
+        if page.get('last_modified'):
+            headers['If-Modified-Since'] = page['last_modified']
+        return headers
+    
+    def put(self, url: str, body: bytes, content_type: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> str:
+        """Store a page body for a URL and return its digest; identical bodies share one blob"""
+        digest = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        with self._lock:
+            # The write lock is held while the blob file is written so eviction cannot remove it underneath us
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self._conn.execute("SELECT digest FROM urls WHERE url = ?", (url,)).fetchone()
+                exists = self._conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+                if not exists or not os.path.exists(self._blob_path(digest)):
+                    data = self._compress(body)
+                    self._write_blob(digest, data)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO blobs (digest, codec, size, raw_size) VALUES (?, ?, ?, ?)",
+                        (digest, self.compression, len(data), len(body))
+                    )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO urls (url, digest, content_type, etag, last_modified, fetched, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, digest, content_type, etag, last_modified, now, now)
+                )
+                if previous and previous[0] != digest:
+                    # The page changed; its old body may now be unreferenced
+                    self._collect_garbage([previous[0]])
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return digest
+    
+    def _write_blob(self, digest: str, data: bytes) -> None:
+        path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary name first so readers never see a partial blob
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def touch(self, url: str) -> None:
+        """Mark a page as just revalidated (the server answered 304 Not Modified)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE urls SET fetched = ?, accessed = ? WHERE url = ?", (now, now, url))
+    
+    def delete(self, url: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT digest FROM urls WHERE url = ?", (url,)).fetchone()
+                self._conn.execute("DELETE FROM urls WHERE url = ?", (url,))
+                if row:
+                    self._collect_garbage([row[0]])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def _total_size(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+    
+    def _evict(self) -> None:
+        """Drop least recently used URLs until the blobs fit in max_bytes; call inside a write transaction"""
+        while self._total_size() > self.max_bytes:
+            oldest = self._conn.execute("SELECT url, digest FROM urls ORDER BY accessed LIMIT 1").fetchone()
+            if oldest is None:
+                break
+            self._conn.execute("DELETE FROM urls WHERE url = ?", (oldest[0],))
+            self._collect_garbage([oldest[1]])
+    
+    def _collect_garbage(self, digests) -> None:
+        """Remove those of digests' blobs that no URL refers to any more; call inside a write transaction"""
+        for digest in digests:
+            if self._conn.execute("SELECT 1 FROM urls WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+                continue
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+    
+    def stats(self) -> Dict[str, int]:
+        """Entry counts and sizes for monitoring"""
+        with self._lock:
+            urls = self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            blobs, size, raw_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) FROM blobs"
+            ).fetchone()
+        return {'urls': urls, 'blobs': blobs, 'bytes': size, 'raw_bytes': raw_size}
+    
+    def clear(self) -> None:
+        """Remove every cached page"""
+        with self._lock:
+            self._conn.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self._open()
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,268 @@
+"""Fetch the pages behind top search results and extract the passages relevant to a query"""
+
+import codecs
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import List, Dict, Any, Optional, Tuple
+
+from context_packer import trim_text
+from domain_reputation import hostname
+from page_cache import PageCache
+from query_optimizer import normalize_query
+from tracing import span
+
+# Elements whose text is never article content
+SKIP_TAGS = {
+    'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'object', 'head',
+    'nav', 'header', 'footer', 'aside', 'form', 'button', 'select', 'textarea'
+}
+# Elements that end a block of text
+BLOCK_TAGS = {
+    'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'table', 'tr', 'td', 'th',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'br', 'hr', 'figcaption'
+}
+# Blocks shorter than this are headings, captions or UI text rather than passages
+MIN_PASSAGE_WORDS = 12
+
+class TextExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text converter: feed() it the page as it downloads and
+    read the visible text back as blocks, one per paragraph-like element
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._current = []
+        self._skip_depth = 0
+    
+    def handle_starttag(self, tag: str, attrs) -> None:
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+    
+    def handle_endtag(self, tag: str) -> None:
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+    
+    def handle_data(self, data: str) -> None:
+        if not self._skip_depth:
+            self._current.append(data)
+    
+    def _flush(self) -> None:
+        text = " ".join("".join(self._current).split())
+        if text:
+            self.blocks.append(text)
+        self._current = []
+    
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+def split_plain_text(text: str) -> List[str]:
+    """Blocks of a plain-text page: its blank-line separated paragraphs"""
+    return [" ".join(block.split()) for block in re.split(r"\n\s*\n", text) if block.strip()]
+
+class PageText:
+    """
+    Incremental bytes-to-blocks converter for one page, decoding with the
+    charset of its Content-Type; used for downloads and cached bodies alike
+    """
+    
+    def __init__(self, content_type: str):
+        match = re.search(r"charset=[\"']?([\w.:-]+)", content_type)
+        # requests would assume ISO-8859-1 for text/* without a charset; pages are far more often UTF-8
+        try:
+            self._decoder = codecs.getincrementaldecoder(match.group(1) if match else 'utf-8')(errors='replace')
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._plain = content_type.startswith('text/plain')
+        self._extractor = None if self._plain else TextExtractor()
+        self._parts = []
+    
+    def feed(self, data: bytes, final: bool = False) -> None:
+        text = self._decoder.decode(data, final=final)
+        if self._plain:
+            self._parts.append(text)
+        else:
+            self._extractor.feed(text)
+    
+    def close(self) -> List[str]:
+        """The page's text blocks"""
+        self.feed(b"", final=True)
+        if self._plain:
+            return split_plain_text("".join(self._parts))
+        self._extractor.close()
+        return self._extractor.blocks
+
+def extract_blocks(body: bytes, content_type: str) -> List[str]:
+    """Text blocks of a complete page body"""
+    text = PageText(content_type)
+    text.feed(body)
+    return text.close()
+
+def select_passages(blocks: List[str], query: str, max_passages: int = 3, max_tokens: int = 300) -> List[str]:
+    """
+    The blocks that best match the query by BM25 over the query's content words,
+    in page order, trimmed to share max_tokens between them
+    """
+    terms = set(normalize_query(query).split())
+    candidates = [(position, block, re.findall(r"\w+", block.lower())) for position, block in enumerate(blocks)]
+    candidates = [candidate for candidate in candidates if len(candidate[2]) >= MIN_PASSAGE_WORDS]
+    if not terms or not candidates:
+        return []
+    
+    document_frequency = {term: sum(1 for _, _, words in candidates if term in words) for term in terms}
+    average_length = sum(len(words) for _, _, words in candidates) / len(candidates)
+    
+    scored = []
+    for position, block, words in candidates:
+        counts = {}
+        for word in words:
+            if word in terms:
+                counts[word] = counts.get(word, 0) + 1
+        score = 0.0
+        for term, count in counts.items():
+            idf = math.log(1 + (len(candidates) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * count * 2.2 / (count + 1.2 * (0.25 + 0.75 * len(words) / average_length))
+        if score > 0:
+            scored.append((score, position, block))
+    
+    best = sorted(scored, reverse=True)[:max_passages]
+    per_passage = max(1, max_tokens // max(1, len(best)))
+    return [trim_text(block, per_passage) for _, _, block in sorted(best, key=lambda item: item[1])]
+
+class PageFetcher:
+    """
+    Downloads the pages of the top_n search results concurrently (max_workers in
+    total, at most per_host at a time to any one host), reading at most
+    max_bytes of each within page_deadline seconds. HTML is parsed as it
+    streams in and the best-matching passages are added to each result as
+    'passages'. Pages that fail, time out or are not text are skipped. Bodies
+    are kept in page_cache, if given, and revalidated instead of re-downloaded.
+    """
+    
+    def __init__(self, top_n: int = 3, max_workers: int = 6, per_host: int = 2, max_bytes: int = 512 * 1024,
+                 timeout: Tuple[float, float] = (3.0, 5.0), page_deadline: float = 8.0,
+                 max_passages: int = 3, passage_tokens: int = 300, session: Optional["requests.Session"] = None,
+                 page_cache: Optional[PageCache] = None):
+        self.top_n = top_n
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.page_deadline = page_deadline
+        self.max_passages = max_passages
+        self.passage_tokens = passage_tokens
+        self.page_cache = page_cache
+        self._session = session
+        self._session_lock = threading.Lock()
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+    
+    @property
+    def session(self) -> "requests.Session":
+        """Pooled HTTP session, created on first use"""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                
+                self._session = requests.Session()
+                self._session.headers['User-Agent'] = "Mozilla/5.0 (compatible; perplexity-cli)"
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self.per_host)
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+        return self._session
+    
+    def _host_slot(self, host: str) -> threading.Semaphore:
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host)
+            return self._host_slots[host]
+    
+    def enrich(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Copies of results, the top_n of which carry 'passages' from their page when it could be fetched"""
+        targets = [
+            position for position, result in enumerate(results)
+            if result.get('link', '').startswith(('http://', 'https://'))
+        ][:self.top_n]
+        if not targets:
+            return results
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(targets))) as executor:
+            pages = list(executor.map(lambda position: self._fetch_blocks(results[position]['link']), targets))
+        
+        enriched = list(results)
+        for position, blocks in zip(targets, pages):
+            passages = select_passages(blocks, query, self.max_passages, self.passage_tokens)
+            if passages:
+                enriched[position] = {**results[position], 'passages': passages}
+        return enriched
+    
+    def _fetch_blocks(self, url: str) -> List[str]:
+        with self._host_slot(hostname(url)):
+            with span("page_fetch", url=url):
+                try:
+                    return self.fetch_blocks(url)
+                except Exception:
+                    # A page that cannot be read only loses its passages
+                    return []
+    
+    def fetch_blocks(self, url: str) -> List[str]:
+        """
+        Download a page, up to max_bytes and page_deadline, and return its text
+        blocks. With a page cache, recently fetched pages are not downloaded
+        again and older ones are revalidated with a conditional request.
+        """
+        cached = self.page_cache.get(url) if self.page_cache is not None else None
+        if cached is not None and self.page_cache.is_fresh(cached):
+            return extract_blocks(cached['body'], cached['content_type'])
+        
+        headers = {'Accept': 'text/html, text/plain;q=0.8'}
+        if cached is not None:
+            headers.update(self.page_cache.validators(cached))
+        
+        deadline = time.monotonic() + self.page_deadline
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                self.page_cache.touch(url)
+                return extract_blocks(cached['body'], cached['content_type'])
+            
+            content_type = response.headers.get('Content-Type', '').lower()
+            if response.status_code != 200 or not content_type.startswith(('text/html', 'application/xhtml', 'text/plain')):
+                return []
+            
+            text = PageText(content_type)
+            body = [] if self.page_cache is not None else None
+            received = 0
+            truncated = timed_out = False
+            for chunk in response.iter_content(chunk_size=16384):
+                received += len(chunk)
+                text.feed(chunk)
+                if body is not None:
+                    body.append(chunk)
+                if received >= self.max_bytes:
+                    truncated = True
+                    break
+                if time.monotonic() > deadline:
+                    timed_out = True
+                    break
+            
+            # A body cut short is not the page the validators describe, so a 304 must
+            # not revive it. One cut at max_bytes is still reused while fresh; one cut
+            # by the deadline depends on the network and is not cached at all.
+            if body is not None and not timed_out:
+                self.page_cache.put(
+                    url, b"".join(body), content_type,
+                    etag=None if truncated else response.headers.get('ETag'),
+                    last_modified=None if truncated else response.headers.get('Last-Modified')
+                )
+        return text.close()
@@ -0,0 +1,567 @@
+"""Headless query pipeline shared by the non-interactive modes"""
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+from ai_processor import FOLLOW_UP_ERROR_PREFIX
+from context_packer import last_pack, reset_last_pack
+from tracing import span, record
+
+# Streamed chunks closer together than this are merged in the cached chunk log
+CHUNK_MERGE_MS = 10
+
+# Keeps fire-and-forget refresh tasks referenced until they finish
+_background_tasks = set()
+
+def extract_citations(text: str) -> list[int]:
+    """Extract citation numbers from the AI response."""
+    citations = list(set(int(match) for match in re.findall(r'\[(\d+)\]', text)))
+    citations.sort()
+    return citations
+
+def run_in_background(fn, *args):
+    """Run fn on its own thread and return a future for its result"""
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(fn, *args)
+    executor.shutdown(wait=False)
+    return future
+
+def refresh_search_in_background(query: str, num_results: int, search_params: Dict[str, Any], search_engine, cache_manager):
+    """
+    Re-run a search on a background thread and update its cache entry. Only one
+    caller refreshes an entry at a time, across processes sharing the cache.
+    """
+    def refresh():
+        if not cache_manager.lease(query, 'search', search_params):
+            # Someone else is already refreshing (or computing) it
+            return
+        try:
+            # A refresh that finished between our stale read and the lease is enough
+            if cache_manager.get(query, 'search', search_params) is None:
+                cache_manager.set(query, 'search', search_engine.search(query, num_results), search_params)
+        except Exception:
+            # The stale entry keeps being served until it expires
+            pass
+        finally:
+            cache_manager.release(query, 'search', search_params)
+    
+    run_in_background(refresh)
+
+def refresh_search_in_task(query: str, num_results: int, search_params: Dict[str, Any], search_engine, cache_manager):
+    """refresh_search_in_background for an AsyncSearchEngine: the refresh runs as a task on the running loop"""
+    import asyncio
+    
+    async def refresh():
+        if not await asyncio.to_thread(cache_manager.lease, query, 'search', search_params):
+            return
+        try:
+            if await asyncio.to_thread(cache_manager.get, query, 'search', search_params) is None:
+                results = await search_engine.search(query, num_results)
+                await asyncio.to_thread(cache_manager.set, query, 'search', results, search_params)
+        except Exception:
+            pass
+        finally:
+            await asyncio.to_thread(cache_manager.release, query, 'search', search_params)
+    
+    task = asyncio.get_running_loop().create_task(refresh())
+    # Fire-and-forget tasks must stay referenced until they finish
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def lookup_cached_search(query: str, num_results: int, search_engine, cache_manager=None,
+                         refresh: Callable = refresh_search_in_background) -> Dict[str, Any]:
+    """
+    Look up cached search results for a query. Stale entries are served for
+    time-insensitive queries and refreshed in the background with refresh;
+    results is None on a miss.
+    """
+    search_params = search_engine.cache_params(query, num_results) if cache_manager else None
+    lookup = {'results': None, 'params': search_params, 'cached': False, 'stale': False}
+    
+    if cache_manager:
+        with span("cache_lookup", type='search'):
+            cached_search, is_stale = cache_manager.get_with_staleness(query, 'search', search_params)
+        if cached_search and not is_stale:
+            lookup.update(results=cached_search, cached=True)
+        elif cached_search and not search_engine.query_optimizer.is_time_sensitive(query):
+            refresh(query, num_results, search_params, search_engine, cache_manager)
+            lookup.update(results=cached_search, cached=True, stale=True)
+    
+    return lookup
+
+def get_search_results(query: str, num_results: int, search_engine, cache_manager=None) -> Dict[str, Any]:
+    """Return search results for a query, from the cache when possible"""
+    search = lookup_cached_search(query, num_results, search_engine, cache_manager)
+    if search['results'] is None:
+        if cache_manager:
+            try:
+                # Identical searches already in flight are joined rather than repeated
+                search['results'] = cache_manager.get_or_compute(
+                    query, 'search', lambda: search_engine.search(query, num_results), search['params']
+                )
+            except Exception:
+                # While SerpAPI is failing, stale results beat none, even for time-sensitive queries
+                fallback = stale_fallback(query, 'search', search['params'], cache_manager)
+                if fallback is None:
+                    raise
+                search.update(results=fallback, cached=True, stale=True)
+        else:
+            search['results'] = search_engine.search(query, num_results)
+    return search
+
+async def get_search_results_async(query: str, num_results: int, search_engine, cache_manager=None) -> Dict[str, Any]:
+    """get_search_results for an AsyncSearchEngine; cache reads run off the event loop"""
+    import asyncio
+    
+    # The lookup runs on a worker thread, so a stale entry's refresh is handed back to the loop
+    loop = asyncio.get_running_loop()
+    refresh = partial(loop.call_soon_threadsafe, refresh_search_in_task)
+    search = await asyncio.to_thread(lookup_cached_search, query, num_results, search_engine, cache_manager, refresh)
+    if search['results'] is None:
+        if cache_manager:
+            try:
+                search['results'] = await cache_manager.get_or_compute_async(
+                    query, 'search', lambda: search_engine.search(query, num_results), search['params']
+                )
+            except Exception:
+                fallback = await asyncio.to_thread(stale_fallback, query, 'search', search['params'], cache_manager)
+                if fallback is None:
+                    raise
+                search.update(results=fallback, cached=True, stale=True)
+        else:
+            search['results'] = await search_engine.search(query, num_results)
+    return search
+
+def stale_fallback(query: str, cache_type: str, params: Dict[str, Any], cache_manager=None) -> Optional[Any]:
+    """A cached entry past its freshness TTL but not yet expired, served when its backend fails"""
+    if not cache_manager:
+        return None
+    data, _ = cache_manager.get_with_staleness(query, cache_type, params)
+    return data
+
+class ChunkLog:
+    """
+    Records the boundaries and arrival times of a streamed answer so the cached
+    answer can be replayed as the same stream. Each chunk is stored as
+    [offset_ms, length] against the full text, which is stored only once.
+    """
+    
+    def __init__(self):
+        self._started = time.monotonic()
+        self._parts = []
+        self.chunks = []
+    
+    def append(self, text: str) -> None:
+        offset_ms = int((time.monotonic() - self._started) * 1000)
+        self._parts.append(text)
+        # Chunks arriving within the same few milliseconds are indistinguishable on replay
+        if self.chunks and offset_ms - self.chunks[-1][0] < CHUNK_MERGE_MS:
+            self.chunks[-1][1] += len(text)
+        else:
+            self.chunks.append([offset_ms, len(text)])
+    
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+def _replay_schedule(entry: Dict[str, Any]) -> Iterator[Tuple[float, str]]:
+    """A cached answer's chunks with the seconds after the start of the stream each arrived at"""
+    response = entry.get('response') or ''
+    chunks = entry.get('chunks') or [[0, len(response)]]
+    position = 0
+    
+    for offset_ms, length in chunks:
+        yield offset_ms / 1000, response[position:position + length]
+        position += length
+    
+    # Anything the log does not cover (it should not happen) is still delivered
+    if position < len(response):
+        yield chunks[-1][0] / 1000, response[position:]
+
+def replay_answer(entry: Dict[str, Any], timed: bool = False) -> Iterator[str]:
+    """
+    Yield a cached answer chunk by chunk, instantly or with its original timing.
+    Entries cached without a chunk log replay as a single chunk.
+    """
+    started = time.monotonic()
+    for offset, text in _replay_schedule(entry):
+        delay = started + offset - time.monotonic()
+        if timed and delay > 0:
+            time.sleep(delay)
+        yield text
+
+async def replay_answer_async(entry: Dict[str, Any], timed: bool = False):
+    """replay_answer without blocking the event loop while it waits"""
+    import asyncio
+    
+    started = time.monotonic()
+    for offset, text in _replay_schedule(entry):
+        delay = started + offset - time.monotonic()
+        if timed and delay > 0:
+            await asyncio.sleep(delay)
+        yield text
+
+def find_similar_answer(query: str, num_results: int, model: str, search_engine, cache_manager=None) -> Optional[Dict[str, Any]]:
+    """
+    Cached search results and answer of an earlier, near-duplicate query, if the
+    cache has a semantic index. Time-sensitive queries always get a fresh answer.
+    """
+    semantic = cache_manager.semantic if cache_manager else None
+    if semantic is None or search_engine.query_optimizer.is_time_sensitive(query):
+        return None
+    
+    with span("semantic_lookup"):
+        match = semantic.lookup(query, {'num_results': num_results, 'model': model})
+    if match is None:
+        return None
+    
+    results = cache_manager.get(match['query'], 'search', match['search_params'])
+    answer = cache_manager.get(match['query'], 'ai_response', match['ai_params'])
+    # Both halves must still be fresh, and a match must not need any API call
+    if not results or not answer or answer.get('model') != model or 'follow_up_questions' not in answer:
+        return None
+    return {
+        'query': match['query'],
+        'similarity': match['similarity'],
+        'search_params': match['search_params'],
+        'ai_params': match['ai_params'],
+        'results': results,
+        'answer': answer
+    }
+
+def remember_answer(query: str, num_results: int, model: str, search_params: Dict[str, Any], ai_params: Dict[str, Any], cache_manager=None) -> None:
+    """Add a freshly cached answer to the semantic index, if there is one"""
+    if cache_manager and cache_manager.semantic is not None:
+        cache_manager.semantic.add(
+            query,
+            {'num_results': num_results, 'model': model},
+            {'query': query, 'search_params': search_params, 'ai_params': ai_params}
+        )
+
+def answer_params(query: str, model: str, search: Dict[str, Any], similar: Optional[Dict[str, Any]] = None,
+                  cache_manager=None) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Cache parameters of a query's answer and the fresh cached answer, if any"""
+    if similar:
+        return similar['ai_params'], similar['answer']
+    if not cache_manager:
+        return None, None
+    ai_params = {**search['params'], 'model': model}
+    return ai_params, cache_manager.get(query, 'ai_response', ai_params)
+
+def stale_answer(query: str, model: str, ai_params: Dict[str, Any], cache_manager=None) -> Optional[Dict[str, Any]]:
+    """An answer past its freshness TTL, served when generating a new one fails before any output"""
+    entry = stale_fallback(query, 'ai_response', ai_params, cache_manager)
+    return entry if entry and entry.get('model') == model else None
+
+def store_answer(query: str, num_results: int, model: str, answer: str, follow_up_questions: List[str],
+                 chunks: Optional[List[List[int]]], search_params: Dict[str, Any], ai_params: Dict[str, Any], cache_manager=None) -> None:
+    """Cache a freshly generated answer and index it for near-duplicate queries"""
+    if cache_manager and answer:
+        with span("cache_write"):
+            cache_manager.set(query, 'ai_response', answer_cache_entry(answer, model, follow_up_questions, chunks), ai_params)
+            remember_answer(query, num_results, model, search_params, ai_params, cache_manager)
+
+def claim_answer(query: str, model: str, ai_params: Dict[str, Any], cache_manager=None,
+                 cached_ai: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Make sure only one caller, in any process sharing the cache, generates a given
+    answer. Without a cached answer, either lease it (leased is True and the caller
+    must release it once the answer is stored) or wait for the caller holding the
+    lease and return what it stored. Returns (cached answer for model or None, leased).
+    """
+    leased = False
+    if cache_manager and cached_ai is None:
+        leased = cache_manager.lease(query, 'ai_response', ai_params)
+        if leased:
+            # The previous holder may have stored it between our lookup and the lease
+            cached_ai = cache_manager.get(query, 'ai_response', ai_params)
+        else:
+            cached_ai = cache_manager.wait_for(query, 'ai_response', ai_params)
+    if not (cached_ai and cached_ai.get('model') == model):
+        cached_ai = None
+    return cached_ai, leased
+
+def answer_cache_entry(response: str, model: str, follow_up_questions: List[str], chunks: Optional[List[List[int]]] = None) -> Dict[str, Any]:
+    """Build the cached form of an answer; follow-ups are stored with it so cache hits need no API call"""
+    entry = {'response': response, 'model': model}
+    if chunks:
+        entry['chunks'] = chunks
+    # A failed follow-up generation is retried next time rather than cached
+    if not any(question.startswith(FOLLOW_UP_ERROR_PREFIX) for question in follow_up_questions):
+        entry['follow_up_questions'] = follow_up_questions
+    return entry
+
+def cited_sources(citations: List[int], search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The search results referenced by the given citation numbers"""
+    by_index = {result['index']: result for result in search_results}
+    return [
+        {'index': citation, 'title': by_index[citation]['title'], 'link': by_index[citation]['link'], 'source': by_index[citation]['source']}
+        for citation in citations if citation in by_index
+    ]
+
+def _query_steps(query: str, num_results: int, model: str, search_engine, cache_manager=None,
+                 timed_replay: bool = False) -> Iterator[Tuple]:
+    """
+    The event sequence of query_events, independent of how its I/O is done. Yields
+    ('event', event) for each event and (operation, *args) for each call the driver
+    makes on its behalf, sending back the result or throwing in the exception:
+    'call' runs a blocking cache function, 'search' gets the search results,
+    'claim' runs claim_answer, 'follow_ups' starts generating follow-ups and
+    'follow_ups_result' waits for them, 'stream' and 'replay' open a fresh or
+    cached answer and 'next_chunk' reads it, returning None at its end.
+    """
+    started = time.monotonic()
+    timing = {}
+    
+    similar = yield 'call', find_similar_answer, query, num_results, model, search_engine, cache_manager
+    if similar:
+        search = {'results': similar['results'], 'params': similar['search_params'], 'cached': True, 'stale': False}
+    else:
+        try:
+            search = yield 'search', query, num_results
+        except Exception as e:
+            yield 'event', {'event': 'error', 'stage': 'search', 'message': str(e)}
+            return
+    search_results = search['results']
+    timing['search'] = time.monotonic() - started
+    search_event = {'event': 'search_results', 'query': query, 'results': search_results, 'cached': search['cached'], 'stale': search['stale']}
+    if similar:
+        search_event['similar_to'] = {'query': similar['query'], 'similarity': similar['similarity']}
+    yield 'event', search_event
+    
+    if search_results:
+        ai_params, cached_ai = yield 'call', answer_params, query, model, search, similar, cache_manager
+        
+        # Only one caller generates a given answer; identical queries in flight wait for it.
+        # The driver releases the lease once the sequence ends.
+        cached_ai = yield 'claim', query, model, ai_params, cached_ai
+        
+        # Follow-ups only need the search results, so they run alongside the answer
+        follow_ups = None
+        if cached_ai is None or 'follow_up_questions' not in cached_ai:
+            follow_ups = yield 'follow_ups', query, search_results, model
+        
+        answer_started = time.monotonic()
+        stream_started = time.perf_counter()
+        chunk_log = None
+        reset_last_pack()
+        if cached_ai:
+            stream = yield 'replay', cached_ai, timed_replay
+        else:
+            chunk_log = ChunkLog()
+            stream = yield 'stream', query, search_results, model
+        
+        chunks = []
+        
+        def deltas(stream, chunk_log):
+            while True:
+                chunk = yield 'next_chunk', stream
+                if chunk is None:
+                    return
+                if chunk:
+                    if not chunks:
+                        timing['time_to_first_token'] = time.monotonic() - answer_started
+                        record("time_to_first_token", stream_started, time.perf_counter())
+                    chunks.append(chunk)
+                    if chunk_log is not None:
+                        chunk_log.append(chunk)
+                    yield 'event', {'event': 'answer_delta', 'text': chunk, 'cached': chunk_log is None}
+        
+        fell_back = False
+        try:
+            yield from deltas(stream, chunk_log)
+        except Exception as e:
+            # If nothing was shown yet, an expired cached answer stands in for a failed generation
+            stale_ai = None
+            if chunk_log is not None and not chunks:
+                stale_ai = yield 'call', stale_answer, query, model, ai_params, cache_manager
+            if not stale_ai:
+                yield 'event', {'event': 'error', 'stage': 'answer', 'message': str(e)}
+                return
+            cached_ai, chunk_log, fell_back = stale_ai, None, True
+            stream = yield 'replay', stale_ai, timed_replay
+            yield from deltas(stream, None)
+        answer = "".join(chunks)
+        timing['answer'] = time.monotonic() - answer_started
+        record("answer_stream", stream_started, time.perf_counter(), cached=chunk_log is None)
+        _packing_timing(timing)
+        
+        citations = extract_citations(answer)
+        yield 'event', {'event': 'citations', 'citations': citations, 'sources': cited_sources(citations, search_results)}
+        
+        if fell_back and cached_ai.get('follow_up_questions'):
+            follow_up_questions = cached_ai['follow_up_questions']
+        elif follow_ups is not None:
+            follow_up_questions = yield 'follow_ups_result', follow_ups
+        else:
+            follow_up_questions = cached_ai['follow_up_questions']
+        yield 'event', {'event': 'follow_ups', 'questions': follow_up_questions}
+        
+        # A stale fallback is not re-cached as if it were fresh
+        if follow_ups is not None and not fell_back:
+            chunk_entries = chunk_log.chunks if chunk_log is not None else cached_ai.get('chunks')
+            yield ('call', store_answer, query, num_results, model, answer, follow_up_questions, chunk_entries,
+                   search['params'], ai_params, cache_manager)
+    
+    timing['total'] = time.monotonic() - started
+    yield 'event', {'event': 'timing', **timing}
+
+def query_events(query: str, num_results: int, model: str, search_engine, ai_processor, cache_manager=None,
+                 timed_replay: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Run the search/answer/follow-up pipeline as a stream of structured events:
+    search_results, answer_delta (one per chunk), citations, follow_ups and timing,
+    or a final error event if the search or answer fails. Cached answers are replayed as
+    the same deltas, with their original timing if timed_replay is set. When a
+    backend fails, stale cached results or answers are served if there are any.
+    """
+    steps = _query_steps(query, num_results, model, search_engine, cache_manager, timed_replay)
+    leases = []
+    result = error = None
+    try:
+        while True:
+            try:
+                step = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration:
+                return
+            operation, args = step[0], step[1:]
+            result = error = None
+            if operation == 'event':
+                yield args[0]
+                continue
+            try:
+                if operation == 'call':
+                    result = args[0](*args[1:])
+                elif operation == 'search':
+                    result = get_search_results(*args, search_engine, cache_manager)
+                elif operation == 'claim':
+                    result, leased = claim_answer(*args[:3], cache_manager, args[3])
+                    if leased:
+                        leases.append(args[2])
+                elif operation == 'follow_ups':
+                    result = run_in_background(ai_processor.generate_follow_up_questions, *args)
+                elif operation == 'follow_ups_result':
+                    result = args[0].result()
+                elif operation == 'stream':
+                    result = iter(ai_processor.generate_response_with_citations_stream(*args))
+                elif operation == 'replay':
+                    result = replay_answer(*args)
+                elif operation == 'next_chunk':
+                    result = next(args[0], None)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+        for ai_params in leases:
+            cache_manager.release(query, 'ai_response', ai_params)
+
+def _packing_timing(timing: Dict[str, Any]) -> None:
+    """Add the context tokens of the prompt just built, and those packing saved, to a timing event"""
+    packing = last_pack()
+    if packing is not None:
+        timing['context_tokens'] = packing['tokens']
+        timing['tokens_saved'] = packing['tokens_saved']
+
+def _new_answer(query: str) -> Dict[str, Any]:
+    return {
+        'query': query,
+        'answer': '',
+        'citations': [],
+        'sources': [],
+        'follow_up_questions': [],
+        'search_results': [],
+        'cached': {'search': False, 'answer': False},
+        'timing': {}
+    }
+
+def _fold_event(result: Dict[str, Any], event: Dict[str, Any]) -> None:
+    """Apply one query event to an answer_query result"""
+    kind = event['event']
+    if kind == 'error':
+        raise Exception(event['message'])
+    elif kind == 'search_results':
+        result['search_results'] = event['results']
+        result['cached']['search'] = event['cached']
+        if 'similar_to' in event:
+            result['similar_to'] = event['similar_to']
+    elif kind == 'answer_delta':
+        result['answer'] += event['text']
+        result['cached']['answer'] = event['cached']
+    elif kind == 'citations':
+        result['citations'] = event['citations']
+        result['sources'] = event['sources']
+    elif kind == 'follow_ups':
+        result['follow_up_questions'] = event['questions']
+    elif kind == 'timing':
+        result['timing'] = {key: value for key, value in event.items() if key != 'event'}
+
+def answer_query(query: str, num_results: int, model: str, search_engine, ai_processor, cache_manager=None) -> Dict[str, Any]:
+    """Search, synthesize a cited answer and generate follow-ups without any rendering"""
+    result = _new_answer(query)
+    for event in query_events(query, num_results, model, search_engine, ai_processor, cache_manager):
+        _fold_event(result, event)
+    return result
+
+async def query_events_async(query: str, num_results: int, model: str, search_engine, ai_processor, cache_manager=None,
+                             timed_replay: bool = False):
+    """
+    query_events for an AsyncSearchEngine and AsyncAIProcessor, so many queries
+    can run concurrently on one event loop. Cache reads and writes, and waits on
+    other callers' leases, run off the loop.
+    """
+    import asyncio
+    
+    steps = _query_steps(query, num_results, model, search_engine, cache_manager, timed_replay)
+    leases = []
+    follow_up_task = None
+    result = error = None
+    try:
+        while True:
+            try:
+                step = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration:
+                return
+            operation, args = step[0], step[1:]
+            result = error = None
+            if operation == 'event':
+                yield args[0]
+                continue
+            try:
+                if operation == 'call':
+                    result = await asyncio.to_thread(*args)
+                elif operation == 'search':
+                    result = await get_search_results_async(*args, search_engine, cache_manager)
+                elif operation == 'claim':
+                    result, leased = await asyncio.to_thread(claim_answer, *args[:3], cache_manager, args[3])
+                    if leased:
+                        leases.append(args[2])
+                elif operation == 'follow_ups':
+                    result = follow_up_task = asyncio.create_task(ai_processor.generate_follow_up_questions(*args))
+                elif operation == 'follow_ups_result':
+                    result = await args[0]
+                elif operation == 'stream':
+                    result = ai_processor.generate_response_with_citations_stream(*args)
+                elif operation == 'replay':
+                    result = replay_answer_async(*args)
+                elif operation == 'next_chunk':
+                    result = await anext(args[0], None)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+        if follow_up_task and not follow_up_task.done():
+            follow_up_task.cancel()
+        for ai_params in leases:
+            await asyncio.to_thread(cache_manager.release, query, 'ai_response', ai_params)
+
+async def answer_query_async(query: str, num_results: int, model: str, search_engine, ai_processor, cache_manager=None,
+                             on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """answer_query on the event loop; on_chunk receives answer deltas as they stream"""
+    result = _new_answer(query)
+    async for event in query_events_async(query, num_results, model, search_engine, ai_processor, cache_manager):
+        if event['event'] == 'answer_delta' and on_chunk:
+            on_chunk(event['text'])
+        _fold_event(result, event)
+    return result
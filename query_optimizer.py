@@ -4,7 +4,23 @@ import re
 from typing import List, Tuple
 from datetime import datetime
 
+# Words that never change what a search query is about
+STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'of', 'to', 'in', 'on',
+    'for', 'and', 'or', 'do', 'does', 'did', 'please', 'me', 'about', 's'
+}
+
+def normalize_query(query: str) -> str:
+    """Reduce a query to a canonical form so trivially different phrasings share a cache entry"""
+    words = re.sub(r'[^\w\s]', ' ', query.lower()).split()
+    content_words = [word for word in words if word not in STOPWORDS]
+    # A query made only of stopwords still needs a distinct key
+    return ' '.join(content_words or words)
+
 class QueryOptimizer:
+    # Queries mentioning these want fresh results
+    TIME_KEYWORDS = ['latest', 'recent', 'current', 'today', 'now', 'trending']
+    
     def __init__(self):
         self.current_year = datetime.now().year
         self.current_month = datetime.now().strftime("%B")
@@ -18,8 +34,7 @@ class QueryOptimizer:
         alternatives = []
         
         # Time-sensitive optimization
-        time_keywords = ['latest', 'recent', 'current', 'today', 'now', 'trending']
-        if any(keyword in query for keyword in time_keywords):
+        if self.is_time_sensitive(query):
             # Add current time context
             if 'latest' in query or 'recent' in query:
                 alternatives.append(f"{original_query} {self.current_month} {self.current_year}")
@@ -63,4 +78,9 @@ class QueryOptimizer:
         """Determine if we should try alternative queries"""
         # Use alternatives for vague or general queries
         vague_indicators = ['latest', 'news', 'trending', 'current', 'what is', 'how to']
-        return any(indicator in query.lower() for indicator in vague_indicators)
\ No newline at end of file
+        return any(indicator in query.lower() for indicator in vague_indicators)
+    
+    def is_time_sensitive(self, query: str) -> bool:
+        """Determine if results for this query go out of date quickly"""
+        query = query.lower()
+        return any(keyword in query for keyword in self.TIME_KEYWORDS)
\ No newline at end of file
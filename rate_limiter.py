@@ -0,0 +1,142 @@
+"""Token-bucket rate limits on API calls, shared by every process on the machine"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+def key_id(api_key: str) -> str:
+    """Short fingerprint of an API key, so buckets are per account without storing the key"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+class BucketStore(ABC):
+    """Holds the (tokens, updated) state of named buckets"""
+    
+    @abstractmethod
+    def take(self, name: str, amount: float, rate: float, capacity: float) -> float:
+        """
+        Refill a bucket at rate tokens per second up to capacity, then take amount
+        from it, going into debt if there are not enough. Returns how many seconds the
+        caller must wait before its call, which is 0 unless the bucket was in debt.
+        """
+
+def _refill_and_take(state: Optional[Tuple[float, float]], now: float, amount: float, rate: float, capacity: float) -> Tuple[float, float]:
+    """New token count and wait in seconds for a take from a bucket in state"""
+    if state is None:
+        tokens = capacity
+    else:
+        tokens, updated = state
+        # max() guards against the wall clock stepping backwards
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    tokens -= amount
+    return tokens, (-tokens / rate if tokens < 0 else 0.0)
+
+class MemoryBucketStore(BucketStore):
+    """Buckets shared by the threads of one process"""
+    
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def take(self, name: str, amount: float, rate: float, capacity: float) -> float:
+        with self._lock:
+            now = time.time()
+            tokens, wait = _refill_and_take(self._buckets.get(name), now, amount, rate, capacity)
+            self._buckets[name] = (tokens, now)
+        return wait
+
+class SQLiteBucketStore(BucketStore):
+    """
+    Buckets in a SQLite file, so every process using the same file draws from
+    the same budget. Each take is one short write transaction.
+    """
+    
+    def __init__(self, db_path: str, busy_timeout: float = 30.0):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+    
+    def take(self, name: str, amount: float, rate: float, capacity: float) -> float:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens, wait = _refill_and_take(row, now, amount, rate, capacity)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                    (name, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+    
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class TokenBucket:
+    """
+    A token bucket allowing `rate` units per second on average with bursts of up
+    to `capacity` (default: one second's worth). Callers reserve units before a
+    call and wait out any debt, so concurrent callers queue up in order instead
+    of all firing and being rejected.
+    """
+    
+    def __init__(self, name: str, rate: float, capacity: Optional[float] = None, store: Optional[BucketStore] = None):
+        if rate <= 0:
+            raise Exception(f"Rate limit for {name} must be positive")
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.store = store if store is not None else MemoryBucketStore()
+        self.waited = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+    
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take amount units now and return the seconds to wait before using them"""
+        wait = self.store.take(self.name, amount, self.rate, self.capacity)
+        with self._lock:
+            self.calls += 1
+            self.waited += wait
+        return wait
+    
+    def acquire(self, amount: float = 1.0) -> None:
+        """Block until amount units may be used"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+    
+    async def acquire_async(self, amount: float = 1.0) -> None:
+        """acquire() that waits on the event loop; the store update, a SQLite write for shared buckets, runs off it"""
+        import asyncio
+        
+        wait = await asyncio.to_thread(self.reserve, amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {'calls': self.calls, 'waited': self.waited}
+    
+    @classmethod
+    def per_minute(cls, name: str, limit: float, store: Optional[BucketStore] = None) -> "TokenBucket":
+        """A bucket for quotas stated per minute (e.g. OpenAI tokens/min), allowing a minute's worth as a burst"""
+        return cls(name, limit / 60.0, capacity=limit, store=store)
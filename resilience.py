@@ -0,0 +1,202 @@
+"""Retries with backoff and circuit breaking around calls to the SerpAPI and OpenAI backends"""
+
+import random
+import threading
+import time
+from typing import Dict, Any, Callable, Optional
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server-side failures
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Exception classes (matched by name so requests, httpx and openai need not be imported)
+# raised when a request timed out or the connection failed before an answer
+RETRYABLE_ERRORS = {
+    'TimeoutError', 'ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout', 'ChunkedEncodingError',
+    'TimeoutException', 'NetworkError', 'RemoteProtocolError', 'APIConnectionError', 'APITimeoutError'
+}
+
+class BackendError(Exception):
+    """A backend answered with an HTTP error status, or a request to it failed"""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: Optional[bool] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        # Set when this error stands in for another one, whose retryability it keeps
+        self.retryable = retryable
+
+class CircuitOpenError(Exception):
+    """A call was refused without being attempted because its backend's circuit is open"""
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed call may succeed if repeated"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if getattr(error, 'retryable', None) is not None:
+        return error.retryable
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUSES
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the delay before retry n is uniform in
+    [0, min(max_delay, base_delay * 2**n)], so clients that failed together do not retry together
+    """
+    
+    def __init__(self, retries: int = 2, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+class CircuitBreaker:
+    """
+    Tracks the health of one backend. After failure_threshold consecutive
+    failures the circuit opens and calls are refused for reset_timeout seconds;
+    then a single trial call is let through (half-open), which closes the
+    circuit if it succeeds and reopens it if it fails.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+    
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+    
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; refusals are counted"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED or (state == self.HALF_OPEN and not self._trial_running):
+                self._trial_running = state == self.HALF_OPEN
+                self.calls += 1
+                return True
+            self.rejected += 1
+            return False
+    
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a trial call through"""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+    
+    def record_failure(self, error: Optional[Exception] = None) -> None:
+        with self._lock:
+            self.failures += 1
+            self._failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+    
+    def reset(self) -> None:
+        """Close the circuit and forget consecutive failures"""
+        self.record_success()
+    
+    def stats(self) -> Dict[str, Any]:
+        """State and counters for monitoring"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_after': max(0.0, self._opened_at + self.reset_timeout - time.monotonic()) if state == self.OPEN else 0.0,
+                'calls': self.calls,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'last_error': self.last_error
+            }
+
+class Resilience:
+    """Runs calls to one backend through its circuit breaker, retrying retryable failures"""
+    
+    def __init__(self, name: str, retry_policy: Optional[RetryPolicy] = None, circuit_breaker: Optional[CircuitBreaker] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.name = name
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker(name)
+        self._sleep = sleep
+    
+    def _check_circuit(self) -> None:
+        if not self.circuit_breaker.allow():
+            raise CircuitOpenError(
+                f"{self.name} is unavailable after repeated failures; "
+                f"retrying in {self.circuit_breaker.retry_after():.0f}s"
+            )
+    
+    def _record(self, error: Exception) -> bool:
+        """Record a failed attempt; True if it should be retried"""
+        if is_retryable(error):
+            self.circuit_breaker.record_failure(error)
+            return True
+        # The backend answered, it just refused this request (bad key, bad query, ...)
+        self.circuit_breaker.record_success()
+        return False
+    
+    def call(self, fn: Callable, *args, **kwargs):
+        """Call fn, retrying retryable errors with backoff; raises CircuitOpenError while the backend is unhealthy"""
+        for attempt in range(self.retry_policy.retries + 1):
+            self._check_circuit()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self._record(e) or attempt == self.retry_policy.retries:
+                    raise
+                self._sleep(self.retry_policy.delay(attempt))
+                continue
+            self.circuit_breaker.record_success()
+            return result
+    
+    async def acall(self, fn: Callable, *args, **kwargs):
+        """call() for coroutine functions, sleeping on the event loop between attempts"""
+        import asyncio
+        
+        for attempt in range(self.retry_policy.retries + 1):
+            self._check_circuit()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                if not self._record(e) or attempt == self.retry_policy.retries:
+                    raise
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                continue
+            self.circuit_breaker.record_success()
+            return result
+    
+    def stats(self) -> Dict[str, Any]:
+        return self.circuit_breaker.stats()
@@ -1,64 +1,353 @@
 import os
-from typing import List, Dict, Any
-from serpapi import GoogleSearch
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from datetime import datetime
-from query_optimizer import QueryOptimizer
+from query_optimizer import QueryOptimizer, normalize_query
+from resilience import Resilience, RetryPolicy, CircuitBreaker, BackendError, RETRYABLE_STATUSES, is_retryable
+from rate_limiter import TokenBucket
+from tracing import span
+
+SERPAPI_URL = "https://serpapi.com/search.json"
+
+# (connect, read) timeouts in seconds for SerpAPI requests
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+# Query parameters that only track the click and never change the page content
+TRACKING_PARAMS = {'gclid', 'fbclid', 'ref', 'ref_src'}
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL so the same page found by different queries compares equal"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    
+    netloc = parts.netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    ]
+    path = parts.path.rstrip('/') or '/'
+    
+    # Scheme and fragment never distinguish two search results
+    return urlunsplit(('', netloc, path, urlencode(sorted(query)), ''))
+
+def format_results(results: Dict[str, Any], num_results: int) -> List[Dict[str, Any]]:
+    """Convert a raw SerpAPI response into the indexed result dicts used for citations"""
+    formatted_results = []
+    
+    # Process organic results
+    if "organic_results" in results:
+        for idx, result in enumerate(results["organic_results"][:num_results]):
+            formatted_results.append({
+                "index": idx + 1,
+                "title": result.get("title", ""),
+                "link": result.get("link", ""),
+                "snippet": result.get("snippet", ""),
+                "source": result.get("source", result.get("link", "").split("/")[2] if "/" in result.get("link", "") else ""),
+                "date": result.get("date", "")
+            })
+    
+    # Add answer box if available
+    if "answer_box" in results:
+        answer_box = results["answer_box"]
+        formatted_results.insert(0, {
+            "index": 0,
+            "title": "Featured Answer",
+            "link": answer_box.get("link", ""),
+            "snippet": answer_box.get("answer", answer_box.get("snippet", "")),
+            "source": "Answer Box",
+            "date": ""
+        })
+    
+    return formatted_results
+
+def merge_results(result_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Merge result lists from several queries, dropping duplicate URLs and
+    re-indexing so citation numbers match the merged order
+    """
+    merged = []
+    seen_urls = set()
+    answer_box = None
+    
+    # Keep the first featured answer (the original query comes first)
+    for results in result_lists:
+        for result in results:
+            if result['index'] == 0 and answer_box is None:
+                answer_box = result
+    
+    # Interleave by rank so every query contributes its best results first
+    organic_lists = [[r for r in results if r['index'] != 0] for results in result_lists]
+    longest = max((len(results) for results in organic_lists), default=0)
+    for rank in range(longest):
+        for results in organic_lists:
+            if rank >= len(results):
+                continue
+            result = results[rank]
+            url = canonicalize_url(result['link']) if result['link'] else None
+            if url and url in seen_urls:
+                continue
+            if url:
+                seen_urls.add(url)
+            merged.append({**result, "index": len(merged) + 1})
+    
+    if answer_box is not None:
+        merged.insert(0, answer_box)
+    
+    return merged
+
+def redact_api_key(text: str, api_key: str) -> str:
+    """Text with the API key removed, including from URLs quoted in it"""
+    if api_key:
+        text = text.replace(api_key, "***")
+    return re.sub(r"(api_key=)[^&\s'\"]+", r"\1***", text)
+
+def _request_error(error: Exception, api_key: str) -> BackendError:
+    """
+    A failed request's error, safe to show, log or report in --health: requests
+    and httpx quote the full URL, and the SerpAPI key is in its query string
+    """
+    if isinstance(error, BackendError):
+        return error
+    return BackendError(
+        redact_api_key(f"{type(error).__name__}: {error}", api_key),
+        status_code=getattr(getattr(error, 'response', None), 'status_code', None),
+        retryable=is_retryable(error)
+    )
+
+def _check_status(status_code: int) -> None:
+    """Raise for HTTP statuses that mean SerpAPI could not serve the request right now"""
+    if status_code in RETRYABLE_STATUSES:
+        raise BackendError(f"SerpAPI returned HTTP {status_code}", status_code)
 
 class SearchEngine:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, multi_query: bool = False, max_workers: int = 4, base_url: str = SERPAPI_URL,
+                 pool_size: int = 10, timeout: Tuple[float, float] = DEFAULT_TIMEOUT, session: Optional["requests.Session"] = None,
+                 retry_policy: Optional[RetryPolicy] = None, circuit_breaker: Optional[CircuitBreaker] = None,
+                 rate_limiter: Optional[TokenBucket] = None, page_fetcher: Optional["PageFetcher"] = None):
         self.api_key = api_key
         self.query_optimizer = QueryOptimizer()
+        self.multi_query = multi_query
+        self.max_workers = max_workers
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = session
+        self._session_lock = threading.Lock()
+        # Timeouts, 429s and 5xx are retried with backoff; repeated failures open the circuit
+        self.resilience = Resilience("SerpAPI", retry_policy, circuit_breaker)
+        # Every request, retries included, draws from the SerpAPI quota
+        self.rate_limiter = rate_limiter
+        # When set, results carry passages from their pages for the answer prompt
+        self.page_fetcher = page_fetcher
+    
+    @property
+    def session(self) -> "requests.Session":
+        """
+        The pooled HTTP session shared by every search from this engine, created on
+        first use. Keep-alive connections are reused across queries, so back-to-back
+        searches (agent mode, batches, multi-query fan-out) skip DNS, TCP and TLS setup.
+        """
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._create_session()
+        return self._session
+    
+    def _create_session(self) -> "requests.Session":
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        session = requests.Session()
+        # Enough pooled connections for the widest fan-out so none are thrown away
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.pool_size, self.max_workers))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
     
     def search(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """
         Perform a web search using SerpAPI with query optimization
         """
+        with span("search", query=query):
+            results = self._search(query, num_results)
+        
+        if self.page_fetcher:
+            with span("page_fetch_round", pages=self.page_fetcher.top_n):
+                results = self.page_fetcher.enrich(query, results)
+        return results
+    
+    def _search(self, query: str, num_results: int) -> List[Dict[str, Any]]:
         # Optimize query if needed
         optimized_query, alternatives = self.query_optimizer.optimize_query(query)
         
-        # Use optimized query
-        params = {
+        if not self._use_alternatives(query, alternatives):
+            return self._search_single(optimized_query, num_results)
+        
+        # Fan out the original and alternative queries over a bounded pool
+        queries = [optimized_query] + alternatives
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(queries))) as executor:
+            futures = [executor.submit(self._search_single, q, num_results) for q in queries]
+            
+            result_lists = []
+            for idx, future in enumerate(futures):
+                try:
+                    result_lists.append(future.result())
+                except Exception:
+                    # Alternatives only broaden recall, the original query must succeed
+                    if idx == 0:
+                        raise
+        
+        return merge_results(result_lists)
+    
+    def cache_params(self, query: str, num_results: int) -> Dict[str, Any]:
+        """Parameters that change what search() returns for a query, for cache keying"""
+        params = {"num_results": num_results}
+        if self.page_fetcher:
+            # Results with page passages are a different cache entry from snippet-only ones
+            params["fetch_pages"] = self.page_fetcher.top_n
+        
+        _, alternatives = self.query_optimizer.optimize_query(query)
+        if self._use_alternatives(query, alternatives):
+            params["alternatives"] = [normalize_query(alternative) for alternative in alternatives]
+        
+        return params
+    
+    def _use_alternatives(self, query: str, alternatives: List[str]) -> bool:
+        """Whether this query should fan out to its alternatives"""
+        return bool(self.multi_query and alternatives and self.query_optimizer.should_use_alternatives(query))
+    
+    def _build_params(self, query: str, num_results: int) -> Dict[str, Any]:
+        """Build the SerpAPI request parameters"""
+        return {
             "api_key": self.api_key,
             "engine": "google",
-            "q": optimized_query,
+            "q": query,
             "num": num_results,
             "hl": "en",
             "gl": "us"
         }
+    
+    def _search_single(self, query: str, num_results: int) -> List[Dict[str, Any]]:
+        """Run a single SerpAPI query and format its results"""
+        params = self._build_params(query, num_results)
         
         try:
-            search = GoogleSearch(params)
-            results = search.get_dict()
+            results = self.resilience.call(self._fetch, params)
             
             if "error" in results:
                 raise Exception(results["error"])
             
-            formatted_results = []
-            
-            # Process organic results
-            if "organic_results" in results:
-                for idx, result in enumerate(results["organic_results"][:num_results]):
-                    formatted_results.append({
-                        "index": idx + 1,
-                        "title": result.get("title", ""),
-                        "link": result.get("link", ""),
-                        "snippet": result.get("snippet", ""),
-                        "source": result.get("source", result.get("link", "").split("/")[2] if "/" in result.get("link", "") else ""),
-                        "date": result.get("date", "")
-                    })
+            return format_results(results, num_results)
+        except Exception as e:
+            raise Exception(f"An error occurred during the search: {e}")
+    
+    def _fetch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """One SerpAPI request; statuses worth retrying raise, other errors come back in the JSON body"""
+        if self.rate_limiter:
+            with span("rate_limit_wait", backend="serpapi"):
+                self.rate_limiter.acquire()
+        with span("serpapi_request", query=params['q']):
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                _check_status(response.status_code)
+                return response.json()
+            except Exception as e:
+                raise _request_error(e, self.api_key) from None
+    
+    def close(self) -> None:
+        """Close the pooled HTTP session"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+class AsyncSearchEngine(SearchEngine):
+    """SearchEngine variant that queries SerpAPI over a shared httpx.AsyncClient"""
+    
+    def __init__(self, api_key: str, multi_query: bool = False, max_workers: int = 4, base_url: str = SERPAPI_URL,
+                 pool_size: int = 10, timeout: Tuple[float, float] = DEFAULT_TIMEOUT, client: Optional["httpx.AsyncClient"] = None,
+                 retry_policy: Optional[RetryPolicy] = None, circuit_breaker: Optional[CircuitBreaker] = None,
+                 rate_limiter: Optional[TokenBucket] = None, page_fetcher: Optional["PageFetcher"] = None):
+        super().__init__(api_key, multi_query=multi_query, max_workers=max_workers, base_url=base_url, pool_size=pool_size,
+                         timeout=timeout, retry_policy=retry_policy, circuit_breaker=circuit_breaker, rate_limiter=rate_limiter,
+                         page_fetcher=page_fetcher)
+        if client is None:
+            import httpx
+            connect_timeout, read_timeout = timeout
+            pool = max(pool_size, max_workers)
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool)
+            )
+        self.client = client
+    
+    async def search(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+        """
+        Perform a web search using SerpAPI with query optimization
+        """
+        import asyncio
+        
+        results = await self._search(query, num_results)
+        if self.page_fetcher:
+            # Page fetching is blocking I/O on its own pool, kept off the event loop
+            results = await asyncio.to_thread(self.page_fetcher.enrich, query, results)
+        return results
+    
+    async def _search(self, query: str, num_results: int) -> List[Dict[str, Any]]:
+        import asyncio
+        
+        optimized_query, alternatives = self.query_optimizer.optimize_query(query)
+        
+        if not self._use_alternatives(query, alternatives):
+            return await self._search_single(optimized_query, num_results)
+        
+        # Same fan-out as the threaded engine, bounded by a semaphore instead of a pool
+        semaphore = asyncio.Semaphore(self.max_workers)
+        
+        async def bounded_search(q: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self._search_single(q, num_results)
+        
+        queries = [optimized_query] + alternatives
+        outcomes = await asyncio.gather(*[bounded_search(q) for q in queries], return_exceptions=True)
+        
+        # Alternatives only broaden recall, the original query must succeed
+        if isinstance(outcomes[0], Exception):
+            raise outcomes[0]
+        
+        return merge_results([outcome for outcome in outcomes if not isinstance(outcome, Exception)])
+    
+    async def _search_single(self, query: str, num_results: int) -> List[Dict[str, Any]]:
+        """Run a single SerpAPI query and format its results"""
+        params = self._build_params(query, num_results)
+        
+        try:
+            results = await self.resilience.acall(self._fetch_async, params)
             
-            # Add answer box if available
-            if "answer_box" in results:
-                answer_box = results["answer_box"]
-                formatted_results.insert(0, {
-                    "index": 0,
-                    "title": "Featured Answer",
-                    "link": answer_box.get("link", ""),
-                    "snippet": answer_box.get("answer", answer_box.get("snippet", "")),
-                    "source": "Answer Box",
-                    "date": ""
-                })
+            if "error" in results:
+                raise Exception(results["error"])
             
-            return formatted_results
+            return format_results(results, num_results)
         except Exception as e:
             raise Exception(f"An error occurred during the search: {e}")
+    
+    async def _fetch_async(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if self.rate_limiter:
+            await self.rate_limiter.acquire_async()
+        try:
+            response = await self.client.get(self.base_url, params=params)
+            _check_status(response.status_code)
+            return response.json()
+        except Exception as e:
+            raise _request_error(e, self.api_key) from None
+    
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client"""
+        await self.client.aclose()
@@ -0,0 +1,216 @@
+"""Local semantic index that maps near-duplicate queries to a previously cached answer"""
+
+import base64
+import json
+import os
+import threading
+import zlib
+from typing import Callable, Dict, Any, FrozenSet, Optional
+from query_optimizer import normalize_query
+
+# Question framing that rarely changes what is being asked; down-weighted rather than dropped
+FRAMING_WORDS = {
+    'how', 'what', 'why', 'when', 'which', 'who', 'explain', 'describe', 'tell', 'show',
+    'work', 'works', 'working', 'mean', 'means', 'meaning', 'define', 'definition',
+    'overview', 'guide', 'understand', 'can', 'you', 'i', 'we', 'should', 'would', 'could'
+}
+FRAMING_WEIGHT = 0.25
+TRIGRAM_WEIGHT = 0.5
+
+def content_terms(query: str) -> FrozenSet[str]:
+    """
+    The words of a query that decide what it asks about: everything but framing,
+    with a plural 's' dropped. Near-duplicates must agree on these exactly, since
+    similar vectors alone match "python 3.11" with "python 3.12".
+    """
+    terms = set()
+    for word in normalize_query(query).split():
+        if word in FRAMING_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.add(word)
+    return frozenset(terms)
+
+def _scope_key(scope: Dict[str, Any]) -> str:
+    return json.dumps(scope, sort_keys=True)
+
+class SemanticCache:
+    """
+    Embeds queries as signed hashed vectors of words and character trigrams (no
+    model, no network) and finds the most similar earlier query by cosine
+    similarity over a NumPy matrix. Matches are only made within the same scope
+    (e.g. result count and model), since those change the answer, and between
+    queries with the same content terms, so a different number or qualifier is
+    never a match.
+    
+    The content-term gate is intentionally strict: a wrong cached answer costs more
+    than a missed match. Queries passing it differ only in framing, word order and
+    plurals, and the similarity threshold decides how much of that is tolerated.
+    
+    The index is stored as a JSON Lines file with one float16 vector per row, so
+    processes sharing a cache directory see each other's entries. Rows are only
+    appended, until compact() rewrites the file without the ones no longer needed.
+    """
+    
+    def __init__(self, path: str, threshold: float = 0.85, dim: int = 512):
+        try:
+            import numpy
+        except ImportError:
+            raise Exception("The semantic cache requires numpy (pip install numpy)")
+        self._np = numpy
+        self.threshold = threshold
+        self.dim = dim
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        
+        # Rows [0, len(self._entries)) are in use; capacity doubles so appends stay cheap
+        self._vectors = numpy.zeros((64, dim), dtype=numpy.float32)
+        self._entries = []
+        self._known = set()  # (normalized query, scope key) already indexed
+        self._offset = 0  # bytes of the index file loaded so far
+        self._inode = None  # identity of that file, which compact() replaces
+        self._lock = threading.Lock()
+        with self._lock:
+            self._sync()
+    
+    def embed(self, query: str):
+        """Unit-length hashed feature vector of a query"""
+        np = self._np
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in normalize_query(query).split():
+            weight = FRAMING_WEIGHT if word in FRAMING_WORDS else 1.0
+            features = [(word, weight)]
+            # Trigrams make plurals and other inflections land close together
+            padded = f"#{word}#"
+            features += [(padded[i:i + 3], weight * TRIGRAM_WEIGHT) for i in range(len(padded) - 2)]
+            for feature, feature_weight in features:
+                digest = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vector[digest % self.dim] += sign * feature_weight
+        
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(self, query: str, scope: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The entry of the most similar indexed query in scope, with its similarity, if above threshold"""
+        vector = self.embed(query)
+        scope_key = _scope_key(scope)
+        terms = content_terms(query)
+        with self._lock:
+            self._sync()
+            if not self._entries:
+                return None
+            similarities = self._vectors[:len(self._entries)] @ vector
+            # Only the few best candidates need their scope checked
+            candidates = min(32, len(similarities))
+            best = self._np.argpartition(-similarities, candidates - 1)[:candidates]
+            for position in best[self._np.argsort(-similarities[best])]:
+                similarity = float(similarities[position])
+                if similarity < self.threshold:
+                    break
+                entry = self._entries[position]
+                if entry['scope'] == scope_key and content_terms(entry['query']) == terms:
+                    return {**entry['data'], 'similarity': similarity}
+        return None
+    
+    def add(self, query: str, scope: Dict[str, Any], data: Dict[str, Any]) -> None:
+        """Index a query; data is returned by lookups that match it"""
+        scope_key = _scope_key(scope)
+        identity = (normalize_query(query), scope_key)
+        vector = self.embed(query)
+        with self._lock:
+            self._sync()
+            if identity in self._known:
+                return
+            row = {
+                'query': identity[0],
+                'scope': scope_key,
+                'data': data,
+                'vector': base64.b64encode(vector.astype(self._np.float16).tobytes()).decode('ascii')
+            }
+            # One write per row so concurrent appenders do not interleave
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(row) + "\n")
+            self._sync()
+    
+    def _sync(self) -> None:
+        """Load rows appended since the last sync, including ones written by other processes"""
+        np = self._np
+        try:
+            with open(self.path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if inode != self._inode or f.seek(0, os.SEEK_END) < self._offset:
+                    # Another process cleared or compacted the index
+                    self._reset()
+                    self._inode = inode
+                f.seek(self._offset)
+                appended = f.read()
+        except FileNotFoundError:
+            self._reset()
+            return
+        
+        # A trailing row without its newline is still being written
+        complete = appended[:appended.rfind(b"\n") + 1]
+        if not complete:
+            return
+        self._offset += len(complete)
+        
+        for line in complete.splitlines():
+            try:
+                row = json.loads(line)
+                vector = np.frombuffer(base64.b64decode(row['vector']), dtype=np.float16)
+            except (ValueError, KeyError):
+                continue
+            if vector.shape != (self.dim,):
+                continue
+            
+            count = len(self._entries)
+            if count == len(self._vectors):
+                self._vectors = np.vstack([self._vectors, np.zeros_like(self._vectors)])
+            self._vectors[count] = vector
+            self._entries.append({'query': row['query'], 'scope': row['scope'], 'data': row['data']})
+            self._known.add((row['query'], row['scope']))
+    
+    def compact(self, keep: Callable[[Dict[str, Any]], bool]) -> int:
+        """
+        Rewrite the index with only the entries whose data keep() accepts, and return
+        how many were dropped. Rows another process appends while it runs may be lost.
+        """
+        with self._lock:
+            self._sync()
+            kept = [position for position, entry in enumerate(self._entries) if keep(entry['data'])]
+            dropped = len(self._entries) - len(kept)
+            if not dropped:
+                return 0
+            
+            # Written beside the index and swapped in, so readers never see a partial file
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                for position in kept:
+                    entry = self._entries[position]
+                    vector = self._vectors[position].astype(self._np.float16).tobytes()
+                    f.write(json.dumps({**entry, 'vector': base64.b64encode(vector).decode('ascii')}) + "\n")
+            os.replace(temp_path, self.path)
+            self._reset()
+            self._sync()
+            return dropped
+    
+    def clear(self) -> None:
+        """Drop every indexed query"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._reset()
+    
+    def _reset(self) -> None:
+        self._offset = 0
+        self._inode = None
+        self._entries = []
+        self._known.clear()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
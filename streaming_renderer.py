@@ -0,0 +1,71 @@
+"""Incremental terminal rendering for streamed answers"""
+
+import time
+from rich.console import Console
+from rich.live import Live
+from rich.text import Text
+
+class StreamingRenderer:
+    """
+    Renders a streamed answer with flat per-chunk cost. Chunks are buffered and
+    flushed at most refresh_per_second times; completed lines are printed once
+    above the live region, which only ever lays out the unfinished last line.
+    """
+    
+    def __init__(self, console: Console, title: str = "AI Response", style: str = "green", refresh_per_second: int = 8):
+        self.console = console
+        self.title = title
+        self.style = style
+        self.refresh_per_second = refresh_per_second
+        self._interval = 1.0 / refresh_per_second
+        self._parts = []    # every chunk received, joined once at the end
+        self._pending = []  # chunks not yet flushed to the screen
+        self._tail = ""     # text after the last printed newline
+        self._last_flush = 0.0
+        self._live = None
+    
+    def __enter__(self) -> "StreamingRenderer":
+        self.console.rule(self.title, style=self.style)
+        self._live = Live(
+            Text("Generating response...", style="dim"),
+            console=self.console,
+            refresh_per_second=self.refresh_per_second,
+            transient=True
+        )
+        self._live.__enter__()
+        return self
+    
+    def feed(self, chunk: str) -> None:
+        """Add a chunk; the screen is updated when the refresh interval has passed"""
+        self._parts.append(chunk)
+        self._pending.append(chunk)
+        now = time.monotonic()
+        if now - self._last_flush >= self._interval:
+            self._last_flush = now
+            self._flush()
+    
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        
+        text = self._tail + "".join(self._pending)
+        self._pending.clear()
+        
+        # Everything before the last newline is final and printed exactly once
+        stable, sep, self._tail = text.rpartition("\n")
+        if sep:
+            self._live.console.print(stable)
+        self._live.update(self._tail, refresh=False)
+    
+    @property
+    def text(self) -> str:
+        """The full answer received so far"""
+        return "".join(self._parts)
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._flush()
+        # The live region is transient, so the last line is printed for good once it stops
+        self._live.__exit__(exc_type, exc, tb)
+        if self._tail:
+            self.console.print(self._tail)
+        self.console.rule(style=self.style)
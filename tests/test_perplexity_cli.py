@@ -7,15 +7,30 @@ import os
 import sys
 import tempfile
 import json
+import time
+import asyncio
 from datetime import datetime
 
 # Add parent directory to path to import our modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import our modules
-from cache_manager import CacheManager
-from query_optimizer import QueryOptimizer
+from cache_manager import CacheManager, LRUCache
+from cache_backends import JSONFileBackend, SQLiteBackend
+from query_optimizer import QueryOptimizer, normalize_query
 from ai_processor import AIProcessor
+from context_packer import estimate_tokens
+from domain_reputation import DomainReputation
+from search_engine import SearchEngine, AsyncSearchEngine, canonicalize_url, merge_results
+from agent_mode import ResearchAgent
+from semantic_cache import SemanticCache
+from batch import run_batch
+from pipeline import query_events, answer_query, replay_answer
+from resilience import Resilience, RetryPolicy, CircuitBreaker, CircuitOpenError, BackendError
+from rate_limiter import TokenBucket, SQLiteBucketStore
+import tracing
+from page_fetcher import PageFetcher, TextExtractor, select_passages
+from page_cache import PageCache
 
 class TestCacheManager(unittest.TestCase):
     def setUp(self):
@@ -39,6 +54,28 @@ class TestCacheManager(unittest.TestCase):
         # Should return None immediately
         self.assertIsNone(cache.get("test", "type"))
     
+    def test_cache_key_includes_params(self):
+        """Test that results fetched with different parameters are cached separately"""
+        self.cache.set("test query", "search", {"results": 5}, {"num_results": 5})
+        
+        self.assertIsNone(self.cache.get("test query", "search", {"num_results": 10}))
+        self.assertEqual(self.cache.get("test query", "search", {"num_results": 5}), {"results": 5})
+    
+    def test_normalized_queries_share_entry(self):
+        """Test that trivially different phrasings hit the same entry"""
+        self.cache.set("What is X?", "search", {"data": 1})
+        
+        self.assertEqual(self.cache.get("what  is x", "search"), {"data": 1})
+        self.assertEqual(normalize_query("What's the  capital of France?"), "what capital france")
+    
+    def test_stale_entries_until_hard_ttl(self):
+        """Test that entries past the soft TTL are reported stale, not dropped"""
+        cache = CacheManager(cache_dir=self.temp_dir, ttl_hours=0, stale_ttl_hours=1)
+        cache.set("test", "type", {"data": "test"})
+        
+        self.assertIsNone(cache.get("test", "type"))
+        self.assertEqual(cache.get_with_staleness("test", "type"), ({"data": "test"}, True))
+    
     def test_cache_clear(self):
         """Test cache clearing"""
         self.cache.set("test1", "type", {"data": 1})
@@ -49,6 +86,303 @@ class TestCacheManager(unittest.TestCase):
         self.assertIsNone(self.cache.get("test1", "type"))
         self.assertIsNone(self.cache.get("test2", "type"))
 
+class TestCacheBackends(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def test_sqlite_backend_uses_wal(self):
+        """Test that the SQLite store runs in WAL mode"""
+        backend = SQLiteBackend(os.path.join(self.temp_dir, "cache.db"))
+        mode = backend._conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+    
+    def test_purge_expired_removes_unread_entries(self):
+        """Test that TTL sweeps reclaim entries without reading them"""
+        backend = SQLiteBackend(os.path.join(self.temp_dir, "cache.db"))
+        backend.set("old", "search", 100.0, {"data": 1})
+        backend.set("new", "search", 200.0, {"data": 2})
+        
+        self.assertEqual(backend.purge_expired(150.0), 1)
+        self.assertIsNone(backend.get("old"))
+        self.assertEqual(backend.get("new"), (200.0, {"data": 2}))
+    
+    def test_shared_cache_between_managers(self):
+        """Test that separate connections (e.g. two CLI processes) share entries"""
+        writer = CacheManager(cache_dir=self.temp_dir)
+        reader = CacheManager(cache_dir=self.temp_dir)
+        writer.set("query", "search", [{"index": 1}])
+        
+        self.assertEqual(reader.get("query", "search"), [{"index": 1}])
+    
+    def test_json_file_backend(self):
+        """Test that the legacy file-per-entry backend still works"""
+        cache = CacheManager(cache_dir=self.temp_dir, backend=JSONFileBackend(self.temp_dir))
+        cache.set("query", "search", {"data": 1})
+        
+        self.assertEqual(cache.get("query", "search"), {"data": 1})
+        cache.clear()
+        self.assertEqual(os.listdir(self.temp_dir), [])
+    
+    def test_backends_must_implement_storage(self):
+        """Test that a backend missing part of the storage interface cannot be created"""
+        from cache_backends import CacheBackend
+        
+        class ReadOnlyBackend(CacheBackend):
+            def get(self, key):
+                return None
+        
+        with self.assertRaises(TypeError):
+            ReadOnlyBackend()
+
+class TestMemoryTier(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def test_repeated_get_skips_backend(self):
+        """Test that repeated lookups are served from memory"""
+        cache = CacheManager(cache_dir=self.temp_dir)
+        cache.set("query", "search", {"data": 1})
+        
+        with patch.object(cache.backend, 'get') as backend_get:
+            self.assertEqual(cache.get("query", "search"), {"data": 1})
+            self.assertEqual(cache.get("query", "search"), {"data": 1})
+        
+        backend_get.assert_not_called()
+        self.assertEqual(cache.stats()['memory']['hits'], 2)
+    
+    def test_backend_hit_populates_memory(self):
+        """Test that entries from a previous session are promoted to memory"""
+        CacheManager(cache_dir=self.temp_dir).set("query", "search", {"data": 1})
+        cache = CacheManager(cache_dir=self.temp_dir)
+        
+        cache.get("query", "search")
+        cache.get("query", "search")
+        
+        self.assertEqual(cache.stats()['memory']['misses'], 1)
+        self.assertEqual(cache.stats()['memory']['hits'], 1)
+    
+    def test_lru_eviction_by_count_and_size(self):
+        """Test eviction of least recently used entries"""
+        lru = LRUCache(max_entries=2, max_bytes=100)
+        lru.set("a", 0.0, "a", 10)
+        lru.set("b", 0.0, "b", 10)
+        lru.get("a")
+        lru.set("c", 0.0, "c", 10)
+        
+        self.assertIsNone(lru.get("b"))  # Least recently used
+        self.assertIsNotNone(lru.get("a"))
+        
+        lru.set("d", 0.0, "d", 95)
+        self.assertEqual(lru.stats()['entries'], 1)
+        self.assertEqual(lru.stats()['evictions'], 3)
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = CacheManager(cache_dir=self.temp_dir)
+    
+    def test_concurrent_identical_queries_coalesce(self):
+        """Test that identical queries in flight share one search and one completion"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def slow_search(query, num_results):
+            time.sleep(0.2)
+            return [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        
+        def slow_answer(query, results, model):
+            time.sleep(0.2)
+            yield "Shared answer [1]"
+        
+        search_engine = SearchEngine("fake_key")
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = slow_answer
+        ai_processor.generate_follow_up_questions.return_value = ["Next?"]
+        
+        with patch.object(search_engine, 'search', side_effect=slow_search) as mock_search:
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                futures = [
+                    executor.submit(answer_query, "Same query", 5, "gpt-4o-mini", search_engine, ai_processor, self.cache)
+                    for _ in range(6)
+                ]
+                answers = [future.result()['answer'] for future in futures]
+        
+        self.assertEqual(answers, ["Shared answer [1]"] * 6)
+        self.assertEqual(mock_search.call_count, 1)
+        self.assertEqual(ai_processor.generate_response_with_citations_stream.call_count, 1)
+    
+    def test_rich_path_shares_one_completion_across_processes(self):
+        """Test that default-mode queries from two processes sharing the cache make one OpenAI call"""
+        import io
+        import threading
+        from rich.console import Console
+        import cli
+        
+        def slow_answer(query, results, model):
+            time.sleep(0.3)
+            yield "Shared answer [1]"
+        
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = slow_answer
+        ai_processor.generate_follow_up_questions.return_value = ["Next?"]
+        search_engine = SearchEngine("fake_key")
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        self.cache.set("Same query", 'search', results, search_engine.cache_params("Same query", 5))
+        
+        # Each "process" has its own cache instance and terminal
+        outputs = []
+        local = threading.local()
+        
+        def console():
+            if not hasattr(local, 'console'):
+                local.console = Console(file=io.StringIO(), width=120)
+                outputs.append(local.console.file)
+            return local.console
+        
+        caches = [self.cache, CacheManager(cache_dir=self.temp_dir)]
+        with patch.object(cli, 'get_console', side_effect=console):
+            threads = [
+                threading.Thread(target=cli.process_query, args=("Same query", 5, "gpt-4o-mini", search_engine, ai_processor, cache))
+                for cache in caches
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(ai_processor.generate_response_with_citations_stream.call_count, 1)
+        self.assertTrue(all("Shared answer" in output.getvalue() for output in outputs))
+    
+    def test_concurrent_stale_hits_refresh_once(self):
+        """Test that stale hits arriving while a refresh is running do not start their own"""
+        from pipeline import lookup_cached_search
+        cache = CacheManager(cache_dir=self.temp_dir, ttl_hours=0, stale_ttl_hours=1)
+        search_engine = SearchEngine("fake_key")
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        cache.set("python decorators", 'search', results, search_engine.cache_params("python decorators", 5))
+        
+        def slow_search(query, num_results):
+            time.sleep(0.2)
+            return results
+        
+        with patch.object(search_engine, 'search', side_effect=slow_search) as mock_search:
+            for _ in range(5):
+                self.assertTrue(lookup_cached_search("python decorators", 5, search_engine, cache)['stale'])
+            time.sleep(0.4)
+        
+        self.assertEqual(mock_search.call_count, 1)
+    
+    def test_lease_is_shared_across_cache_instances(self):
+        """Test that a second process sharing the cache waits for the first one's result"""
+        import threading
+        other = CacheManager(cache_dir=self.temp_dir)
+        
+        self.assertTrue(self.cache.lease("q", "search"))
+        self.assertFalse(other.lease("q", "search"))
+        
+        def finish():
+            time.sleep(0.1)
+            self.cache.set("q", "search", {"data": 1})
+            self.cache.release("q", "search")
+        holder = threading.Thread(target=finish)
+        holder.start()
+        
+        self.assertEqual(other.wait_for("q", "search", timeout=5), {"data": 1})
+        holder.join()
+        self.assertTrue(other.lease("q", "search"))
+        other.release("q", "search")
+    
+    def test_failed_holder_lets_waiters_compute(self):
+        """Test that a holder that stores nothing, or whose claim expired, does not block others"""
+        other = CacheManager(cache_dir=self.temp_dir, lock_ttl=0)
+        self.assertTrue(other.lease("q", "search"))
+        
+        # The claim expired immediately, as if its process had crashed
+        self.assertTrue(self.cache.lease("q", "search"))
+        self.cache.release("q", "search")
+        self.assertIsNone(self.cache.wait_for("q", "search", timeout=1))
+        self.assertEqual(self.cache.get_or_compute("q", "search", lambda: {"data": 2}), {"data": 2})
+
+class TestSemanticCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = CacheManager(cache_dir=self.temp_dir, semantic_threshold=0.85)
+    
+    def test_near_duplicate_query_reuses_answer(self):
+        """Test that a rephrased query is answered from the cache without API calls"""
+        search_engine = SearchEngine("fake_key")
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter([f"About {q} [1]"])
+        ai_processor.generate_follow_up_questions.return_value = ["Next?"]
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        
+        with patch.object(search_engine, 'search', return_value=results) as mock_search:
+            first = answer_query("how does TCP congestion control work", 5, "gpt-4o-mini", search_engine, ai_processor, self.cache)
+            second = answer_query("explain TCP congestion control", 5, "gpt-4o-mini", search_engine, ai_processor, self.cache)
+            self.assertEqual(mock_search.call_count, 1)
+            
+            # A different model, or a different topic, is not a match
+            answer_query("explain TCP congestion control", 5, "gpt-4o", search_engine, ai_processor, self.cache)
+            answer_query("how does UDP congestion control work", 5, "gpt-4o-mini", search_engine, ai_processor, self.cache)
+            self.assertEqual(mock_search.call_count, 3)
+        
+        self.assertEqual(second['answer'], first['answer'])
+        self.assertEqual(second['similar_to']['query'], "how does TCP congestion control work")
+        self.assertEqual(second['cached'], {'search': True, 'answer': True})
+        self.assertEqual(ai_processor.generate_response_with_citations_stream.call_count, 3)
+    
+    def test_index_is_shared_and_cleared(self):
+        """Test that another process sees indexed queries and that clearing the cache empties the index"""
+        scope = {'num_results': 5, 'model': 'gpt-4o-mini'}
+        self.cache.semantic.add("How do hash tables work?", scope, {'query': "How do hash tables work?"})
+        self.cache.semantic.add("how do hash tables work", scope, {'query': "duplicate"})
+        
+        other = SemanticCache(self.cache.semantic.path, threshold=0.85)
+        self.assertEqual(len(other), 1)
+        match = other.lookup("explain hash tables", scope)
+        self.assertEqual(match['query'], "How do hash tables work?")
+        self.assertGreaterEqual(match['similarity'], 0.85)
+        self.assertIsNone(other.lookup("explain hash tables", {**scope, 'num_results': 10}))
+        
+        self.cache.clear()
+        self.assertIsNone(other.lookup("explain hash tables", scope))
+    
+    def test_purge_compacts_index(self):
+        """Test that purging expired answers also drops their queries from the index file"""
+        search_engine = SearchEngine("fake_key")
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter([f"About {q} [1]"])
+        ai_processor.generate_follow_up_questions.return_value = ["Next?"]
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        with patch.object(search_engine, 'search', return_value=results):
+            answer_query("how does TCP congestion control work", 5, "gpt-4o-mini", search_engine, ai_processor, self.cache)
+        
+        # An entry whose answer has expired and been purged
+        scope = {'num_results': 5, 'model': 'gpt-4o-mini'}
+        self.cache.semantic.add("how do hash tables work", scope, {
+            'query': "how do hash tables work", 'search_params': {}, 'ai_params': {'model': 'gpt-4o-mini'}
+        })
+        other = SemanticCache(self.cache.semantic.path, threshold=0.85)
+        self.assertEqual(len(other), 2)
+        
+        self.cache.purge_expired()
+        
+        with open(self.cache.semantic.path) as f:
+            self.assertEqual([json.loads(line)['query'] for line in f], ["how tcp congestion control work"])
+        # Other processes reload the rewritten file rather than reading on from their old offset
+        self.assertIsNone(other.lookup("explain hash tables", scope))
+        self.assertEqual(len(other), 1)
+        self.assertEqual(other.lookup("explain TCP congestion control", scope)['query'], "how does TCP congestion control work")
+    
+    def test_different_numbers_or_qualifiers_do_not_match(self):
+        """Test that queries differing only by a version or a place qualifier are not near-duplicates"""
+        scope = {'num_results': 5, 'model': 'gpt-4o-mini'}
+        self.cache.semantic.add("python 3.11 release date", scope, {'query': "python 3.11 release date"})
+        self.cache.semantic.add("best restaurants in paris texas", scope, {'query': "best restaurants in paris texas"})
+        
+        self.assertIsNone(self.cache.semantic.lookup("python 3.12 release date", scope))
+        self.assertIsNone(self.cache.semantic.lookup("best restaurants in paris", scope))
+        self.assertEqual(self.cache.semantic.lookup("python 3.11 release dates", scope)['query'], "python 3.11 release date")
+
 class TestQueryOptimizer(unittest.TestCase):
     def setUp(self):
         self.optimizer = QueryOptimizer()
@@ -78,6 +412,201 @@ class TestQueryOptimizer(unittest.TestCase):
         # Should add context
         self.assertTrue(any("company" in alt or "about" in alt for alt in alternatives))
 
+class TestSearchEngine(unittest.TestCase):
+    def _result(self, index, link):
+        return {"index": index, "title": link, "link": link, "snippet": "", "source": "", "date": ""}
+    
+    def test_canonicalize_url(self):
+        """Test that URL variants of the same page compare equal"""
+        self.assertEqual(
+            canonicalize_url("https://www.Example.com/page/?utm_source=x&id=1#top"),
+            canonicalize_url("http://example.com/page?id=1")
+        )
+        self.assertNotEqual(canonicalize_url("https://example.com/a"), canonicalize_url("https://example.com/b"))
+    
+    def test_merge_results_dedupes_and_reindexes(self):
+        """Test merging results from several queries"""
+        merged = merge_results([
+            [self._result(0, "https://answer.com"), self._result(1, "https://a.com"), self._result(2, "https://b.com")],
+            [self._result(1, "https://www.a.com/"), self._result(2, "https://c.com")],
+        ])
+        
+        self.assertEqual([r['index'] for r in merged], [0, 1, 2, 3])
+        self.assertEqual([r['link'] for r in merged[1:]], ["https://a.com", "https://b.com", "https://c.com"])
+    
+    def test_multi_query_fans_out_alternatives(self):
+        """Test that vague queries search the alternatives as well"""
+        engine = SearchEngine("fake_key", multi_query=True)
+        with patch.object(engine, '_search_single', side_effect=lambda q, n: [self._result(1, f"https://{q}.com")]) as mock_search:
+            results = engine.search("what is openai")
+        
+        # Original query plus up to three alternatives
+        self.assertEqual(mock_search.call_count, 4)
+        self.assertEqual([r['index'] for r in results], [1, 2, 3, 4])
+    
+    def test_cache_params(self):
+        """Test that cache parameters reflect what changes the results"""
+        self.assertEqual(SearchEngine("fake_key").cache_params("what is openai", 5), {"num_results": 5})
+        
+        params = SearchEngine("fake_key", multi_query=True).cache_params("What is OpenAI?", 10)
+        self.assertEqual(params["num_results"], 10)
+        self.assertIn("openai company overview", params["alternatives"])
+    
+    def test_single_query_without_multi_query(self):
+        """Test that only one search is issued by default"""
+        engine = SearchEngine("fake_key")
+        with patch.object(engine, '_search_single', return_value=[]) as mock_search:
+            engine.search("what is openai")
+        
+        mock_search.assert_called_once()
+    
+    def test_searches_reuse_pooled_session(self):
+        """Test that every search goes through one shared keep-alive session"""
+        engine = SearchEngine("fake_key", base_url="http://localhost:9/search.json", timeout=(1.0, 2.0))
+        session = Mock()
+        session.get.return_value.json.return_value = {"organic_results": [{"title": "T", "link": "https://a.com/x", "snippet": "S"}]}
+        
+        with patch.object(engine, '_create_session', return_value=session) as mock_create:
+            engine.search("first query")
+            results = engine.search("second query")
+        
+        mock_create.assert_called_once()
+        self.assertEqual(session.get.call_count, 2)
+        args, kwargs = session.get.call_args
+        self.assertEqual(args[0], "http://localhost:9/search.json")
+        self.assertEqual(kwargs['timeout'], (1.0, 2.0))
+        self.assertEqual(results[0]['source'], "a.com")
+    
+    def test_session_pool_covers_fan_out(self):
+        """Test that the connection pool is at least as wide as the search fan-out"""
+        engine = SearchEngine("fake_key", max_workers=16, pool_size=4)
+        try:
+            adapter = engine.session.get_adapter("https://serpapi.com/search.json")
+            self.assertEqual(adapter._pool_maxsize, 16)
+        finally:
+            engine.close()
+
+class TestAsyncBackends(unittest.TestCase):
+    def test_async_search_engine_formats_results(self):
+        """Test that the async engine returns the same result shape"""
+        import httpx
+        
+        def handler(request):
+            self.assertEqual(request.url.params["q"], "python asyncio")
+            return httpx.Response(200, json={
+                "organic_results": [{"title": "Asyncio", "link": "https://docs.python.org/3/library/asyncio.html", "snippet": "Docs"}]
+            })
+        
+        async def run_search():
+            engine = AsyncSearchEngine("fake_key", client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            try:
+                return await engine.search("python asyncio")
+            finally:
+                await engine.aclose()
+        
+        results = asyncio.run(run_search())
+        
+        self.assertEqual(results, [{
+            "index": 1,
+            "title": "Asyncio",
+            "link": "https://docs.python.org/3/library/asyncio.html",
+            "snippet": "Docs",
+            "source": "docs.python.org",
+            "date": ""
+        }])
+    
+    def test_answer_query_async(self):
+        """Test the async query path on an event loop"""
+        from pipeline import answer_query_async
+        
+        class FakeSearchEngine:
+            async def search(self, query, num_results):
+                return [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        
+        class FakeAIProcessor:
+            async def generate_response_with_citations_stream(self, query, results, model):
+                for chunk in ["Answer ", "[1]"]:
+                    yield chunk
+            
+            async def generate_follow_up_questions(self, query, results, model):
+                return ["Next?"]
+        
+        chunks = []
+        result = asyncio.run(answer_query_async("q", 5, "gpt-4o-mini", FakeSearchEngine(), FakeAIProcessor(), on_chunk=chunks.append))
+        
+        self.assertEqual(result['answer'], "Answer [1]")
+        self.assertEqual(result['citations'], [1])
+        self.assertEqual(result['follow_up_questions'], ["Next?"])
+        self.assertEqual(chunks, ["Answer ", "[1]"])
+    
+    def test_async_path_shares_cache_and_single_flight(self):
+        """Test that concurrent async queries coalesce through the cache and reuse answers cached by the sync path"""
+        from pipeline import answer_query_async
+        
+        calls = {'search': 0, 'answer': 0}
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        
+        class FakeSearchEngine(SearchEngine):
+            async def search(self, query, num_results):
+                calls['search'] += 1
+                await asyncio.sleep(0.1)
+                return results
+        
+        class FakeAIProcessor:
+            async def generate_response_with_citations_stream(self, query, results, model):
+                calls['answer'] += 1
+                await asyncio.sleep(0.1)
+                yield "Shared [1]"
+            
+            async def generate_follow_up_questions(self, query, results, model):
+                return ["Next?"]
+        
+        cache = CacheManager(cache_dir=tempfile.mkdtemp())
+        
+        async def run_all():
+            engine, processor = FakeSearchEngine("fake_key"), FakeAIProcessor()
+            return await asyncio.gather(*[
+                answer_query_async("same query", 5, "gpt-4o-mini", engine, processor, cache) for _ in range(4)
+            ])
+        
+        answers = asyncio.run(run_all())
+        self.assertEqual([answer['answer'] for answer in answers], ["Shared [1]"] * 4)
+        self.assertEqual(calls, {'search': 1, 'answer': 1})
+        
+        # The sync pipeline reads the same entries
+        sync_answer = answer_query("same query", 5, "gpt-4o-mini", SearchEngine("fake_key"), Mock(), cache)
+        self.assertEqual(sync_answer['cached'], {'search': True, 'answer': True})
+    
+    def test_async_events_match_sync(self):
+        """Test that both pipelines emit the same events, with timed replay and traced stages on the async path"""
+        from pipeline import query_events_async
+        
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        engine = SearchEngine("fake_key")
+        cache = CacheManager(cache_dir=tempfile.mkdtemp())
+        search_params = engine.cache_params("q", 5)
+        cache.set("q", 'search', results, search_params)
+        cache.set("q", 'ai_response', {
+            'response': "Cached [1]", 'model': "gpt-4o-mini", 'chunks': [[0, 7], [100, 3]], 'follow_up_questions': ["Next?"]
+        }, {**search_params, 'model': "gpt-4o-mini"})
+        
+        async def collect():
+            return [event async for event in query_events_async("q", 5, "gpt-4o-mini", engine, Mock(), cache, timed_replay=True)]
+        
+        tracer = tracing.start_tracing()
+        try:
+            started = time.monotonic()
+            async_events = asyncio.run(collect())
+            self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        finally:
+            tracing.stop_tracing()
+        sync_events = list(query_events("q", 5, "gpt-4o-mini", engine, Mock(), cache, timed_replay=True))
+        
+        self.assertEqual(async_events[:-1], sync_events[:-1])
+        self.assertEqual(async_events[-1].keys(), sync_events[-1].keys())
+        self.assertIn('time_to_first_token', async_events[-1])
+        self.assertIn('answer_stream', [stage['name'] for stage in tracer.summary()])
+
 class TestAIProcessor(unittest.TestCase):
     def setUp(self):
         self.ai_processor = AIProcessor("fake_key")
@@ -102,6 +631,38 @@ class TestAIProcessor(unittest.TestCase):
         score = self.ai_processor.score_source_quality(untrusted_source)
         self.assertLess(score, 0.7)  # Should be lower quality
     
+    def test_domain_reputation_suffix_lookup(self):
+        """Test that domains match on hostname suffixes, most specific entry first"""
+        reputation = DomainReputation({'example.com': 0.3, 'spam.example.com': -0.4, 'gov': 0.3})
+        
+        self.assertEqual(reputation.score_url("https://docs.example.com:8443/page"), 0.3)
+        self.assertEqual(reputation.score_url("https://a.spam.example.com/"), -0.4)
+        self.assertEqual(reputation.score_url("https://www.nasa.gov/"), 0.3)
+        # Substrings outside the hostname's labels no longer count
+        self.assertEqual(reputation.score_url("https://notexample.com/example.com"), 0.0)
+        self.assertEqual(reputation.score_url("not a url"), 0.0)
+    
+    def test_domain_list_loading_and_scale(self):
+        """Test loading a large allow/deny list and batch scoring against it"""
+        path = os.path.join(tempfile.mkdtemp(), "domains.txt")
+        with open(path, 'w') as f:
+            f.write("# deny list\n")
+            f.write("random-blog.com -0.3\n")
+            f.writelines(f"site{i}.example\n" for i in range(50000))
+        
+        processor = AIProcessor("fake_key")
+        processor.domain_reputation.load(path)
+        self.assertGreater(len(processor.domain_reputation), 50000)
+        
+        sources = [{"link": f"https://www.site{i % 100}.example/a", "snippet": "", "date": ""} for i in range(2000)]
+        started = time.perf_counter()
+        scores = processor.score_sources(sources + [{"link": "https://random-blog.com/post", "snippet": "", "date": ""}])
+        self.assertLess(time.perf_counter() - started, 0.5)
+        
+        self.assertEqual(scores[0], 0.8)
+        self.assertEqual(scores[-1], 0.2)
+        self.assertEqual(processor.domain_reputation._score_url.cache_info().misses, 101)
+    
     def test_citation_extraction(self):
         """Test citation extraction from text"""
         from cli import extract_citations
@@ -110,6 +671,1034 @@ class TestAIProcessor(unittest.TestCase):
         citations = extract_citations(text)
         
         self.assertEqual(citations, [1, 2])  # Should be sorted and unique
+    
+    def test_context_packing_within_budget(self):
+        """Test that the prompt keeps the best results that fit the budget and drops near-duplicates"""
+        def result(index, link, snippet):
+            return {"index": index, "title": f"Title {index}", "link": link, "snippet": snippet, "source": "", "date": ""}
+        
+        results = [
+            result(1, "https://random-blog.com/a", "Rust uses ownership and borrowing to guarantee memory safety. " * 3),
+            result(2, "https://www.nature.com/b", "Ownership rules are checked by the Rust compiler at build time, " * 30),
+            result(3, "https://random-blog.com/c", "Rust uses ownership and borrowing to guarantee memory safety. " * 3),
+        ] + [result(i, f"https://site{i}.com", f"Filler snippet number {i} about systems programming. " * 4) for i in range(4, 21)]
+        
+        processor = AIProcessor("fake_key", context_budget=400)
+        scored = [{**r, 'quality_score': processor.score_source_quality(r)} for r in results]
+        packed = processor.context_packer.pack(scored)
+        
+        self.assertEqual(packed['included'][0], 2)  # Highest quality first, trimmed to fit
+        self.assertIn(1, packed['included'])
+        self.assertIn(3, packed['dropped'])  # Same snippet as result 1
+        self.assertLessEqual(packed['tokens'], 400)
+        self.assertGreater(packed['tokens_saved'], 0)
+        self.assertEqual(processor.context_packer.stats()['tokens_saved'], packed['tokens_saved'])
+        
+        user_prompt = processor._build_citation_messages("rust", results)[1]['content']
+        self.assertLess(estimate_tokens(user_prompt), 400 + 150)
+        self.assertNotIn("[3] Title 3", user_prompt)
+    
+    def test_estimate_tokens(self):
+        """Test the local token estimate on plain English"""
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("The cat sat."), 4)
+        self.assertTrue(40 <= estimate_tokens("word " * 50) <= 60)
+
+class TestProcessQuery(unittest.TestCase):
+    def setUp(self):
+        import io
+        from rich.console import Console
+        import cli
+        self.cli = cli
+        self.console_patch = patch.object(cli, '_console', Console(file=io.StringIO(), width=120))
+        self.console_patch.start()
+        self.search_results = [
+            {"index": 1, "title": "Result", "link": "https://example.com/a", "snippet": "Snippet", "source": "example.com", "date": ""}
+        ]
+    
+    def tearDown(self):
+        self.console_patch.stop()
+    
+    def test_follow_ups_run_while_answer_streams(self):
+        """Test that follow-up generation starts before the answer stream is drained"""
+        import threading
+        follow_up_started = threading.Event()
+        
+        def follow_ups(query, results, model):
+            follow_up_started.set()
+            return ["Next question?"]
+        
+        def stream(query, results, model):
+            yield "Answer [1]"
+            # Would deadlock if follow-ups were only requested after streaming
+            self.assertTrue(follow_up_started.wait(timeout=5))
+            yield " done."
+        
+        search_engine = Mock()
+        search_engine.search.return_value = self.search_results
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = stream
+        ai_processor.generate_follow_up_questions.side_effect = follow_ups
+        
+        self.cli.process_query("test", 5, "gpt-4o-mini", search_engine, ai_processor)
+        
+        ai_processor.generate_follow_up_questions.assert_called_once_with("test", self.search_results, "gpt-4o-mini")
+        output = self.cli._console.file.getvalue()
+        self.assertIn("Next question?", output)
+        # The renderer's rule is the only answer heading
+        self.assertEqual(output.count("AI Response"), 1)
+
+class TestResearchAgent(unittest.TestCase):
+    def _make_agent(self, **kwargs):
+        search_engine = Mock()
+        search_engine.search.side_effect = lambda q, num_results: [
+            {"index": 1, "title": q, "link": f"https://example.com/{q}", "snippet": "short", "source": "example.com", "date": ""}
+        ]
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter(["Answer about Rust Lang"])
+        return ResearchAgent(search_engine, ai_processor, **kwargs)
+    
+    def test_levels_expand_breadth_first(self):
+        """Test that research expands each level until max depth"""
+        agent = self._make_agent(max_depth=3)
+        research = agent.autonomous_research("how does rust work")
+        
+        self.assertEqual(research['depth'], 2)
+        self.assertEqual(research['reason'], "Max research depth reached")
+        self.assertIn("how does rust work technical details", research['followup_queries'])
+        # Root and level 1 are synthesized, level 2 is only searched
+        self.assertEqual({entry['depth'] for entry in agent.context_history}, {0, 1})
+    
+    def test_level_searches_run_concurrently(self):
+        """Test that all searches of a level are in flight at once"""
+        import threading
+        agent = self._make_agent(max_depth=2, max_concurrency=3)
+        barrier = threading.Barrier(3, timeout=5)
+        
+        def search(q, num_results):
+            barrier.wait()  # Breaks unless all three follow-ups search together
+            return []
+        
+        agent.search_engine.search.side_effect = search
+        research = agent.autonomous_research("how does rust work", initial_results=[])
+        
+        self.assertEqual(len(research['followup_queries']), 3)
+    
+    def test_token_budget_stops_research(self):
+        """Test that research stops once the token budget is spent"""
+        agent = self._make_agent(max_depth=5, token_budget=1)
+        research = agent.autonomous_research("how does rust work")
+        
+        self.assertEqual(research['reason'], "Token budget exhausted")
+        self.assertEqual(research['depth'], 0)
+    
+    def test_initial_response_is_not_regenerated(self):
+        """Test that the answer already streamed for the root query is reused rather than requested again"""
+        agent = self._make_agent(max_depth=2)
+        research = agent.autonomous_research("how does rust work", initial_results=[], initial_response="ownership and Borrowing")
+        
+        agent.ai_processor.generate_response_with_citations_stream.assert_not_called()
+        self.assertIn("explain Borrowing in detail", research['followup_queries'])
+        self.assertEqual(agent.context_history[0]['response'], "ownership and Borrowing")
+    
+    def test_budget_is_per_query(self):
+        """Test that a query exhausting the token budget does not starve the next query on the same agent"""
+        agent = self._make_agent(max_depth=3, token_budget=20)
+        first = agent.autonomous_research("how does rust work")
+        self.assertEqual(first['reason'], "Token budget exhausted")
+        
+        second = agent.autonomous_research("how does go work")
+        self.assertEqual(second['reason'], "Token budget exhausted")
+        self.assertGreater(len(second['followup_queries']), 0)
+        self.assertEqual(agent.context_history[0]['query'], "how does go work")
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+    def setUp(self):
+        import io
+        from rich.console import Console
+        import cli
+        self.cli = cli
+        self.console_patch = patch.object(cli, '_console', Console(file=io.StringIO(), width=120))
+        self.console_patch.start()
+        self.cache = CacheManager(cache_dir=tempfile.mkdtemp(), ttl_hours=0, stale_ttl_hours=1)
+        self.stale = [{"index": 1, "title": "Old", "link": "https://old.com", "snippet": "", "source": "old.com", "date": ""}]
+        self.fresh = [{"index": 1, "title": "New", "link": "https://new.com", "snippet": "", "source": "new.com", "date": ""}]
+        
+        self.search_engine = SearchEngine("fake_key")
+        self.ai_processor = Mock()
+        self.ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter([r[0]['title']])
+        self.ai_processor.generate_follow_up_questions.return_value = []
+    
+    def tearDown(self):
+        self.console_patch.stop()
+    
+    def _run(self, query):
+        params = self.search_engine.cache_params(query, 5)
+        self.cache.set(query, 'search', self.stale, params)
+        with patch.object(self.search_engine, 'search', return_value=self.fresh) as mock_search:
+            self.cli.process_query(query, 5, "gpt-4o-mini", self.search_engine, self.ai_processor, self.cache)
+            for _ in range(100):
+                data, _ = self.cache.get_with_staleness(query, 'search', params)
+                if data == self.fresh:
+                    break
+                time.sleep(0.01)
+        return mock_search, data
+    
+    def test_stale_results_served_and_refreshed(self):
+        """Test that stale results are answered from immediately and refreshed in the background"""
+        mock_search, data = self._run("python decorators")
+        
+        answer_results = self.ai_processor.generate_response_with_citations_stream.call_args[0][1]
+        self.assertEqual(answer_results, self.stale)
+        mock_search.assert_called_once()
+        self.assertEqual(data, self.fresh)
+    
+    def test_time_sensitive_query_skips_stale_results(self):
+        """Test that time-sensitive queries wait for fresh results"""
+        self._run("latest python release")
+        
+        answer_results = self.ai_processor.generate_response_with_citations_stream.call_args[0][1]
+        self.assertEqual(answer_results, self.fresh)
+
+class TestStreamingRenderer(unittest.TestCase):
+    def _console(self):
+        import io
+        from rich.console import Console
+        return Console(file=io.StringIO(), width=80, force_terminal=False)
+    
+    def test_live_region_holds_only_the_tail(self):
+        """Test that completed lines leave the live region"""
+        from streaming_renderer import StreamingRenderer
+        console = self._console()
+        with StreamingRenderer(console, refresh_per_second=1000) as renderer:
+            for chunk in ["First line\nSec", "ond line\nThi", "rd"]:
+                renderer.feed(chunk)
+                time.sleep(0.002)
+            self.assertEqual(str(renderer._live.renderable), "Third")
+        
+        output = console.file.getvalue()
+        self.assertEqual(renderer.text, "First line\nSecond line\nThird")
+        for line in ["First line", "Second line", "Third"]:
+            self.assertEqual(output.count(line), 1)
+    
+    def test_updates_coalesced_to_refresh_rate(self):
+        """Test that a burst of chunks triggers a single screen update"""
+        from streaming_renderer import StreamingRenderer
+        renderer = StreamingRenderer(self._console(), refresh_per_second=1)
+        with renderer:
+            with patch.object(renderer, '_flush', wraps=renderer._flush) as flush:
+                for _ in range(100):
+                    renderer.feed("word ")
+                self.assertEqual(flush.call_count, 1)
+        
+        self.assertEqual(renderer.text, "word " * 100)
+
+class TestQueryEvents(unittest.TestCase):
+    def setUp(self):
+        self.search_engine = Mock()
+        self.search_engine.search.return_value = [
+            {"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}
+        ]
+        self.ai_processor = Mock()
+        self.ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter(["Answer ", "[1]"])
+        self.ai_processor.generate_follow_up_questions.return_value = ["Next?"]
+    
+    def test_event_sequence(self):
+        """Test the structured events emitted for a query"""
+        events = list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor))
+        
+        self.assertEqual(
+            [event['event'] for event in events],
+            ['search_results', 'answer_delta', 'answer_delta', 'citations', 'follow_ups', 'timing']
+        )
+        self.assertEqual(events[3]['sources'][0]['link'], "https://a.com")
+        self.assertIn('time_to_first_token', events[-1])
+        # Events are plain data that serialize without rendering
+        json.dumps(events)
+    
+    def test_timing_reports_context_tokens(self):
+        """Test that a fresh answer's timing event carries the packed and saved context tokens, and a replay does not"""
+        results = [
+            {"index": i, "title": f"T{i}", "link": f"https://a{i}.com", "snippet": "tcp congestion window " * 20, "source": "a.com", "date": ""}
+            for i in range(1, 4)
+        ]
+        search_engine = SearchEngine("fake_key")
+        search_engine.search = Mock(return_value=results)
+        ai_processor = AIProcessor("fake_key")
+        chunk = Mock()
+        chunk.choices = [Mock(delta=Mock(content="Answer [1]"))]
+        cache = CacheManager(cache_dir=tempfile.mkdtemp())
+        
+        with patch.object(ai_processor, '_create_completion', side_effect=lambda **kwargs: iter([chunk])), \
+             patch.object(ai_processor, 'generate_follow_up_questions', return_value=["Next?"]):
+            fresh = list(query_events("q", 5, "gpt-4o-mini", search_engine, ai_processor, cache))[-1]
+            replayed = list(query_events("q", 5, "gpt-4o-mini", search_engine, ai_processor, cache))[-1]
+        
+        # The three snippets are near-duplicates, so two are dropped
+        self.assertGreater(fresh['context_tokens'], 0)
+        self.assertGreater(fresh['tokens_saved'], fresh['context_tokens'])
+        self.assertNotIn('tokens_saved', replayed)
+    
+    def test_search_error_event(self):
+        """Test that search failures end the stream with an error event"""
+        self.search_engine.search.side_effect = Exception("boom")
+        events = list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor))
+        
+        self.assertEqual(events, [{'event': 'error', 'stage': 'search', 'message': 'boom'}])
+        with self.assertRaises(Exception):
+            answer_query("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor)
+
+    def test_cached_answer_replays_chunks(self):
+        """Test that a cached answer is replayed as the chunks it was streamed in"""
+        cache = CacheManager(cache_dir=tempfile.mkdtemp())
+        self.search_engine.cache_params.return_value = {"num_results": 5}
+        
+        def slow_stream(q, r, m):
+            for chunk in ["Answer ", "[1]"]:
+                time.sleep(0.05)
+                yield chunk
+        self.ai_processor.generate_response_with_citations_stream.side_effect = slow_stream
+        
+        fresh = list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor, cache))
+        replayed = list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor, cache))
+        
+        deltas = lambda events: [(e['text'], e['cached']) for e in events if e['event'] == 'answer_delta']
+        self.assertEqual(deltas(fresh), [("Answer ", False), ("[1]", False)])
+        self.assertEqual(deltas(replayed), [("Answer ", True), ("[1]", True)])
+        self.assertEqual(self.ai_processor.generate_response_with_citations_stream.call_count, 1)
+    
+    def test_replay_timing(self):
+        """Test instant and timed replay, and entries cached without a chunk log"""
+        entry = {'response': "Hello world", 'chunks': [[0, 6], [100, 5]]}
+        
+        started = time.monotonic()
+        self.assertEqual(list(replay_answer(entry)), ["Hello ", "world"])
+        self.assertLess(time.monotonic() - started, 0.05)
+        
+        started = time.monotonic()
+        self.assertEqual(list(replay_answer(entry, timed=True)), ["Hello ", "world"])
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        
+        self.assertEqual(list(replay_answer({'response': "Old entry"})), ["Old entry"])
+
+    def test_backend_failures_fall_back_to_stale_cache(self):
+        """Test that stale search results and answers are served while both backends fail"""
+        cache = CacheManager(cache_dir=tempfile.mkdtemp(), ttl_hours=0)
+        self.search_engine.cache_params.return_value = {"num_results": 5}
+        list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor, cache))
+        
+        def failing_stream(q, r, m):
+            raise Exception("OpenAI down")
+            yield
+        self.search_engine.search.side_effect = Exception("SerpAPI down")
+        self.ai_processor.generate_response_with_citations_stream.side_effect = failing_stream
+        events = list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor, cache))
+        
+        self.assertNotIn('error', [event['event'] for event in events])
+        self.assertTrue(events[0]['stale'])
+        self.assertEqual("".join(e['text'] for e in events if e['event'] == 'answer_delta'), "Answer [1]")
+        self.assertEqual([e['questions'] for e in events if e['event'] == 'follow_ups'], [["Next?"]])
+        # The fallback is not written back as a fresh answer
+        self.assertIsNone(cache.get("q", 'ai_response', {"num_results": 5, "model": "gpt-4o-mini"}))
+    
+    def test_answer_error_event(self):
+        """Test that a failed answer stream ends with an error event rather than error text"""
+        def failing_stream(q, r, m):
+            raise Exception("OpenAI down")
+            yield
+        self.ai_processor.generate_response_with_citations_stream.side_effect = failing_stream
+        events = list(query_events("q", 5, "gpt-4o-mini", self.search_engine, self.ai_processor))
+        
+        self.assertEqual(events[-1], {'event': 'error', 'stage': 'answer', 'message': 'OpenAI down'})
+        self.assertNotIn('answer_delta', [event['event'] for event in events])
+    
+    def test_agent_is_rejected_with_structured_output(self):
+        """Test that --agent with --output json/ndjson is a usage error rather than silently ignored"""
+        import click
+        import cli
+        for output_format in ('json', 'ndjson'):
+            with self.assertRaises(click.UsageError):
+                cli.main(['-q', 'q', '--agent', '--output', output_format], standalone_mode=False)
+
+class TestResilience(unittest.TestCase):
+    def test_retries_retryable_errors_with_backoff(self):
+        """Test that timeouts and 5xx are retried with jittered, growing delays"""
+        sleeps = []
+        resilience = Resilience("test", RetryPolicy(retries=2, base_delay=0.1), sleep=sleeps.append)
+        fn = Mock(side_effect=[BackendError("busy", 503), TimeoutError("slow"), "ok"])
+        
+        self.assertEqual(resilience.call(fn), "ok")
+        self.assertEqual(fn.call_count, 3)
+        self.assertTrue(0 <= sleeps[0] <= 0.1 and 0 <= sleeps[1] <= 0.2)
+        self.assertEqual(resilience.stats()['state'], 'closed')
+    
+    def test_per_backend_timeouts(self):
+        """Test that --search-timeout/--openai-timeout set connect and read timeouts and override --timeout"""
+        import cli
+        context = cli.main.make_context('cli', ['--timeout', '15', '--openai-timeout', '2', '90'])
+        params = context.params
+        
+        self.assertEqual(cli.backend_timeout((5.0, 30.0), params['timeout'], params['search_timeout']), (5.0, 15.0))
+        self.assertEqual(cli.backend_timeout((5.0, 60.0), params['timeout'], params['openai_timeout']), (2.0, 90.0))
+        self.assertEqual(cli.backend_timeout((5.0, 60.0)), (5.0, 60.0))
+    
+    def test_search_errors_do_not_leak_the_api_key(self):
+        """Test that connection errors quoting the SerpAPI URL are redacted but still retried"""
+        import socket
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]  # Nothing listens here once the socket is closed
+        
+        secret = "sk-serp-secret-123"
+        for engine_class in (SearchEngine, AsyncSearchEngine):
+            engine = engine_class(secret, base_url=f"http://127.0.0.1:{port}/search.json", retry_policy=RetryPolicy(retries=1, base_delay=0))
+            with self.assertRaises(Exception) as raised:
+                if engine_class is SearchEngine:
+                    engine.search("python")
+                else:
+                    asyncio.run(engine.search("python"))
+            
+            message = str(raised.exception)
+            self.assertIn("ConnectError" if engine_class is AsyncSearchEngine else "ConnectionError", message)
+            self.assertNotIn(secret, message)
+            stats = engine.resilience.stats()
+            self.assertEqual(stats['failures'], 2)
+            self.assertNotIn(secret, stats['last_error'])
+    
+    def test_non_retryable_errors_fail_immediately(self):
+        """Test that client errors are raised at once and do not count against the backend"""
+        resilience = Resilience("test", RetryPolicy(retries=3), sleep=Mock())
+        fn = Mock(side_effect=BackendError("bad key", 401))
+        
+        with self.assertRaises(BackendError):
+            resilience.call(fn)
+        fn.assert_called_once()
+        self.assertEqual(resilience.stats()['failures'], 0)
+    
+    def test_circuit_opens_and_recovers(self):
+        """Test that repeated failures fail fast until a half-open trial call succeeds"""
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+        resilience = Resilience("test", RetryPolicy(retries=0), breaker)
+        failing = Mock(side_effect=TimeoutError("slow"))
+        
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                resilience.call(failing)
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            resilience.call(failing)
+        self.assertEqual(failing.call_count, 2)
+        
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertEqual(resilience.call(lambda: "ok"), "ok")
+        stats = breaker.stats()
+        self.assertEqual((stats['state'], stats['failures'], stats['rejected']), ('closed', 2, 1))
+    
+    def test_search_engine_retries_server_errors(self):
+        """Test that a 503 from SerpAPI is retried on the same session"""
+        engine = SearchEngine("fake_key", retry_policy=RetryPolicy(retries=1, base_delay=0))
+        unavailable = Mock(status_code=503)
+        ok = Mock(status_code=200)
+        ok.json.return_value = {"organic_results": [{"title": "T", "link": "https://a.com/x", "snippet": "S"}]}
+        session = Mock()
+        session.get.side_effect = [unavailable, ok]
+        
+        with patch.object(engine, '_create_session', return_value=session):
+            results = engine.search("query")
+        
+        self.assertEqual(len(results), 1)
+        self.assertEqual(session.get.call_count, 2)
+        unavailable.json.assert_not_called()
+    
+    def test_answer_stream_raises_instead_of_yielding_errors(self):
+        """Test that OpenAI failures surface as exceptions and are counted by the breaker"""
+        processor = AIProcessor("fake_key", retry_policy=RetryPolicy(retries=0))
+        processor._client = Mock()
+        processor._client.chat.completions.create.side_effect = BackendError("overloaded", 503)
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        
+        with self.assertRaises(BackendError):
+            list(processor.generate_response_with_citations_stream("q", results))
+        self.assertEqual(processor.resilience.stats()['failures'], 1)
+
+class TestTokenBucket(unittest.TestCase):
+    def test_acquire_async_keeps_the_loop_free(self):
+        """Test that a slow shared-store update does not block other tasks on the event loop"""
+        store = Mock()
+        store.take.side_effect = lambda *args: time.sleep(0.2) or 0.0
+        bucket = TokenBucket("test", rate=10, store=store)
+        
+        async def run():
+            started = time.monotonic()
+            
+            async def ticker():
+                for _ in range(5):
+                    await asyncio.sleep(0.01)
+                return time.monotonic() - started
+            
+            _, ticked = await asyncio.gather(bucket.acquire_async(), ticker())
+            return ticked
+        
+        self.assertLess(asyncio.run(run()), 0.15)
+    
+    def test_burst_then_spacing(self):
+        """Test that calls beyond the burst capacity are told to wait for their slot"""
+        bucket = TokenBucket("test", rate=10, capacity=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.1, delta=0.02)
+        self.assertAlmostEqual(waits[3], 0.2, delta=0.02)
+        self.assertEqual(bucket.stats()['calls'], 4)
+    
+    def test_bucket_store_follows_the_cache_directory(self):
+        """Test that rate limits live in the cache directory, and only in memory without one"""
+        import cli
+        from rate_limiter import BucketStore, MemoryBucketStore
+        with self.assertRaises(TypeError):
+            BucketStore()
+        
+        cache_dir = tempfile.mkdtemp()
+        shared = cli.create_rate_limiters("serp", "openai", search_rate=5, cache_dir=cache_dir)
+        self.assertEqual(shared['search'].store.db_path, os.path.join(cache_dir, "rate_limits.db"))
+        self.assertTrue(os.path.exists(shared['search'].store.db_path))
+        
+        local = cli.create_rate_limiters("serp", "openai", search_rate=5)
+        self.assertIsInstance(local['search'].store, MemoryBucketStore)
+    
+    def test_sqlite_buckets_are_shared_between_stores(self):
+        """Test that separate connections (as in separate processes) draw from one bucket"""
+        import threading
+        db_path = os.path.join(tempfile.mkdtemp(), "rate_limits.db")
+        buckets = [TokenBucket("serpapi", rate=10, capacity=1, store=SQLiteBucketStore(db_path)) for _ in range(2)]
+        waits = []
+        lock = threading.Lock()
+        
+        def reserve(bucket):
+            wait = bucket.reserve()
+            with lock:
+                waits.append(wait)
+        threads = [threading.Thread(target=reserve, args=(buckets[i % 2],)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # Every caller got its own slot, 0.1s apart
+        for slot, wait in enumerate(sorted(waits)):
+            self.assertAlmostEqual(wait, slot * 0.1, delta=0.05)
+    
+    def test_clients_reserve_quota_before_requests(self):
+        """Test that searches take a request slot and completions their estimated tokens"""
+        search_limiter = Mock()
+        engine = SearchEngine("fake_key", rate_limiter=search_limiter)
+        session = Mock()
+        session.get.return_value = Mock(status_code=200)
+        session.get.return_value.json.return_value = {"organic_results": []}
+        with patch.object(engine, '_create_session', return_value=session):
+            engine.search("query")
+        search_limiter.acquire.assert_called_once()
+        
+        token_limiter = Mock()
+        token_limiter.reserve.return_value = 0.0
+        processor = AIProcessor("fake_key", token_limiter=token_limiter)
+        processor._client = Mock()
+        processor._client.chat.completions.create.return_value.choices = [Mock(message=Mock(content="1. Next?"))]
+        results = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}]
+        
+        self.assertEqual(processor.generate_follow_up_questions("q", results), ["Next?"])
+        # The prompt's estimate plus the 200 tokens the answer may use
+        self.assertGreater(token_limiter.reserve.call_args[0][0], 200)
+
+class TestTracing(unittest.TestCase):
+    def tearDown(self):
+        tracing.stop_tracing()
+    
+    def test_spans_are_noops_when_tracing_is_off(self):
+        """Test that instrumented code records nothing unless a tracer is active"""
+        with tracing.span("search"):
+            pass
+        tracing.record("answer_stream", 0.0, 1.0)
+        self.assertIsNone(tracing.active_tracer())
+    
+    def test_summary_and_chrome_trace(self):
+        """Test the per-stage breakdown and the Chrome trace events"""
+        import threading
+        tracer = tracing.start_tracing()
+        with tracing.span("search", query="q"):
+            time.sleep(0.01)
+        worker = threading.Thread(target=lambda: tracing.record("render", 0.0, 0.002), name="renderer")
+        worker.start()
+        worker.join()
+        tracing.record("render", 0.0, 0.004)
+        
+        summary = {stage['name']: stage for stage in tracer.summary()}
+        self.assertGreaterEqual(summary['search']['total'], 0.01)
+        self.assertEqual(summary['render']['count'], 2)
+        self.assertAlmostEqual(summary['render']['max'], 0.004)
+        self.assertIn("search", tracer.format_breakdown())
+        
+        path = os.path.join(tempfile.mkdtemp(), "trace.json")
+        tracer.export(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(sorted(event['name'] for event in spans), ['render', 'render', 'search'])
+        self.assertEqual(spans[0]['args'], {'query': 'q'})
+        self.assertIn('renderer', [event['args']['name'] for event in events if event['ph'] == 'M'])
+    
+    def test_query_events_records_stages(self):
+        """Test that a traced query records search, first-token and stream spans"""
+        search_engine = SearchEngine("fake_key")
+        search_engine._search_single = Mock(return_value=[
+            {"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}
+        ])
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter(["Answer ", "[1]"])
+        ai_processor.generate_follow_up_questions.return_value = []
+        tracer = tracing.start_tracing()
+        
+        list(query_events("q", 5, "gpt-4o-mini", search_engine, ai_processor))
+        
+        names = [stage['name'] for stage in tracer.summary()]
+        self.assertEqual(names, ['search', 'time_to_first_token', 'answer_stream'])
+    
+    def test_counters_appear_in_breakdown(self):
+        """Test that counted totals such as tokens saved by packing are reported with the stages"""
+        tracer = tracing.start_tracing()
+        AIProcessor("fake_key")._build_citation_messages("q", [
+            {"index": i, "title": "T", "link": "https://a.com", "snippet": "same snippet text here", "source": "a.com", "date": ""}
+            for i in range(1, 3)
+        ])
+        
+        self.assertGreater(tracer.counters['context_tokens_saved'], 0)
+        self.assertIn("context_tokens_saved", tracer.format_breakdown())
+        self.assertEqual(tracer.chrome_trace()['traceEvents'][-1]['ph'], 'C')
+
+ARTICLE = """<html><head><title>TCP</title><style>p { color: red }</style></head><body>
+<nav>Home | Networking | Congestion control | About us and our many other sections</nav>
+<h1>TCP congestion control</h1>
+<p>TCP congestion control adjusts the congestion window so a sender backs off when the network
+drops packets, using slow start, congestion avoidance and fast recovery to probe for bandwidth.</p>
+<script>var congestion = "control tcp tcp tcp";</script>
+<p>The history of the protocol began in the nineteen seventies with research networks funded by
+several agencies, long before anybody worried about collapse on shared links.</p>
+<p>Modern algorithms such as CUBIC and BBR replace the classic additive increase rule of TCP
+congestion control with curves or bandwidth and round trip time models.</p>
+<footer>Copyright TCP congestion control foundation, all rights reserved, contact us for details</footer>
+</body></html>"""
+
+class TestPageFetcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        class Handler(BaseHTTPRequestHandler):
+            active = 0
+            peak = 0
+            statuses = []
+            lock = threading.Lock()
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def do_GET(self):
+                with Handler.lock:
+                    Handler.active += 1
+                    Handler.peak = max(Handler.peak, Handler.active)
+                time.sleep(0.05)
+                if self.path.startswith('/article') and self.headers.get('If-None-Match') == '"v1"':
+                    Handler.statuses.append(304)
+                    self.send_response(304)
+                    self.send_header('ETag', '"v1"')
+                    self.end_headers()
+                    with Handler.lock:
+                        Handler.active -= 1
+                    return
+                Handler.statuses.append(200)
+                if self.path.startswith('/article'):
+                    body, content_type = ARTICLE.encode('utf-8'), 'text/html'
+                elif self.path == '/huge':
+                    body, content_type = ("<p>" + "tcp congestion control filler words " * 20 + "</p>").encode('utf-8') * 2000, 'text/html'
+                else:
+                    body, content_type = b"%PDF-1.4 binary", 'application/pdf'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if self.path.startswith('/article'):
+                    self.send_header('ETag', '"v1"')
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                with Handler.lock:
+                    Handler.active -= 1
+        
+        cls.handler = Handler
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def test_extractor_keeps_visible_blocks(self):
+        """Test that scripts, styles and page chrome are dropped and paragraphs kept apart"""
+        extractor = TextExtractor()
+        for start in range(0, len(ARTICLE), 50):
+            extractor.feed(ARTICLE[start:start + 50])
+        extractor.close()
+        
+        self.assertEqual(extractor.blocks[0], "TCP congestion control")
+        self.assertEqual(len(extractor.blocks), 4)
+        self.assertFalse(any("var congestion" in block or "Copyright" in block for block in extractor.blocks))
+    
+    def test_select_passages_ranks_relevant_blocks(self):
+        """Test that the blocks matching the query are chosen and kept in page order"""
+        extractor = TextExtractor()
+        extractor.feed(ARTICLE)
+        extractor.close()
+        
+        passages = select_passages(extractor.blocks, "how does tcp congestion control work", max_passages=2)
+        self.assertEqual(len(passages), 2)
+        self.assertTrue(passages[0].startswith("TCP congestion control adjusts"))
+        self.assertTrue(passages[1].startswith("Modern algorithms"))
+    
+    def test_enrich_fetches_top_pages_concurrently(self):
+        """Test that only the top results are fetched, per host limits hold and failures are skipped"""
+        self.handler.peak = 0
+        results = [
+            {"index": i, "title": f"T{i}", "link": f"{self.base}/article{i}", "snippet": "S", "source": "local", "date": ""}
+            for i in range(1, 5)
+        ]
+        results[1]['link'] = f"{self.base}/report.pdf"
+        fetcher = PageFetcher(top_n=3, per_host=2)
+        
+        started = time.monotonic()
+        enriched = fetcher.enrich("tcp congestion control", results)
+        
+        self.assertIn('passages', enriched[0])
+        self.assertNotIn('passages', enriched[1])
+        self.assertIn('passages', enriched[2])
+        self.assertNotIn('passages', enriched[3])
+        self.assertNotIn('passages', results[0])
+        self.assertEqual(self.handler.peak, 2)
+        self.assertLess(time.monotonic() - started, 1.0)
+    
+    def test_page_size_cap(self):
+        """Test that reading stops at max_bytes"""
+        fetcher = PageFetcher(max_bytes=64 * 1024)
+        blocks = fetcher.fetch_blocks(f"{self.base}/huge")
+        
+        self.assertGreater(len(blocks), 0)
+        self.assertLess(sum(len(block) for block in blocks), 100 * 1024)
+    
+    def test_passages_reach_the_prompt_and_cache_key(self):
+        """Test that fetched passages are packed into the prompt and change the search cache key"""
+        engine = SearchEngine("fake_key", page_fetcher=PageFetcher(top_n=1))
+        self.assertEqual(engine.cache_params("q", 5)['fetch_pages'], 1)
+        
+        processor = AIProcessor("fake_key")
+        result = {"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": "",
+                  "passages": ["Slow start doubles the window every round trip."]}
+        prompt = processor._build_citation_messages("q", [result])[1]['content']
+        self.assertIn("Excerpt: Slow start doubles the window every round trip.", prompt)
+
+    def test_page_cache_revalidates_instead_of_downloading(self):
+        """Test that fresh pages are served from the cache and stale ones revalidated with If-None-Match"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            page_cache = PageCache(temp_dir)
+            fetcher = PageFetcher(page_cache=page_cache)
+            url = f"{self.base}/article1"
+            self.handler.statuses = []
+            
+            blocks = fetcher.fetch_blocks(url)
+            self.assertEqual(fetcher.fetch_blocks(url), blocks)
+            self.assertEqual(self.handler.statuses, [200])
+            
+            page_cache.max_age = 0
+            self.assertEqual(fetcher.fetch_blocks(url), blocks)
+            self.assertEqual(self.handler.statuses, [200, 304])
+            page_cache.close()
+    
+    def test_truncated_pages_are_not_revalidated(self):
+        """Test that a body cut at max_bytes is cached without validators, so a 304 cannot revive it"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            page_cache = PageCache(temp_dir)
+            fetcher = PageFetcher(page_cache=page_cache, max_bytes=200)
+            url = f"{self.base}/article2"
+            self.handler.statuses = []
+            
+            fetcher.fetch_blocks(url)
+            self.assertIsNone(page_cache.get(url)['etag'])
+            
+            page_cache.max_age = 0
+            fetcher.fetch_blocks(url)
+            self.assertEqual(self.handler.statuses, [200, 200])
+            page_cache.close()
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = PageCache(self.temp_dir, compression='zlib')
+    
+    def tearDown(self):
+        import shutil
+        self.cache.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_identical_bodies_are_stored_once(self):
+        """Test that URLs serving the same body share one compressed blob"""
+        body = ARTICLE.encode('utf-8') * 20
+        self.cache.put("https://a.example/page", body, 'text/html', etag='"a"')
+        self.cache.put("https://mirror.example/page", body, 'text/html')
+        
+        stats = self.cache.stats()
+        self.assertEqual((stats['urls'], stats['blobs']), (2, 1))
+        self.assertLess(stats['bytes'], stats['raw_bytes'])
+        page = self.cache.get("https://a.example/page")
+        self.assertEqual(page['body'], body)
+        self.assertEqual(self.cache.validators(page), {'If-None-Match': '"a"'})
+        
+        # Changing one URL's body keeps the shared blob; changing both drops it
+        self.cache.put("https://a.example/page", b"new body", 'text/plain')
+        self.assertEqual(self.cache.stats()['blobs'], 2)
+        self.cache.put("https://mirror.example/page", b"new body", 'text/plain')
+        self.assertEqual(self.cache.stats()['blobs'], 1)
+    
+    def test_least_recently_used_pages_are_evicted(self):
+        """Test that the compressed total stays under max_bytes by dropping the least recently used pages"""
+        self.cache.max_bytes = 3500
+        for i in range(3):
+            self.cache.put(f"https://example.com/{i}", os.urandom(1000), 'text/html')
+            time.sleep(0.01)
+        self.cache.get("https://example.com/0")
+        self.cache.put("https://example.com/3", os.urandom(1000), 'text/html')
+        
+        self.assertLessEqual(self.cache.stats()['bytes'], 3500)
+        self.assertIsNone(self.cache.get("https://example.com/1"))
+        self.assertIsNotNone(self.cache.get("https://example.com/0"))
+        self.assertIsNotNone(self.cache.get("https://example.com/3"))
+        blob_files = sum(len(files) for _, _, files in os.walk(os.path.join(self.temp_dir, 'blobs')))
+        self.assertEqual(blob_files, self.cache.stats()['blobs'])
+    
+    def test_corrupt_blob_is_a_miss(self):
+        """Test that a blob that fails its checksum is dropped rather than returned"""
+        digest = self.cache.put("https://example.com/", b"<p>hello</p>", 'text/html')
+        with open(os.path.join(self.temp_dir, 'blobs', digest[:2], digest), 'wb') as f:
+            f.write(b"garbage")
+        
+        self.assertIsNone(self.cache.get("https://example.com/"))
+        self.assertEqual(self.cache.stats(), {'urls': 0, 'blobs': 0, 'bytes': 0, 'raw_bytes': 0})
+
+class TestBatchMode(unittest.TestCase):
+    def test_run_batch_writes_json_lines(self):
+        """Test that every query yields one JSON line tagged with its input line"""
+        import io
+        def search(q, n):
+            if q == "broken":
+                raise Exception("search failed")
+            return [{"index": 1, "title": q, "link": f"https://example.com/{q}", "snippet": "", "source": "example.com", "date": ""}]
+        
+        search_engine = Mock()
+        search_engine.search.side_effect = search
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter([f"About {q} [1]"])
+        ai_processor.generate_follow_up_questions.return_value = ["Next?"]
+        
+        out = io.StringIO()
+        stats = run_batch(["alpha\n", "\n", "broken\n", "gamma\n"], 5, "gpt-4o-mini", search_engine, ai_processor, workers=2, out=out)
+        
+        records = {record['line']: record for record in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(sorted(records), [1, 3, 4])
+        self.assertEqual(records[1]['answer'], "About alpha [1]")
+        self.assertEqual(records[1]['sources'][0]['link'], "https://example.com/alpha")
+        self.assertEqual(records[4]['follow_up_questions'], ["Next?"])
+        self.assertIn("search failed", records[3]['error'])
+        self.assertEqual(stats, {'succeeded': 2, 'failed': 1})
+    
+    def test_results_are_written_before_input_ends(self):
+        """Test that a finished query is written while the next input line is still awaited"""
+        import io
+        search_engine = Mock()
+        search_engine.search.return_value = [{"index": 1, "title": "T", "link": "https://a.com", "snippet": "", "source": "a.com", "date": ""}]
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter([f"About {q} [1]"])
+        ai_processor.generate_follow_up_questions.return_value = []
+        out = io.StringIO()
+        written_before_second_line = []
+        
+        def slow_input():
+            yield "alpha\n"
+            deadline = time.monotonic() + 2
+            while not out.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            written_before_second_line.append(out.getvalue())
+            yield "beta\n"
+        
+        stats = run_batch(slow_input(), 5, "gpt-4o-mini", search_engine, ai_processor, workers=2, out=out)
+        
+        self.assertIn("About alpha", written_before_second_line[0])
+        self.assertEqual(stats, {'succeeded': 2, 'failed': 0})
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+    
+    def test_rate_spaces_queries(self):
+        """Test that --rate starts queries evenly spaced, without an initial burst"""
+        import io
+        starts = []
+        search_engine = Mock()
+        search_engine.search.side_effect = lambda q, n: starts.append(time.monotonic()) or []
+        search_engine.cache_params.return_value = {}
+        
+        run_batch([f"q{i}\n" for i in range(5)], 5, "gpt-4o-mini", search_engine, Mock(), workers=5, rate=50, out=io.StringIO())
+        
+        starts.sort()
+        self.assertGreaterEqual(starts[-1] - starts[0], 4 / 50 - 0.005)
+
+class TestDaemon(unittest.TestCase):
+    def test_client_streams_events_from_server(self):
+        """Test a query round trip through the Unix socket daemon"""
+        import threading
+        from daemon import QueryServer
+        from client import stream_query
+        
+        search_engine = Mock()
+        search_engine.search.return_value = [
+            {"index": 1, "title": "T", "link": "https://a.com", "snippet": "S", "source": "a.com", "date": ""}
+        ]
+        ai_processor = Mock()
+        ai_processor.generate_response_with_citations_stream.side_effect = lambda q, r, m: iter(["Warm ", "answer [1]"])
+        ai_processor.generate_follow_up_questions.return_value = []
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+        server = QueryServer(socket_path, search_engine, ai_processor)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            events = list(stream_query("q", socket_path, results=3))
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        deltas = [event['text'] for event in events if event['event'] == 'answer_delta']
+        self.assertEqual("".join(deltas), "Warm answer [1]")
+        search_engine.search.assert_any_call("q", 3)
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_health_request(self):
+        """Test that the daemon reports circuit breaker state for each backend"""
+        import threading
+        from daemon import QueryServer
+        from client import health
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+        server = QueryServer(socket_path, SearchEngine("fake_key"), AIProcessor("fake_key"), CacheManager(cache_dir=tempfile.mkdtemp()))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            report = health(socket_path)
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        self.assertEqual(report['event'], 'health')
+        self.assertEqual(report['backends']['serpapi']['state'], 'closed')
+        self.assertEqual(report['backends']['openai']['state'], 'closed')
+        self.assertIn('memory', report['cache'])
+    
+    def test_malformed_requests_get_an_error_event(self):
+        """Test that a request line that is not a JSON object is answered rather than dropped"""
+        import socket
+        import threading
+        from daemon import QueryServer
+        
+        socket_path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+        server = QueryServer(socket_path, Mock(), Mock())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            for line in (b'[1]\n', b'"q"\n', b'not json\n', b'{}\n'):
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(socket_path)
+                    sock.sendall(line)
+                    reply = json.loads(sock.makefile('rb').readline())
+                self.assertEqual((reply['event'], reply['stage']), ('error', 'request'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class TestBenchmarkBackend(unittest.TestCase):
+    def test_real_clients_against_fake_servers(self):
+        """Test that the benchmark's fake SerpAPI/OpenAI servers speak what the real clients expect"""
+        from benchmarks.fake_servers import FakeBackend
+        
+        with FakeBackend(latency=0.0, jitter=0.0, token_delay=0.0, answer_tokens=17) as backend:
+            search_engine = SearchEngine("fake_key", base_url=backend.serpapi_url)
+            ai_processor = AIProcessor("fake_key", base_url=backend.openai_url)
+            try:
+                result = answer_query("bloom filters", 3, "gpt-4o-mini", search_engine, ai_processor)
+            finally:
+                search_engine.close()
+            
+            self.assertEqual(len(result['search_results']), 3)
+            self.assertEqual(result['citations'], [1, 2])
+            self.assertEqual(len(result['follow_up_questions']), 3)
+            self.assertEqual(backend.requests, {'search': 1, 'completion': 1, 'stream': 1, 'error': 0})
+            
+            backend.error_rate = 1.0
+            with self.assertRaises(Exception):
+                search_engine.search("bloom filters", 3)
+
+class TestStartup(unittest.TestCase):
+    """Guards the cold-start budget of scripted one-shot invocations"""
+    
+    IMPORT_TIME_BUDGET = 0.5  # seconds, generous to stay stable on slow machines
+    HEAVY_MODULES = ['openai', 'rich', 'requests', 'httpx', 'asyncio', 'numpy']
+    
+    def _run_python(self, code, cwd=None):
+        import subprocess
+        repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = {**os.environ, 'PYTHONPATH': repo_dir, 'SERPAPI_KEY': 'fake', 'OPENAI_API_KEY': 'fake'}
+        completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=cwd or repo_dir, env=env)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    
+    def test_import_is_lightweight(self):
+        """Test that importing the CLI loads no heavy dependencies and stays within budget"""
+        report = self._run_python(
+            "import sys, json, time\n"
+            "start = time.perf_counter()\n"
+            "import cli\n"
+            "elapsed = time.perf_counter() - start\n"
+            f"print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {self.HEAVY_MODULES!r} if m in sys.modules]}}))"
+        )
+        
+        self.assertEqual(report['loaded'], [])
+        self.assertLess(report['elapsed'], self.IMPORT_TIME_BUDGET)
+    
+    def test_fully_cached_query_skips_clients(self):
+        """Test that a fully cached query never imports the API clients"""
+        report = self._run_python(
+            "import sys, json, io, contextlib\n"
+            "import cli\n"
+            "from cache_manager import CacheManager\n"
+            "from search_engine import SearchEngine\n"
+            "cache = CacheManager()\n"
+            "params = SearchEngine('fake').cache_params('test query', 5)\n"
+            "results = [{'index': 1, 'title': 'T', 'link': 'https://a.com', 'snippet': 'S', 'source': 'a.com', 'date': ''}]\n"
+            "cache.set('test query', 'search', results, params)\n"
+            "cache.set('test query', 'ai_response', {'response': 'A [1]', 'model': 'gpt-4o-mini', 'follow_up_questions': []}, {**params, 'model': 'gpt-4o-mini'})\n"
+            "with contextlib.redirect_stdout(io.StringIO()) as out:\n"
+            "    cli.main(['-q', 'test query', '--output', 'json'], standalone_mode=False)\n"
+            "print(json.dumps({'answer': json.loads(out.getvalue())['answer'], 'loaded': [m for m in ('openai', 'requests', 'rich') if m in sys.modules]}))",
+            cwd=tempfile.mkdtemp()
+        )
+        
+        self.assertEqual(report['answer'], 'A [1]')
+        self.assertEqual(report['loaded'], [])
 
 class TestIntegration(unittest.TestCase):
     @patch('subprocess.run')
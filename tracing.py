@@ -0,0 +1,175 @@
+"""Lightweight timing spans for profiling where a query's time goes"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Any, Callable, List, Optional
+
+# The tracer spans are recorded into; None (the default) makes span() a no-op
+_active = None
+_NULL_SPAN = nullcontext()
+
+class Span:
+    """Context manager timing one stage on the current thread"""
+    
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+    
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter(), **self.attrs)
+
+class Tracer:
+    """
+    Collects spans from every thread as (name, start, end, thread, attrs), with
+    times from time.perf_counter(). Spans may overlap: stages run concurrently.
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+    
+    def span(self, name: str, **attrs) -> Span:
+        return Span(self, name, attrs)
+    
+    def record(self, name: str, start: float, end: float, **attrs) -> None:
+        """Record a span measured by the caller"""
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+            self.spans.append({'name': name, 'start': start, 'end': end, 'tid': thread.ident, 'attrs': attrs})
+    
+    def count(self, name: str, amount: float = 1) -> None:
+        """Add to a named total reported alongside the stages (e.g. tokens saved)"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def summary(self) -> List[Dict[str, Any]]:
+        """Per-stage count, total, mean and max seconds, in order of first occurrence"""
+        stages = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s['start'])
+        for span in spans:
+            duration = span['end'] - span['start']
+            stage = stages.setdefault(span['name'], {'name': span['name'], 'count': 0, 'total': 0.0, 'max': 0.0})
+            stage['count'] += 1
+            stage['total'] += duration
+            stage['max'] = max(stage['max'], duration)
+        for stage in stages.values():
+            stage['mean'] = stage['total'] / stage['count']
+        return list(stages.values())
+    
+    def wall_time(self) -> float:
+        """Seconds from the tracer's start to the end of the last span"""
+        with self._lock:
+            return max((span['end'] for span in self.spans), default=self.started) - self.started
+    
+    def format_breakdown(self) -> str:
+        """Plain-text table of summary(); totals of concurrent stages overlap"""
+        lines = [
+            f"Profile ({self.wall_time() * 1000:.1f}ms wall)",
+            f"{'stage':<24}{'count':>7}{'total':>12}{'mean':>12}{'max':>12}"
+        ]
+        for stage in self.summary():
+            lines.append(
+                f"{stage['name']:<24}{stage['count']:>7}{stage['total'] * 1000:>10.1f}ms"
+                f"{stage['mean'] * 1000:>10.1f}ms{stage['max'] * 1000:>10.1f}ms"
+            )
+        with self._lock:
+            counters = dict(self.counters)
+        for name, total in counters.items():
+            lines.append(f"{name:<24}{total:>19}")
+        return "\n".join(lines)
+    
+    def chrome_trace(self) -> Dict[str, Any]:
+        """The spans in Chrome trace event format, viewable in chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+            threads = dict(self._threads)
+        
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in threads.items()
+        ]
+        for span in spans:
+            events.append({
+                'name': span['name'],
+                'cat': 'perplexity',
+                'ph': 'X',
+                'ts': (span['start'] - self.started) * 1e6,
+                'dur': (span['end'] - span['start']) * 1e6,
+                'pid': pid,
+                'tid': span['tid'],
+                'args': {key: _json_safe(value) for key, value in span['attrs'].items()}
+            })
+        with self._lock:
+            counters = dict(self.counters)
+        if counters:
+            events.append({'name': 'counters', 'ph': 'C', 'ts': self.wall_time() * 1e6, 'pid': pid, 'args': counters})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    
+    def export(self, path: str) -> None:
+        """Write chrome_trace() to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+def _json_safe(value: Any) -> Any:
+    return value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+
+def start_tracing() -> Tracer:
+    """Record spans from every thread into a new tracer until stop_tracing()"""
+    global _active
+    _active = Tracer()
+    return _active
+
+def stop_tracing() -> Optional[Tracer]:
+    global _active
+    tracer, _active = _active, None
+    return tracer
+
+def active_tracer() -> Optional[Tracer]:
+    return _active
+
+def span(name: str, **attrs):
+    """Time a stage if tracing is on; costs one global lookup when it is off"""
+    tracer = _active
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **attrs)
+
+def record(name: str, start: float, end: float, **attrs) -> None:
+    """Record a span measured with time.perf_counter(), if tracing is on"""
+    tracer = _active
+    if tracer is not None:
+        tracer.record(name, start, end, **attrs)
+
+def count(name: str, amount: float = 1) -> None:
+    """Add to a named total if tracing is on"""
+    tracer = _active
+    if tracer is not None:
+        tracer.count(name, amount)
+
+def traced(name: str) -> Callable:
+    """Decorator timing every call of a function as a span"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator